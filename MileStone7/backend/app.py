@@ -1,182 +1,350 @@
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request
 from flask_cors import CORS
 import psycopg2
 import re
 import logging
+import hashlib
+import hmac
+import threading
+import time
 from config import Config
+import db
+from db import connect_db, connect_replica
+from compression import dumps, init_compression, json_response
+from providers import ProviderError, get_provider_response
+import auth
+import breaker
+import capture
+import coalesce
+import deadline
+import hedge
+import metrics
+import pii
+import ratelimit
+import routing
+import scheduler
+import sessions
+import usage
+from deadline import DeadlineExceeded
+from ratelimit import RateLimited
+
+# Routes are registered on the app built by create_app()
+bp = Blueprint("gateway", __name__)
 
-app = Flask(__name__)
-app.config.from_object(Config)
-CORS(app)
-
-remembered_provider = None
-remembered_model = None
-file_response=None
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Database connection
-def connect_db():
-    try:
-        logger.debug("Attempting to connect to the database...")
-        return psycopg2.connect(Config.SQLALCHEMY_DATABASE_URI)
-    except psycopg2.Error as e:
-        logger.error(f"Database connection error: {e}")
+# Precomputed /models responses per tenant directory version; tenants without their own models or rules share one
+models_cache = {}
+models_cache_lock = threading.Lock()
+
+# Tenant of the request's API key; without auth, the tenant named by the X-Tenant header (default when absent)
+def current_tenant():
+    if "tenant_id" not in g:
+        g.tenant_id = routing.resolve_tenant(request.headers.get("X-Tenant"))
+    return g.tenant_id
+
+def tenant_error_response(e):
+    if isinstance(e, routing.UnknownTenant):
+        logger.warning(f"Unknown tenant: {e}")
+        return jsonify({"error": f"Unknown tenant: {e}"}), 404
+    logger.error("Database connection failed during tenant lookup")
+    return jsonify({"error": "Database connection failed"}), 500
+
+def auth_error_response(e):
+    logger.warning(f"Authentication failed: {e.message}")
+    response = jsonify({"error": e.message})
+    if e.status == 401:
+        response.headers["WWW-Authenticate"] = "Bearer"
+    return response, e.status
+
+# Read token from an earlier write (X-Read-Token), so admin reads after it never see older data
+def read_token():
+    return db.parse_token(request.headers.get("X-Read-Token"))
+
+bp.register_error_handler(auth.AuthError, auth_error_response)
+bp.register_error_handler(routing.UnknownTenant, tenant_error_response)
+bp.register_error_handler(routing.PoliciesUnavailable, tenant_error_response)
+
+# Build the deduplicated /models payload
+def build_models_body(model_names, rerouted_models):
+    if not model_names:
+        return None
+
+    result = []
+    seen = set()
+    for name in model_names:
+        provider, _, model_name = name.partition('/')
+        if (provider, model_name) not in seen:
+            seen.add((provider, model_name))
+            result.append({"provider": provider, "model": model_name})
+    seen = {entry["model"] for entry in result}
+
+    # Add rerouted models that are not already listed
+    for rerouted_model in rerouted_models:
+        if rerouted_model not in seen:
+            seen.add(rerouted_model)
+            result.append({"model": rerouted_model})
+
+    return dumps(result)
+
+# Return the cached /models body and ETag for the tenant, rebuilding it when the directory changed (None if the DB is down)
+def get_models_response(tenant_id):
+    directory = routing.get_directory()
+    if directory is None:
+        logger.error("Database connection failed during model fetch")
         return None
 
+    key = tenant_id if directory.customized(tenant_id) else None
+    with models_cache_lock:
+        cached = models_cache.get(key)
+        if cached is not None and cached[0] == directory.fingerprint:
+            return cached[1], cached[2]
+        if cached is None and len(models_cache) >= Config.TENANT_CACHE_SIZE:
+            models_cache.clear()
+
+        logger.debug(f"Rebuilding /models cache of tenant {tenant_id} for fingerprint {directory.fingerprint}")
+        body = build_models_body(directory.model_names(tenant_id), directory.policy_models.get(tenant_id, []))
+        etag = hashlib.sha256(body).hexdigest()[:32] if body else None
+        models_cache[key] = (directory.fingerprint, body, etag)
+        return body, etag
 
-    
 # Function to get available models and providers
-@app.route('/models', methods=['GET'])
+@bp.route('/models', methods=['GET'])
+@auth.require(auth.CHAT)
 def get_models():
     try:
-        conn = connect_db()
-        cur = conn.cursor()
-        if conn is None:
-            logger.error("Database connection failed during model fetch")
+        cached = get_models_response(current_tenant())
+        if cached is None:
             return jsonify({"error": "Database connection failed"}), 500
-
-        query = """
-            SELECT name FROM models;
-        """
-        cur.execute(query)
-        models = cur.fetchall()
-
-        if not models:
+        body, etag = cached
+        if body is None:
             logger.info("No models found")
             return jsonify({"error": "No models found"}), 404
 
-        # Query to fetch models that are part of routing policies (model_name)
-        rerouted_query = """
-            SELECT model_name FROM routing_policies;
-        """
-        cur.execute(rerouted_query)
-        rerouted_models = cur.fetchall()
-
-        # Prepare the result with provider and models (name[0] for provider, name[1] for model)
-        result = []
-
-        for model in models:
-            provider = model[0].split('/')[0]  # Extract provider from the name
-            model_name = model[0].split('/')[1]  # Extract model from the name
-            result.append({"provider": provider, "model": model_name})
-
-        # Add rerouted models to the list
-        for rerouted_model in rerouted_models:
-            result.append({"model": rerouted_model[0]})
-
-        return jsonify(result)
+        # With auth on, the tenant comes from the API key, so shared caches must not reuse the body across keys
+        if Config.AUTH_ENABLED:
+            headers = {"Cache-Control": f"private, max-age={Config.MODELS_MAX_AGE}", "Vary": "X-Tenant, X-API-Key, Authorization"}
+        else:
+            headers = {"Cache-Control": f"public, max-age={Config.MODELS_MAX_AGE}", "Vary": "X-Tenant"}
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(body, mimetype="application/json", headers=headers)
+        response.set_etag(etag)
+        return response
+    except (routing.UnknownTenant, routing.PoliciesUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error fetching models: {e}")
         return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
-# Function to check if prompt matches any regex pattern
-def match_prompt_with_policy(model, prompt):
-    conn = connect_db()
-    if conn is None:
-        logger.error("Database connection failed during regex match check")
-        return None, None
 
-    try:
-        cur = conn.cursor()
-        query = "SELECT regex_pattern, redirect_model FROM routing_policies WHERE model_name = %s;"
-        cur.execute(query, (model,))
-        policies = cur.fetchall()
-        logger.debug(f"Retrieved routing policies for model {model}: {policies}")
-
-        # Check each policy if the prompt matches
-        for policy in policies:
-            regex_pattern = policy[0]
-            redirect_model = policy[1]
-            logger.debug(f"Checking prompt: {prompt} against regex pattern: {regex_pattern}")
-            
-            if re.search(regex_pattern, prompt):
-                logger.debug(f"Prompt matched regex pattern: {regex_pattern}")
-                
-                # Fetch all models that match the redirect_model
-                provider_query = "SELECT name FROM models WHERE name LIKE %s;"
-                cur.execute(provider_query, (f"%{redirect_model}%",))
-                models = cur.fetchall()
-
-                # Loop through all models and find the matching one
-                for model_name in models:
-                    model_name = model_name[0]
-                    logger.debug(f"Checking model: {model_name}")
-                    if redirect_model in model_name:
-                        provider = model_name.split("/")[0]  # Extract provider from model name
-                        logger.debug(f"Redirecting to model: {redirect_model} with provider: {provider}")
-                        return redirect_model, provider  # Return redirect model and its provider
-                        
-        logger.debug("No matching routing policy found.")
-        return None, None  # No match found
-    except psycopg2.Error as e:
-        logger.error(f"Error checking regex match: {e}")
+# Function to check if prompt matches any of the tenant's routing policies (regex, semantic or PII)
+def match_prompt_with_policy(tenant_id, model, prompt, findings=None):
+    snapshot = routing.get_snapshot(tenant_id)
+    if snapshot is None:
+        logger.error("Routing policies unavailable during regex match check")
         return None, None
-    finally:
-        conn.close()
+    return snapshot.match(model, prompt, findings)
 
-# Function to validate the provider and model
-def validate_provider_and_model(provider, model):
-    conn = connect_db()
-    if conn is None:
+# Sensitive data in the prompt and uploaded text file, scanned once per request and only when the
+# tenant has PII rules (redirect or redact) for the model
+def detect_sensitive_data(tenant_id, model, prompt, file):
+    snapshot = routing.get_snapshot(tenant_id)
+    if snapshot is None or not snapshot.scans_pii(model):
+        return None
+    with metrics.stage(g.stages, "pii"):
+        findings = pii.scan_request(prompt, file)
+    if findings.kinds:
+        g.request_info["pii"] = sorted(findings.kinds)
+    return findings
+
+# The prompt with the spans of the tenant's redact rules for `model` masked; the spans of PII rules
+# come from `findings`, so nothing is scanned twice
+def redact_prompt(tenant_id, model, prompt, findings):
+    snapshot = routing.get_snapshot(tenant_id)
+    if snapshot is None or not snapshot.redacts(model):
+        return prompt
+    with metrics.stage(g.stages, "redact"):
+        spans = snapshot.redaction_spans(model, prompt, findings)
+        if not spans:
+            return prompt
+        g.request_info["redacted"] = len(spans)
+        redacted = routing.redact(prompt, spans)
+    # Capture and usage see the prompt as sent, so masked text never reaches the capture log
+    g.request_info["prompt"] = redacted
+    return redacted
+
+# Function to validate the provider and model against the tenant's models
+def validate_provider_and_model(tenant_id, provider, model):
+    directory = routing.get_directory()
+    if directory is None:
         logger.error("Database connection failed during validation")
         return False
-
-    try:
-        cur = conn.cursor()
-        query = "SELECT name FROM models WHERE name = %s;"
-        cur.execute(query, (f"{provider}/{model}",))
-        result = cur.fetchone()
-        logger.debug(f"Validation query: {query} | Result: {result}")
-        cur.close()
-        return result is not None
-    except psycopg2.Error as e:
-        logger.error(f"Error validating provider/model: {e}")
-        return False
-    finally:
-        conn.close()
-
-# Function to get provider's response
-def get_provider_response(provider, model, prompt):
-    provider_stubs = {
-        "openai": lambda prompt: {
-            "provider": "openai",
-            "model": "gpt-3.5",
-            "response": f"OpenAI: Processed your prompt with advanced language understanding. Response ID: openai_response_001"
-        },
-        "anthropic": lambda prompt: {
-            "provider": "anthropic",
-            "model": "claude-v1",
-            "response": f"Anthropic: Your prompt has been interpreted with ethical AI principles. Response ID: anthropic_response_002"
-        },
-        "gemini": lambda prompt: {
-            "provider": "gemini",
-            "model": "gemini-alpha",
-            "response": f"Gemini: Your prompt has been processed with cutting-edge AI capabilities. Response ID: gemini_response_003"
-        }
+    return directory.has_model(tenant_id, f"{provider}/{model}")
+
+# Whether the model's deployments (or the provider, for a model without any) are accepting traffic
+def model_available(provider, model):
+    pool = routing.get_pool(provider, model)
+    return pool.available() if pool is not None else breaker.available(provider)
+
+# Call one model: a deployment picked from its pool, failing over to the others, or else the provider's endpoint.
+# Slow calls are hedged (see hedge.py), to another deployment of the pool when there is one.
+def call_model(provider, model, prompt, history=None):
+    def call(deployment):
+        return get_provider_response(provider, model, prompt, timeout=deadline.remaining(), history=history,
+                                     deployment=deployment)
+
+    pool = routing.get_pool(provider, model)
+    if pool is None:
+        return hedge.run(call, provider)
+    last_error = ProviderError(f"{provider}/{model}: no deployment available")
+    tried = []
+    deployment = pool.pick()
+    while deployment is not None:
+        deadline.check("provider")
+        try:
+            return hedge.run(call, deployment.key, deployment, lambda: pool.pick(tried + [deployment]) or deployment)
+        except ProviderError as e:
+            logger.warning(f"Deployment {deployment.key} failed: {e}")
+            metrics.incr("routing.deployment_failovers")
+            last_error = e
+            tried.append(deployment)
+            deployment = pool.pick(tried)
+    raise last_error
+
+# Call the provider, moving down the model's fallback list while it is degraded or failing.
+# The calls wait their turn in the dispatch scheduler first.
+def dispatch_with_fallback(provider, model, prompt, history=None):
+    with scheduler.slot(g.request_class, g.flow):
+        deadline.check("provider")
+        if model_available(provider, model):
+            try:
+                return call_model(provider, model, prompt, history)
+            except ProviderError as e:
+                logger.warning(f"Provider {provider} failed for {model}: {e}")
+                last_error = e
+        else:
+            logger.info(f"Provider {provider} is degraded, trying fallbacks for {model}")
+            last_error = ProviderError(f"{provider}: circuit open")
+
+        for fallback_provider, fallback_model in routing.get_fallbacks(model):
+            if not model_available(fallback_provider, fallback_model):
+                continue
+            deadline.check("provider")
+            try:
+                response = call_model(fallback_provider, fallback_model, prompt, history)
+            except ProviderError as e:
+                logger.warning(f"Fallback {fallback_provider}/{fallback_model} failed: {e}")
+                last_error = e
+                continue
+            logger.info(f"Served {model} from fallback {fallback_provider}/{fallback_model}")
+            metrics.incr("routing.fallbacks")
+            return response
+
+        deadline.check("provider")
+        raise last_error
+
+# Fail a request whose time budget ran out with 504, naming the stage it was in
+def deadline_exceeded_response(e):
+    return jsonify({"error": str(e), "stage": e.stage, "budget_ms": e.budget_ms}), 504
+
+# Reject an over-limit request with 429 and a Retry-After hint
+def rate_limited_response(e):
+    logger.warning(f"Rate limited: {e.reason}")
+    response = jsonify({"error": e.reason})
+    response.headers["Retry-After"] = ratelimit.retry_after_header(e.retry_after)
+    return response, 429
+
+# Whether the request was sent by replay_traffic.py, which proves it with CAPTURE_REPLAY_SECRET
+def is_replay():
+    value = request.headers.get("X-Replay")
+    secret = Config.CAPTURE_REPLAY_SECRET
+    return bool(value and secret) and hmac.compare_digest(value.encode(), secret.encode())
+
+# Append a sampled record of the finished request to the capture log
+def capture_request(response):
+    if is_replay() or not capture.sampled():
+        return
+    info = g.request_info
+    # The tenant the request was served as (from its API key when auth is on), not the header it sent
+    tenant_id = g.get("tenant_id")
+    entry = {
+        "ts": g.started_at,
+        "tenant": routing.tenant_name(tenant_id) if tenant_id is not None else None,
+        "tenant_id": tenant_id,
+        "provider": info.get("requested_provider"),
+        "model": info.get("requested_model"),
+        "resolved_provider": info.get("provider"),
+        "resolved_model": info.get("model"),
+        "redirected": info.get("redirected", False),
+        "file_routed": info.get("file_routed", False),
+        "priority": info.get("priority"),
+        "status": response.status_code,
+        "stages_ms": g.stages,
     }
-
-    logger.debug(f"Received provider: {provider}, model: {model}, prompt: {prompt}")
-
-    if provider in provider_stubs:
-        response = provider_stubs[provider](prompt)
-        logger.debug(f"Generated response: {response}")
-        return response
-    else:
-        logger.error(f"Unsupported provider/model combination: {provider}/{model}")
-        return None
-
-@app.route('/v1/chat/completions', methods=['POST'])
+    if info.get("prompt") is not None:
+        entry.update(capture.prompt_fields(info["prompt"]))
+    file = info.get("file")
+    if file:
+        file.stream.seek(0, 2)
+        entry["file"] = {"name": file.filename, "content_type": file.mimetype, "size": file.stream.tell()}
+        file.stream.seek(0)
+    capture.record(entry)
+
+# Queue the request's usage record for the background flusher
+def record_usage(response):
+    if not Config.USAGE_ENABLED:
+        return
+    info = g.request_info
+    usage.record({
+        "created_at": usage.now(),
+        "requested_provider": info.get("requested_provider"),
+        "requested_model": info.get("requested_model"),
+        "provider": info.get("provider") or info.get("requested_provider"),
+        "model": info.get("model") or info.get("requested_model"),
+        "redirected": info.get("redirected", False),
+        "has_file": bool(info.get("file")),
+        "prompt_chars": len(info.get("prompt") or ""),
+        "response_chars": info.get("response_chars", 0),
+        "latency_ms": g.stages["total"],
+        "status": response.status_code,
+    })
+
+@bp.route('/v1/chat/completions', methods=['POST'])
+@auth.require(auth.CHAT)
 def chat_completions():
+    g.started_at = time.time()
+    g.stages = {}
+    g.request_info = {}
+    try:
+        with deadline.scope(deadline.budget_from_header(request.headers.get("X-Request-Timeout-Ms"))):
+            current_tenant()
+            ratelimit.check_client(f"key:{g.api_key.id}" if "api_key" in g else request.remote_addr)
+            g.request_class = scheduler.request_class(request.headers.get("X-Priority"))
+            g.flow = scheduler.flow_id(g.get("api_key"), g.tenant_id)
+            g.request_info["priority"] = g.request_class
+            with ratelimit.admission(batch=g.request_class == scheduler.BATCH):
+                response = handle_chat_completion()
+    except RateLimited as e:
+        response = rate_limited_response(e)
+    except DeadlineExceeded as e:
+        response = deadline_exceeded_response(e)
+    except (routing.UnknownTenant, routing.PoliciesUnavailable) as e:
+        response = tenant_error_response(e)
+    response = current_app.make_response(response)
+    g.stages["total"] = round((time.time() - g.started_at) * 1000, 3)
+    capture_request(response)
+    record_usage(response)
+    return response
+
+def handle_chat_completion():
     try:
         # Parse the JSON request body
         provider = request.form.get("provider")
         model = request.form.get("model")
         prompt = request.form.get("prompt")
         file = request.files.get("file") 
+        g.request_info.update(requested_provider=provider, requested_model=model, prompt=prompt, file=file)
 
         # Log the incoming request
         logger.debug(f"Request received: provider={provider}, model={model}, prompt={prompt}")
@@ -185,56 +353,245 @@ def chat_completions():
         if not provider or not model or not prompt:
             logger.warning("Missing required parameters")
             return jsonify({"error": "Missing required parameters"}), 400
-        
-        # Check if prompt matches any routing policies
-        redirect_model, redirect_provider = match_prompt_with_policy(model, prompt)
-        
-        if redirect_model:
-            logger.info(f"Prompt matched a regex pattern. Redirecting request to model: {redirect_model}")
-            model = redirect_model  # Reroute to the new model
-            provider = redirect_provider
-            
-        # Now validate the provider and model after rerouting
-        if not validate_provider_and_model(provider, model):
-            logger.warning(f"Invalid provider/model combination: {provider}/{model}")
-            return jsonify({"error": "Invalid provider/model combination"}), 400
-        
-        # Get provider's response
-        response = get_provider_response(provider, model, prompt)
-       
-        if response is None:
-            logger.warning("No response generated")
-            return jsonify({"error": "Unsupported provider/model combination"}), 400
-        logger.debug(f"Remembered model : {remembered_model}")
-        logger.debug(f"Remembered Provider : {remembered_provider}")
-        if (remembered_provider and remembered_model):
-            file_response = get_provider_response(remembered_provider, remembered_model, prompt)
-            response_data = {
-                "response": response,
-                "File Processed": bool(file),
-                "File_response": file_response,
-            }
-        else:
-            response_data = {
-                "response": response,
-                "File Processed": bool(file)
-            }
-        logger.debug(f"{response_data}")
-        return jsonify(response_data)
 
+        # Turns of one session run one at a time so history and routing state stay consistent
+        session_id = request.form.get("session_id")
+        if session_id:
+            session = sessions.get(session_id, g.tenant_id)
+            if session is None:
+                logger.warning(f"Unknown session: {session_id}")
+                return jsonify({"error": "Unknown session"}), 404
+            timeout = deadline.remaining()
+            if not session.lock.acquire(timeout=-1 if timeout is None else timeout):
+                deadline.fail("session")
+            try:
+                return complete_prompt(provider, model, prompt, file, session)
+            finally:
+                session.lock.release()
+        return complete_prompt(provider, model, prompt, file, None)
+
+    except (RateLimited, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error(f"Error processing chat completion: {e}")
         return jsonify({"error": "Internal server error"}), 500
-    
-@app.route('/regex-rules', methods=['GET'])
+
+# Route one session turn: only the new prompt is scanned, and a redirect triggered by an earlier turn sticks
+def route_session_turn(session, model, prompt, findings):
+    if session.checked_model != model:
+        # New session or a model switch: the retained turns were not checked against this model's rules
+        session.checked_model = model
+        session.redirect = None
+        for earlier_prompt in session.user_turns():
+            redirect = match_prompt_with_policy(session.tenant_id, model, earlier_prompt)
+            if redirect[0]:
+                session.redirect = redirect
+                break
+    if session.redirect is not None:
+        metrics.incr("sessions.sticky_redirects")
+        return session.redirect
+    redirect = match_prompt_with_policy(session.tenant_id, model, prompt, findings)
+    if redirect[0]:
+        session.redirect = redirect
+    return redirect
+
+# Route, validate and dispatch one prompt (a session turn when `session` is set)
+def complete_prompt(provider, model, prompt, file, session):
+    findings = detect_sensitive_data(g.tenant_id, model, prompt, file)
+
+    # Check if prompt matches any routing policies
+    with metrics.stage(g.stages, "routing"):
+        if session is not None:
+            redirect_model, redirect_provider = route_session_turn(session, model, prompt, findings)
+        else:
+            redirect_model, redirect_provider = match_prompt_with_policy(g.tenant_id, model, prompt, findings)
+    deadline.check("routing")
+    prompt = redact_prompt(g.tenant_id, model, prompt, findings)
+
+    if redirect_model:
+        logger.info(f"Prompt matched a regex pattern. Redirecting request to model: {redirect_model}")
+        model = redirect_model  # Reroute to the new model
+        provider = redirect_provider
+    g.request_info.update(provider=provider, model=model, redirected=bool(redirect_model))
+
+    # Now validate the provider and model after rerouting
+    with metrics.stage(g.stages, "validation"):
+        valid = validate_provider_and_model(g.tenant_id, provider, model)
+    if not valid:
+        logger.warning(f"Invalid provider/model combination: {provider}/{model}")
+        return jsonify({"error": "Invalid provider/model combination"}), 400
+
+    ratelimit.check_provider(provider)
+
+    # Get provider's response; session turns carry their history, so they are never coalesced
+    history = session.context() if session is not None else None
+    try:
+        with metrics.stage(g.stages, "provider"):
+            if history:
+                response = dispatch_with_fallback(provider, model, prompt, history)
+            else:
+                response = coalesce.run(g.tenant_id, provider, model, prompt, lambda: dispatch_with_fallback(provider, model, prompt))
+    except ProviderError as e:
+        logger.error(f"Upstream provider error: {e}")
+        return jsonify({"error": "Upstream provider error"}), 502
+
+    if response is None:
+        logger.warning("No response generated")
+        return jsonify({"error": "Unsupported provider/model combination"}), 400
+    file_route = routing.get_file_route(g.tenant_id)
+    logger.debug(f"File routing target : {file_route}")
+    if file_route:
+        file_model, file_provider = file_route
+        g.request_info["file_routed"] = True
+        try:
+            with metrics.stage(g.stages, "file_provider"):
+                if history:
+                    file_response = dispatch_with_fallback(file_provider, file_model, prompt, history)
+                else:
+                    file_response = coalesce.run(
+                        g.tenant_id, file_provider, file_model, prompt,
+                        lambda: dispatch_with_fallback(file_provider, file_model, prompt)
+                    )
+        except ProviderError as e:
+            logger.error(f"Upstream provider error for file routing: {e}")
+            return jsonify({"error": "Upstream provider error"}), 502
+        response_data = {
+            "response": response,
+            "File Processed": bool(file),
+            "File_response": file_response,
+        }
+    else:
+        response_data = {
+            "response": response,
+            "File Processed": bool(file)
+        }
+    if session is not None:
+        session.append(prompt, str(response.get("response", "")))
+        response_data["session_id"] = session.id
+    g.request_info["response_chars"] = sum(
+        len(str(part.get("response", ""))) for part in (response, response_data.get("File_response"))
+        if isinstance(part, dict)
+    )
+    logger.debug(f"{response_data}")
+    return json_response(response_data)
+
+# Start a server-side conversation; pass its session_id with each chat turn instead of resending history
+@bp.route("/sessions", methods=["POST"])
+@auth.require(auth.CHAT)
+def create_session():
+    try:
+        session = sessions.create(current_tenant())
+    except psycopg2.Error as e:
+        logger.error(f"Error creating session: {e}")
+        return jsonify({"error": "Database connection failed"}), 500
+    return jsonify({"session_id": session.id}), 201
+
+@bp.route("/sessions/<session_id>", methods=["GET"])
+@auth.require(auth.CHAT)
+def get_session(session_id):
+    try:
+        session = sessions.get(session_id, current_tenant())
+    except psycopg2.Error as e:
+        logger.error(f"Error loading session: {e}")
+        return jsonify({"error": "Database connection failed"}), 500
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return json_response(session.describe())
+
+@bp.route("/sessions/<session_id>", methods=["DELETE"])
+@auth.require(auth.CHAT)
+def delete_session(session_id):
+    try:
+        deleted = sessions.delete(session_id, current_tenant())
+    except psycopg2.Error as e:
+        logger.error(f"Error deleting session: {e}")
+        return jsonify({"error": "Database connection failed"}), 500
+    if not deleted:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"message": "Session deleted successfully"})
+
+# Current routing policy version of the tenant, bumped by every rule add/delete
+def get_rules_version(cursor, tenant_id):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM routing_policy_changes WHERE tenant_id = %s;", (tenant_id,))
+    return cursor.fetchone()[0]
+
+# Record a rule change in the change log and return the new version
+def record_rule_change(cursor, tenant_id, rule_id, op):
+    cursor.execute(
+        "INSERT INTO routing_policy_changes (tenant_id, rule_id, op) VALUES (%s, %s, %s) RETURNING version;",
+        (tenant_id, rule_id, op)
+    )
+    return cursor.fetchone()[0]
+
+@bp.route('/regex-rules', methods=['GET'])
+@auth.require(auth.ADMIN)
 def get_regex_rules():
-    conn = connect_db()
+    tenant_id = current_tenant()
+    model_name = request.args.get("model_name")
+    redirect_model = request.args.get("redirect_model")
+    after = request.args.get("after", type=int)
+    since = request.args.get("since", type=int)
+    limit = min(request.args.get("limit", Config.RULES_PAGE_SIZE, type=int), Config.RULES_MAX_PAGE_SIZE)
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    conn = connect_replica(read_token())
+    if conn is None:
+        logger.error("Database connection failed during rule fetch")
+        return jsonify({"error": "Database connection failed"}), 500
     cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT id, model_name, regex_pattern, redirect_model FROM routing_policies;")
-        rules = cursor.fetchall()
-        return jsonify(rules)
+        # The ETag covers the rule set version and the query, so unchanged pages short-circuit
+        version = get_rules_version(cursor, tenant_id)
+        etag = f"rules-{tenant_id}-{version}-{hashlib.sha1(request.query_string).hexdigest()[:12]}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        filters = ["tenant_id = %s"]
+        params = [tenant_id]
+        if model_name:
+            filters.append("model_name = %s")
+            params.append(model_name)
+        if redirect_model:
+            filters.append("redirect_model = %s")
+            params.append(redirect_model)
+
+        if since is not None:
+            # Delta feed: rules touched after `since`, split into upserts and deletes
+            cursor.execute(
+                "SELECT DISTINCT rule_id FROM routing_policy_changes WHERE tenant_id = %s AND version > %s;",
+                (tenant_id, since)
+            )
+            changed_ids = [row[0] for row in cursor.fetchall()]
+            upserts = []
+            existing = set()
+            if changed_ids:
+                id_list = ", ".join(["%s"] * len(changed_ids))
+                query = f"SELECT id, model_name, regex_pattern, redirect_model, rule_type, similarity_threshold, priority, action FROM routing_policies WHERE id IN ({id_list})"
+                cursor.execute(query + "".join(f" AND {f}" for f in filters) + " ORDER BY id;",
+                               changed_ids + params)
+                upserts = cursor.fetchall()
+                cursor.execute(f"SELECT id FROM routing_policies WHERE id IN ({id_list});", changed_ids)
+                existing = {row[0] for row in cursor.fetchall()}
+            deletes = [rule_id for rule_id in changed_ids if rule_id not in existing]
+            response = json_response({"version": version, "upserts": upserts, "deletes": deletes})
+        else:
+            # Keyset pagination on id so deep pages stay as cheap as the first one
+            if after is not None:
+                filters.append("id > %s")
+                params.append(after)
+            query = "SELECT id, model_name, regex_pattern, redirect_model, rule_type, similarity_threshold, priority, action FROM routing_policies"
+            query += " WHERE " + " AND ".join(filters)
+            cursor.execute(query + " ORDER BY id LIMIT %s;", params + [limit])
+            rules = cursor.fetchall()
+            next_after = rules[-1][0] if len(rules) == limit else None
+            response = json_response({"version": version, "rules": rules, "next_after": next_after})
+
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -242,40 +599,96 @@ def get_regex_rules():
         conn.close()
 
 # Add new regex rule (with validation)
-@app.route('/regex-rules', methods=['POST'])
+@bp.route('/regex-rules', methods=['POST'])
+@auth.require(auth.ADMIN)
 def add_regex_rule():
+    tenant_id = current_tenant()
     data = request.json
     regex_pattern = data.get("pattern")
     model_name = data.get("originalModel")
     redirect_model = data.get("redirectModel")
-
-    if not regex_pattern or not model_name or not redirect_model:
+    rule_type = data.get("type", routing.REGEX)
+    action = data.get("action") or routing.REDIRECT
+    exemplars = [phrase.strip() for phrase in data.get("exemplars") or [] if phrase.strip()]
+    threshold = data.get("threshold")
+    try:
+        priority = int(data.get("priority") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "priority must be an integer"}), 400
+
+    if rule_type not in routing.RULE_TYPES:
+        return jsonify({"error": f"Unknown rule type: {rule_type}"}), 400
+    if action not in routing.ACTIONS:
+        return jsonify({"error": f"Unknown rule action: {action}"}), 400
+    if action == routing.REDACT and rule_type == routing.SEMANTIC:
+        return jsonify({"error": "Semantic rules cannot redact, they match no spans"}), 400
+    if rule_type == routing.SEMANTIC:
+        regex_pattern = regex_pattern or ""
+        if not exemplars:
+            return jsonify({"error": "Semantic rules need at least one exemplar phrase"}), 400
+        try:
+            threshold = float(threshold) if threshold not in (None, "") else Config.SEMANTIC_DEFAULT_THRESHOLD
+        except (TypeError, ValueError):
+            return jsonify({"error": "threshold must be a number"}), 400
+        if not -1.0 <= threshold <= 1.0:
+            return jsonify({"error": "threshold must be between -1 and 1"}), 400
+    elif rule_type == routing.PII:
+        # The pattern names the sensitive-data kinds the rule fires on; empty means any
+        threshold = None
+        kinds = [kind.strip() for kind in (regex_pattern or "").split(",") if kind.strip()]
+        unknown = sorted(set(kinds) - set(pii.KINDS))
+        if unknown:
+            return jsonify({"error": f"Unknown PII kinds: {', '.join(unknown)} (expected {', '.join(pii.KINDS)})"}), 400
+        regex_pattern = ",".join(kinds)
+    else:
+        threshold = None
+        if regex_pattern:
+            try:
+                re.compile(regex_pattern)
+            except re.error as e:
+                return jsonify({"error": f"Invalid regex pattern: {e}"}), 400
+
+    if action == routing.REDACT:
+        redirect_model = ""  # the prompt keeps its model
+    if (rule_type == routing.REGEX and not regex_pattern) or not model_name or (action == routing.REDIRECT and not redirect_model):
         return jsonify({"error": "All fields are required"}), 400
 
     # Extract model name after '/'
     redirect_name = redirect_model.split("/")[-1]  # Extract last part
 
     conn = connect_db()
+    if conn is None:
+        logger.error("Database connection failed during rule insert")
+        return jsonify({"error": "Database connection failed"}), 500
     cursor = conn.cursor()
 
     try:
-        # Check if redirect_model exists in models table
-        cursor.execute("SELECT name FROM models")
+        # Check if redirect_model exists among the tenant's models
+        cursor.execute("SELECT name FROM models WHERE tenant_id IS NULL OR tenant_id = %s;", (tenant_id,))
         models= cursor.fetchall()
 
         # Extract the second part after '/'
         model_names = [name[0].split('/')[1] for name in models]
 
-        if redirect_model not in model_names:
+        if action == routing.REDIRECT and redirect_model not in model_names:
             return jsonify({"error": "Redirect model does not exist in models table"}), 400
 
         # Insert into routing_policies table
         cursor.execute(
-            "INSERT INTO routing_policies (model_name, regex_pattern, redirect_model) VALUES (%s, %s, %s) RETURNING id;",
-            (model_name, regex_pattern, redirect_model)
+            "INSERT INTO routing_policies (tenant_id, model_name, regex_pattern, redirect_model, rule_type, similarity_threshold, priority, action) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;",
+            (tenant_id, model_name, regex_pattern, redirect_model, rule_type, threshold, priority, action)
         )
+        rule_id = cursor.fetchone()[0]
+        if exemplars:
+            cursor.executemany(
+                "INSERT INTO routing_policy_exemplars (policy_id, phrase) VALUES (%s, %s);",
+                [(rule_id, phrase) for phrase in exemplars]
+            )
+        version = record_rule_change(cursor, tenant_id, rule_id, "insert")
         conn.commit()
-        return jsonify({"message": "Rule added successfully", "id": cursor.fetchone()[0]})
+        token = db.write_token(conn)  # before invalidating, so the recheck reads at least this write
+        routing.invalidate()
+        return jsonify({"message": "Rule added successfully", "id": rule_id, "version": version, "read_token": token})
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -284,20 +697,28 @@ def add_regex_rule():
         conn.close()
 
 # Delete regex rule
-@app.route('/regex-rules/<int:rule_id>', methods=['DELETE'])
+@bp.route('/regex-rules/<int:rule_id>', methods=['DELETE'])
+@auth.require(auth.ADMIN)
 def delete_regex_rule(rule_id):
+    tenant_id = current_tenant()
     conn = connect_db()
+    if conn is None:
+        logger.error("Database connection failed during rule delete")
+        return jsonify({"error": "Database connection failed"}), 500
     cursor = conn.cursor()
 
     try:
-        cursor.execute("DELETE FROM routing_policies WHERE id = %s RETURNING id;", (rule_id,))
+        cursor.execute("DELETE FROM routing_policies WHERE id = %s AND tenant_id = %s RETURNING id;", (rule_id, tenant_id))
         deleted_rule = cursor.fetchone()
 
         if not deleted_rule:
             return jsonify({"error": "Rule not found"}), 404
 
+        version = record_rule_change(cursor, tenant_id, rule_id, "delete")
         conn.commit()
-        return jsonify({"message": "Rule deleted successfully"})
+        token = db.write_token(conn)
+        routing.invalidate()
+        return jsonify({"message": "Rule deleted successfully", "version": version, "read_token": token})
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -306,29 +727,166 @@ def delete_regex_rule(rule_id):
         conn.close()
 
 
-# Endpoint to update the file upload routing model
-@app.route("/file-upload-routing", methods=["POST"])
+# Current file upload routing model of the tenant
+@bp.route("/file-upload-routing", methods=["GET"])
+@auth.require(auth.ADMIN)
+def get_file_upload_model():
+    file_route = routing.get_file_route(current_tenant(), read_token())
+    model, provider = file_route or (None, None)
+    return jsonify({"model": model, "provider": provider})
+
+# Endpoint to update the tenant's file upload routing model (an empty model clears it)
+@bp.route("/file-upload-routing", methods=["POST"])
+@auth.require(auth.ADMIN)
 def update_file_upload_model():
-    global remembered_model,remembered_provider
+    tenant_id = current_tenant()
     data = request.get_json()
     new_model_name = data.get("model")
     conn = connect_db()
+    if conn is None:
+        logger.error("Database connection failed during file routing update")
+        return jsonify({"error": "Database connection failed"}), 500
     cur = conn.cursor()
-    # Validate if the model exists in the `models` table
-    provider_query = "SELECT name FROM models;"
-    cur.execute(provider_query)
-    models = cur.fetchall()
-
-    # Loop through all models and find the matching one
-    for model_name in models:
-            model_name = model_name[0]
-            logger.debug(f"Checking model: {model_name}")
-            if new_model_name in model_name:
-                remembered_model = new_model_name
-                remembered_provider = model_name.split("/")[0]
-            logger.debug(f"Remembered model : {remembered_model}")
-            logger.debug(f"Remembered Provider : {remembered_provider}")
-    return jsonify({"message": "File upload model updated successfully!"})
+
+    try:
+        if not new_model_name:
+            cur.execute("DELETE FROM file_routing WHERE tenant_id = %s;", (tenant_id,))
+        else:
+            # Validate if the model exists among the tenant's models
+            cur.execute("SELECT name FROM models WHERE tenant_id IS NULL OR tenant_id = %s;", (tenant_id,))
+            provider = None
+            # Loop through all models and find the matching one
+            for (model_name,) in cur.fetchall():
+                logger.debug(f"Checking model: {model_name}")
+                if new_model_name in model_name:
+                    provider = model_name.split("/")[0]
+            logger.debug(f"File routing target of tenant {tenant_id}: {provider}/{new_model_name}")
+            if provider:
+                cur.execute("""
+                    INSERT INTO file_routing (tenant_id, model_name, provider) VALUES (%s, %s, %s)
+                    ON CONFLICT (tenant_id) DO UPDATE SET model_name = EXCLUDED.model_name, provider = EXCLUDED.provider;
+                """, (tenant_id, new_model_name, provider))
+        conn.commit()
+        token = db.write_token(conn)
+        routing.invalidate()
+        return jsonify({"message": "File upload model updated successfully!", "read_token": token})
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+# Rule evaluation order chosen by the planner, with the measurements behind it
+@bp.route("/routing-plan", methods=["GET"])
+@auth.require(auth.ADMIN)
+def get_routing_plan():
+    snapshot = routing.get_snapshot(current_tenant())
+    if snapshot is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    report = snapshot.plan_report()
+    model = request.args.get("model")
+    if model:
+        report = {model: report.get(model, [])}
+    return json_response(report)
+
+# Usage rollups per model (default) or per minute over the last `minutes`
+@bp.route("/usage", methods=["GET"])
+@auth.require(auth.ADMIN)
+def get_usage():
+    group = request.args.get("group", "model")
+    if group not in ("model", "minute"):
+        return jsonify({"error": "group must be 'model' or 'minute'"}), 400
+    minutes = request.args.get("minutes", 60, type=int)
+    try:
+        rows = usage.query_rollups(group, minutes, request.args.get("provider"), request.args.get("model"))
+    except psycopg2.Error as e:
+        logger.error(f"Error fetching usage: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+    if rows is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    return json_response({"group": group, "minutes": minutes, "usage": rows})
+
+# Counters, stage timings and provider breaker state
+@bp.route("/metrics", methods=["GET"])
+@auth.require(auth.ADMIN)
+def get_metrics():
+    return json_response(metrics.snapshot())
+
+# Warm-up state reported by /readyz
+startup = {"ready": False, "phases": {}, "error": None}
+startup_lock = threading.Lock()
+
+def run_phase(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    with startup_lock:
+        startup["phases"][name] = {"ms": round((time.perf_counter() - start) * 1000, 3), "result": result}
+    return result
+
+# Open the database pool, load the tenant directory and compile the busiest tenants' rules;
+# retried until the database answers, so a worker started during an outage becomes ready on its own
+def warm_up():
+    while True:
+        routing.invalidate()
+        if run_phase("pool", db.warm_pool) and run_phase("registry", lambda: routing.get_directory() is not None):
+            run_phase("policies", lambda: routing.preload(Config.PRELOAD_TENANTS))
+            with startup_lock:
+                startup["ready"] = True
+                startup["error"] = None
+            logger.info(f"Gateway ready: {startup['phases']}")
+            return
+        with startup_lock:
+            startup["error"] = "Database connection failed"
+        logger.error(f"Warm-up failed, retrying in {Config.STARTUP_RETRY_INTERVAL:g} s")
+        time.sleep(Config.STARTUP_RETRY_INTERVAL)
+
+# Liveness: the process is up and serving requests
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# Readiness from in-memory state only: warm-up done, database reachable, routing cache fresh and at
+# least one provider accepting traffic. The cache refresh behind it runs at most once per
+# POLICY_CACHE_CHECK_INTERVAL however often this is probed.
+@bp.route("/readyz", methods=["GET"])
+def readyz():
+    routing.get_directory()
+    with startup_lock:
+        warm_up_state = {"ok": startup["ready"], "phases": dict(startup["phases"]), "error": startup["error"]}
+    database = db.pool_status()
+    database["ok"] = database["connected"]
+    cache = routing.cache_status()
+    cache["ok"] = cache["age_s"] is not None and cache["age_s"] <= Config.READY_MAX_CACHE_AGE
+    breakers = breaker.snapshot()
+    providers = {"ok": not breakers or any(entry["state"] != "open" for entry in breakers.values()), "breakers": breakers}
+
+    checks = {"warm_up": warm_up_state, "database": database, "routing_cache": cache, "providers": providers}
+    ready = all(check["ok"] for check in checks.values())
+    return jsonify({"ready": ready, "checks": checks}), 200 if ready else 503
+
+def create_app(config=Config):
+    start = time.perf_counter()
+    logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper(), logging.INFO))
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    CORS(app, origins=config.CORS_ORIGINS,
+         allow_headers=["Content-Type", "Authorization", "X-API-Key", "X-Tenant", "X-Read-Token", "X-Priority"],
+         expose_headers=["ETag", "Retry-After"])
+    init_compression(app)
+    app.register_blueprint(bp)
+    with startup_lock:
+        startup["phases"]["config"] = {"ms": round((time.perf_counter() - start) * 1000, 3), "result": True}
+
+    # Requests are accepted right away; load balancers hold traffic back until /readyz turns 200
+    if config.STARTUP_WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        # Everything loads lazily on first use; readiness still waits on the database and routing cache checks
+        with startup_lock:
+            startup["ready"] = True
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5006)
+    create_app().run(debug=True, port=5006)
@@ -0,0 +1,183 @@
+import argparse
+import functools
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+from flask import g, request
+import metrics
+from config import Config
+from db import connect_db
+
+logger = logging.getLogger(__name__)
+
+CHAT = "chat"
+ADMIN = "admin"
+SCOPES = (CHAT, ADMIN)
+KEY_PREFIX = "ubk_"
+
+
+class AuthError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class ApiKey:
+    __slots__ = ("id", "tenant_id", "scopes")
+
+    def __init__(self, key_id, tenant_id, scopes):
+        self.id = key_id
+        self.tenant_id = tenant_id
+        self.scopes = frozenset(scopes)
+
+
+# Keys are random tokens, so one keyed hash is enough; the plaintext is never stored or cached
+def hash_key(raw_key):
+    return hmac.new(Config.API_KEY_PEPPER.encode(), raw_key.encode(), hashlib.sha256).hexdigest()
+
+def generate_key():
+    return KEY_PREFIX + secrets.token_urlsafe(32)
+
+
+# Verified keys by hash, as (expires_at, ApiKey or None); None entries are cached rejections
+key_cache = OrderedDict()
+key_cache_lock = threading.Lock()
+
+def cached_key(key_hash):
+    with key_cache_lock:
+        entry = key_cache.get(key_hash)
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            del key_cache[key_hash]
+            return False, None
+        key_cache.move_to_end(key_hash)
+        return True, entry[1]
+
+def cache_key(key_hash, api_key):
+    ttl = Config.AUTH_CACHE_TTL if api_key is not None else Config.AUTH_NEGATIVE_TTL
+    with key_cache_lock:
+        key_cache[key_hash] = (time.monotonic() + ttl, api_key)
+        key_cache.move_to_end(key_hash)
+        while len(key_cache) > Config.AUTH_CACHE_SIZE:
+            key_cache.popitem(last=False)
+
+def fetch_key(key_hash):
+    conn = connect_db()
+    if conn is None:
+        logger.error("Database connection failed during API key verification")
+        raise AuthError("Database connection failed", 500)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, tenant_id, scopes FROM api_keys WHERE key_hash = %s AND revoked_at IS NULL;", (key_hash,))
+        row = cur.fetchone()
+        return ApiKey(row[0], row[1], row[2].split(",")) if row else None
+    except psycopg2.Error as e:
+        logger.error(f"Error verifying API key: {e}")
+        raise AuthError("Internal server error", 500)
+    finally:
+        conn.close()
+
+# ApiKey for a presented key, or None; only cache misses reach the database
+def verify(raw_key):
+    key_hash = hash_key(raw_key)
+    hit, api_key = cached_key(key_hash)
+    if hit:
+        metrics.incr("auth.cache_hits")
+        return api_key
+    metrics.incr("auth.cache_misses")
+    api_key = fetch_key(key_hash)
+    cache_key(key_hash, api_key)
+    return api_key
+
+def presented_key():
+    header = request.headers.get("Authorization", "")
+    if header.lower().startswith("bearer "):
+        return header[7:].strip()
+    return request.headers.get("X-API-Key")
+
+# Authenticate the request for `scope`; the key's tenant becomes the request's tenant
+def authenticate(scope):
+    raw_key = presented_key()
+    if not raw_key:
+        raise AuthError("Missing API key", 401)
+    api_key = verify(raw_key)
+    if api_key is None:
+        metrics.incr("auth.rejected")
+        raise AuthError("Invalid API key", 401)
+    if scope not in api_key.scopes:
+        metrics.incr("auth.forbidden")
+        raise AuthError(f"API key lacks the '{scope}' scope", 403)
+    g.api_key = api_key
+    g.tenant_id = api_key.tenant_id
+    return api_key
+
+# Route decorator: require a key with `scope` when AUTH_ENABLED is set
+def require(scope):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if Config.AUTH_ENABLED:
+                authenticate(scope)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def cache_stats():
+    with key_cache_lock:
+        return {"cached_keys": len(key_cache), "capacity": Config.AUTH_CACHE_SIZE}
+
+metrics.register_collector("auth", cache_stats)
+
+
+# Issue and revoke keys from the command line
+#
+#   python auth.py create --tenant default --scopes chat,admin --name "admin panel"
+#   python auth.py revoke <id>
+if __name__ == '__main__':
+    import sys
+
+    parser = argparse.ArgumentParser(description="Manage gateway API keys")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create")
+    create.add_argument("--tenant", default="default")
+    create.add_argument("--scopes", default=CHAT, help="comma-separated: chat, admin")
+    create.add_argument("--name", default="")
+    revoke = commands.add_parser("revoke")
+    revoke.add_argument("id", type=int)
+    args = parser.parse_args()
+
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Database connection failed")
+    cur = conn.cursor()
+    if args.command == "create":
+        scopes = [scope.strip() for scope in args.scopes.split(",") if scope.strip()]
+        unknown = set(scopes) - set(SCOPES)
+        if unknown:
+            sys.exit(f"Unknown scopes: {', '.join(sorted(unknown))}")
+        cur.execute("SELECT id FROM tenants WHERE name = %s;", (args.tenant,))
+        row = cur.fetchone()
+        if row is None:
+            sys.exit(f"Unknown tenant: {args.tenant}")
+        raw_key = generate_key()
+        cur.execute(
+            "INSERT INTO api_keys (tenant_id, name, key_prefix, key_hash, scopes) VALUES (%s, %s, %s, %s, %s) RETURNING id;",
+            (row[0], args.name, raw_key[:len(KEY_PREFIX) + 6], hash_key(raw_key), ",".join(scopes))
+        )
+        key_id = cur.fetchone()[0]
+        conn.commit()
+        print(f"key {key_id} for tenant {args.tenant} ({','.join(scopes)}): {raw_key}")
+        print("Store it now; only its hash is kept.")
+    else:
+        cur.execute("UPDATE api_keys SET revoked_at = NOW() WHERE id = %s AND revoked_at IS NULL RETURNING id;", (args.id,))
+        revoked = cur.fetchone()
+        conn.commit()
+        print(f"key {args.id} revoked (takes effect within {Config.AUTH_CACHE_TTL:g} s)" if revoked else f"key {args.id} not found or already revoked")
+    conn.close()
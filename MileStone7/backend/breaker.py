@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Health of one upstream provider: error rate and latency EWMAs driving a circuit breaker
+class ProviderHealth:
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.error_rate = 0.0
+        self.latency_ms = None
+        self.samples = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def tripped(self):
+        if self.samples < Config.BREAKER_MIN_SAMPLES:
+            return False
+        return (self.error_rate >= Config.BREAKER_ERROR_THRESHOLD
+                or self.latency_ms >= Config.BREAKER_LATENCY_THRESHOLD_MS)
+
+    def open(self):
+        if self.state != OPEN:
+            logger.warning(f"Circuit opened for {self.provider}: error_rate={self.error_rate:.2f}, latency={self.latency_ms:.0f} ms")
+            metrics.incr(f"breaker.{self.provider}.opened")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+    def cooled_down(self):
+        return time.monotonic() - self.opened_at >= Config.BREAKER_COOLDOWN
+
+    # Whether routing should consider this provider at all
+    def available(self):
+        with self.lock:
+            if self.state == OPEN:
+                return self.cooled_down()
+            if self.state == HALF_OPEN:
+                return not self.probe_in_flight
+            return True
+
+    # Claim permission to send one request; in half-open state only a single probe is let through
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.cooled_down():
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record(self, latency_ms, ok):
+        alpha = Config.BREAKER_EWMA_ALPHA
+        with self.lock:
+            self.samples += 1
+            self.error_rate = (1 - alpha) * self.error_rate + alpha * (0.0 if ok else 1.0)
+            self.latency_ms = latency_ms if self.latency_ms is None else (1 - alpha) * self.latency_ms + alpha * latency_ms
+
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                if ok and latency_ms < Config.BREAKER_LATENCY_THRESHOLD_MS:
+                    logger.info(f"Circuit closed for {self.provider}")
+                    self.state = CLOSED
+                    self.error_rate = 0.0
+                    self.latency_ms = latency_ms
+                    self.samples = 0
+                else:
+                    self.open()
+            elif self.state == CLOSED and self.tripped():
+                self.open()
+
+    # End a call without a verdict on the provider (the caller ran out of time): a half-open
+    # probe is handed back so the next request can probe instead
+    def release(self):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "error_rate": round(self.error_rate, 4),
+                "latency_ewma_ms": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+                "samples": self.samples,
+            }
+
+
+health = {}
+health_lock = threading.Lock()
+
+def get_health(provider):
+    entry = health.get(provider)
+    if entry is None:
+        with health_lock:
+            entry = health.setdefault(provider, ProviderHealth(provider))
+    return entry
+
+def available(provider):
+    return get_health(provider).available()
+
+def allow(provider):
+    return get_health(provider).allow()
+
+def record(provider, latency_ms, ok):
+    get_health(provider).record(latency_ms, ok)
+
+def release(provider):
+    get_health(provider).release()
+
+def snapshot():
+    return {provider: entry.snapshot() for provider, entry in list(health.items())}
+
+metrics.register_collector("breakers", snapshot)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Opt-in traffic capture: sampled request records appended to an NDJSON log by a background writer
+
+records = queue.Queue(maxsize=Config.CAPTURE_QUEUE_SIZE)
+writer = None
+writer_lock = threading.Lock()
+
+
+def enabled():
+    return bool(Config.CAPTURE_PATH) and Config.CAPTURE_SAMPLE_RATE > 0
+
+def sampled():
+    return enabled() and random.random() < Config.CAPTURE_SAMPLE_RATE
+
+def prompt_fields(prompt):
+    fields = {
+        "prompt_chars": len(prompt),
+        "prompt_sha256": hashlib.sha256(prompt.encode()).hexdigest(),
+    }
+    if Config.CAPTURE_BODIES:
+        fields["prompt"] = prompt
+    return fields
+
+# Queue a record for the writer; never blocks the request path
+def record(entry):
+    start_writer()
+    try:
+        records.put_nowait(entry)
+    except queue.Full:
+        metrics.incr("capture.dropped")
+
+def write_loop():
+    with open(Config.CAPTURE_PATH, "a", encoding="utf-8") as f:
+        while True:
+            batch = [records.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            f.write("".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in batch))
+            f.flush()
+            metrics.incr("capture.written", len(batch))
+
+def start_writer():
+    global writer
+    if writer is not None:
+        return
+    with writer_lock:
+        if writer is None:
+            logger.info(f"Capturing {Config.CAPTURE_SAMPLE_RATE:.0%} of requests to {Config.CAPTURE_PATH}")
+            writer = threading.Thread(target=write_loop, name="capture-writer", daemon=True)
+            writer.start()
+
+# Block until queued records are written (used on shutdown and by tools)
+def flush(timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not records.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
@@ -0,0 +1,77 @@
+import hashlib
+import logging
+import threading
+import deadline
+import metrics
+from config import Config
+from providers import ProviderError
+
+logger = logging.getLogger(__name__)
+
+
+# One in-flight upstream call that duplicate requests can wait on
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+inflight = {}
+inflight_lock = threading.Lock()
+stats = {"leaders": 0, "joined": 0, "bypassed": 0, "retried": 0}
+
+def count(name):
+    with inflight_lock:
+        stats[name] += 1
+
+# Run fn() once per (tenant, provider, model, prompt) at a time; concurrent duplicates share its result.
+# Only upstream failures are shared: a leader that hit its own deadline or quota leaves its joiners to retry.
+def run(tenant_id, provider, model, prompt, fn):
+    if not Config.COALESCE_ENABLED or provider in Config.COALESCE_DISABLED_PROVIDERS:
+        count("bypassed")
+        return fn()
+
+    key = (tenant_id, provider, model, hashlib.sha256(prompt.encode()).digest())
+    while True:
+        with inflight_lock:
+            call = inflight.get(key)
+            leader = call is None
+            if leader:
+                call = inflight[key] = Call()
+                stats["leaders"] += 1
+            else:
+                stats["joined"] += 1
+        if leader:
+            break
+
+        logger.debug(f"Coalesced duplicate request for {provider}/{model}")
+        if not call.done.wait(deadline.remaining()):
+            deadline.fail("provider")
+        if call.error is None:
+            # Copy so callers can annotate their response without affecting each other
+            return dict(call.result) if isinstance(call.result, dict) else call.result
+        if isinstance(call.error, ProviderError):
+            raise call.error
+        count("retried")
+
+    try:
+        call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with inflight_lock:
+            del inflight[key]
+        call.done.set()
+
+def snapshot():
+    with inflight_lock:
+        leaders, joined = stats["leaders"], stats["joined"]
+        result = dict(stats)
+        result["in_flight"] = len(inflight)
+    result["ratio"] = round(joined / (leaders + joined), 4) if leaders + joined else 0.0
+    return result
+
+metrics.register_collector("coalescing", snapshot)
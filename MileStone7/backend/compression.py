@@ -0,0 +1,127 @@
+import gzip
+import json
+import logging
+import zlib
+from flask import Response, request
+from config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+# Compact JSON encoding, using orjson when it is installed
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+# jsonify() replacement for the hot endpoints
+def json_response(obj, status=200, headers=None):
+    return Response(dumps(obj), status=status, mimetype="application/json", headers=headers)
+
+# Pick the best encoding the client accepts, or None
+def negotiate_encoding():
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+# Compress a whole body in one go
+def compress_body(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.GZIP_LEVEL)
+
+# Compress a streamed body chunk by chunk, flushing after each chunk so clients see it right away
+def compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=Config.BROTLI_QUALITY)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(Config.GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+# after_request hook that compresses responses the client can decode
+def compress_response(response):
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if "Content-Encoding" in response.headers or response.direct_passthrough:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < Config.COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(compress_body(data, encoding))
+
+    response.headers["Content-Encoding"] = encoding
+    # A compressed representation is no longer byte-identical, so its ETag becomes weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Register response compression on the app
+def init_compression(app):
+    app.after_request(compress_response)
+
+
+# Bandwidth and CPU comparison of the encoders on a /regex-rules sized payload
+if __name__ == '__main__':
+    import sys
+    import time
+
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    payload = {
+        "version": rule_count,
+        "rules": [[i, "gpt-4o", rf"credit\s+card\s+{i}", "gemini-alpha"] for i in range(1, rule_count + 1)],
+        "next_after": None,
+    }
+
+    def timed(fn, repeat=20):
+        start = time.process_time()
+        for _ in range(repeat):
+            result = fn()
+        return result, (time.process_time() - start) / repeat * 1000
+
+    pretty, pretty_ms = timed(lambda: json.dumps(payload, indent=2).encode())
+    compact, compact_ms = timed(lambda: json.dumps(payload, separators=(",", ":")).encode())
+    print(f"json indent=2      {len(pretty):>10} bytes {pretty_ms:8.2f} ms")
+    print(f"json compact       {len(compact):>10} bytes {compact_ms:8.2f} ms")
+    if orjson is not None:
+        fast, fast_ms = timed(lambda: orjson.dumps(payload))
+        print(f"orjson             {len(fast):>10} bytes {fast_ms:8.2f} ms")
+
+    body = dumps(payload)
+    gz, gz_ms = timed(lambda: compress_body(body, "gzip"))
+    print(f"gzip level {Config.GZIP_LEVEL}       {len(gz):>10} bytes {gz_ms:8.2f} ms")
+    if brotli is not None:
+        br, br_ms = timed(lambda: compress_body(body, "br"))
+        print(f"brotli quality {Config.BROTLI_QUALITY}   {len(br):>10} bytes {br_ms:8.2f} ms")
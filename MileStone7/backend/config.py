@@ -4,6 +4,185 @@ from dotenv import load_dotenv
 # Load environment variables from .env
 load_dotenv()
 
+# Parse "provider=rate:burst,..." into {provider: (rate, burst)}
+def parse_rate_limits(value):
+    limits = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, spec = item.partition("=")
+        rate, _, burst = spec.partition(":")
+        limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+# Parse "name=weight,..." into {name: weight}
+def parse_weights(value):
+    weights = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, weight = item.rpartition("=")
+        weights[name] = float(weight)
+    return weights
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    # Primary DSN: DATABASE_URL, or assembled from the DB_* variables
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Per-request time budget for /v1/chat/completions; clients may ask for less (or more, up to the cap) with X-Request-Timeout-Ms
+    REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 30))
+    REQUEST_MAX_TIMEOUT = float(os.getenv('REQUEST_MAX_TIMEOUT', 120))
+
+    # Start-up: warm-up runs in the background and /readyz reports when it is done
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    STARTUP_WARM_UP = os.getenv('STARTUP_WARM_UP', 'true').lower() == 'true'
+    STARTUP_RETRY_INTERVAL = float(os.getenv('STARTUP_RETRY_INTERVAL', 2))
+    PRELOAD_TENANTS = int(os.getenv('PRELOAD_TENANTS', 32))  # tenants whose rules are compiled before traffic
+    READY_MAX_CACHE_AGE = float(os.getenv('READY_MAX_CACHE_AGE', 30))  # /readyz fails once the routing cache is older
+
+    # PostgreSQL connection pool
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 2))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+    # Read replicas (comma-separated DSNs) for listings and routing cache reloads; a replica more than
+    # REPLICA_MAX_LAG seconds behind, or behind the caller's read token, is skipped for the primary
+    DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+    REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+    REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 1))  # how long a measured lag is trusted
+
+    # API key authentication; verified keys are cached for AUTH_CACHE_TTL, unknown keys for AUTH_NEGATIVE_TTL
+    AUTH_ENABLED = os.getenv('AUTH_ENABLED', 'true').lower() == 'true'
+    API_KEY_PEPPER = os.getenv('API_KEY_PEPPER', '')
+    AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 60))
+    AUTH_NEGATIVE_TTL = float(os.getenv('AUTH_NEGATIVE_TTL', 10))
+    AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+    CORS_ORIGINS = [origin.strip() for origin in os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',') if origin.strip()]
+
+    # Page sizes for the /regex-rules listing
+    RULES_PAGE_SIZE = int(os.getenv('RULES_PAGE_SIZE', 100))
+    RULES_MAX_PAGE_SIZE = int(os.getenv('RULES_MAX_PAGE_SIZE', 1000))
+
+    # /models response caching
+    MODELS_MAX_AGE = int(os.getenv('MODELS_MAX_AGE', 30))
+
+    # Response compression
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+    BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+    # Upstream providers; a provider without a base URL answers with its canned stub
+    PROVIDER_BASE_URLS = {
+        "openai": os.getenv('OPENAI_BASE_URL'),
+        "anthropic": os.getenv('ANTHROPIC_BASE_URL'),
+        "gemini": os.getenv('GEMINI_BASE_URL'),
+    }
+    PROVIDER_API_KEYS = {
+        "openai": os.getenv('OPENAI_API_KEY'),
+        "anthropic": os.getenv('ANTHROPIC_API_KEY'),
+        "gemini": os.getenv('GEMINI_API_KEY'),
+    }
+    PROVIDER_POOL_SIZE = int(os.getenv('PROVIDER_POOL_SIZE', 20))
+    PROVIDER_MAX_CONCURRENCY = int(os.getenv('PROVIDER_MAX_CONCURRENCY', 32))
+    PROVIDER_QUEUE_TIMEOUT = float(os.getenv('PROVIDER_QUEUE_TIMEOUT', 5))
+    PROVIDER_CONNECT_TIMEOUT = float(os.getenv('PROVIDER_CONNECT_TIMEOUT', 3))
+    PROVIDER_READ_TIMEOUT = float(os.getenv('PROVIDER_READ_TIMEOUT', 60))
+    PROVIDER_MAX_TOKENS = int(os.getenv('PROVIDER_MAX_TOKENS', 1024))
+
+    # Hedged provider calls: a call that has not answered within HEDGE_PERCENTILE of its endpoint's recent latency
+    # (at least HEDGE_MIN_DELAY_MS) gets a duplicate, to another deployment when the model has several. Hedges
+    # are capped at HEDGE_BUDGET of calls (bursts up to HEDGE_BURST); the first answer wins
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+    HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', 50))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', 0.05))
+    HEDGE_BURST = float(os.getenv('HEDGE_BURST', 10))
+    HEDGE_MAX_THREADS = int(os.getenv('HEDGE_MAX_THREADS', 128))
+
+    # Models with rows in model_deployments are served by a weighted pool of deployments: "p2c"
+    # (power of two choices) or "least_outstanding", both scored by live latency and in-flight requests
+    LOAD_BALANCER = os.getenv('LOAD_BALANCER', 'p2c')
+    DEPLOYMENT_EWMA_ALPHA = float(os.getenv('DEPLOYMENT_EWMA_ALPHA', 0.3))
+
+    # Metrics window (samples kept per timing series)
+    METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', 2048))
+
+    # Per-provider circuit breaker
+    BREAKER_EWMA_ALPHA = float(os.getenv('BREAKER_EWMA_ALPHA', 0.2))
+    BREAKER_MIN_SAMPLES = int(os.getenv('BREAKER_MIN_SAMPLES', 5))
+    BREAKER_ERROR_THRESHOLD = float(os.getenv('BREAKER_ERROR_THRESHOLD', 0.5))
+    BREAKER_LATENCY_THRESHOLD_MS = float(os.getenv('BREAKER_LATENCY_THRESHOLD_MS', 20000))
+    BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 30))
+
+    # Rate limiting and admission control, shared by all workers on the host
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_SHM_PATH = os.getenv('RATE_LIMIT_SHM_PATH', '/dev/shm/unbound-ratelimit' if os.path.isdir('/dev/shm') else '/tmp/unbound-ratelimit')
+    RATE_LIMIT_WORKER_SLOTS = int(os.getenv('RATE_LIMIT_WORKER_SLOTS', 64))
+    RATE_LIMIT_BUCKETS = int(os.getenv('RATE_LIMIT_BUCKETS', 4096))
+    CLIENT_RATE = float(os.getenv('CLIENT_RATE', 10))
+    CLIENT_BURST = float(os.getenv('CLIENT_BURST', 20))
+    PROVIDER_RATE_LIMITS = parse_rate_limits(os.getenv('PROVIDER_RATE_LIMITS'))
+    MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 64))
+    ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 128))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2))
+    ADMISSION_RETRY_AFTER = float(os.getenv('ADMISSION_RETRY_AFTER', 1))
+    BATCH_ADMISSION_SHARE = float(os.getenv('BATCH_ADMISSION_SHARE', 0.75))  # of MAX_IN_FLIGHT; the rest is kept for interactive requests
+
+    # Dispatch scheduler: at most SCHEDULER_CONCURRENCY provider calls per worker process. Waiting requests are
+    # served interactive before batch (X-Priority header), and fairly between API keys (or tenants) within a class,
+    # weighted by SCHEDULER_FLOW_WEIGHTS, e.g. "key:12=4,tenant:3=0.5"
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', 32))
+    SCHEDULER_DEFAULT_CLASS = os.getenv('SCHEDULER_DEFAULT_CLASS', 'interactive')  # for requests without X-Priority
+    SCHEDULER_QUEUE_TIMEOUTS = {
+        "interactive": float(os.getenv('SCHEDULER_INTERACTIVE_QUEUE_TIMEOUT', 2)),
+        "batch": float(os.getenv('SCHEDULER_BATCH_QUEUE_TIMEOUT', 60)),
+    }
+    SCHEDULER_QUEUE_SIZES = {
+        "interactive": int(os.getenv('SCHEDULER_INTERACTIVE_QUEUE_SIZE', 256)),
+        "batch": int(os.getenv('SCHEDULER_BATCH_QUEUE_SIZE', 4096)),
+    }
+    SCHEDULER_BATCH_MIN_SHARE = float(os.getenv('SCHEDULER_BATCH_MIN_SHARE', 0.05))  # of grants while both classes wait
+    SCHEDULER_FLOW_WEIGHTS = parse_weights(os.getenv('SCHEDULER_FLOW_WEIGHTS'))
+
+    # Single-flight coalescing of identical in-flight completions
+    COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'true').lower() == 'true'
+    COALESCE_DISABLED_PROVIDERS = set(filter(None, os.getenv('COALESCE_DISABLED_PROVIDERS', '').split(',')))
+
+    # Compiled routing policy cache
+    POLICY_CACHE_CHECK_INTERVAL = float(os.getenv('POLICY_CACHE_CHECK_INTERVAL', 5))
+    TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', 256))  # compiled per-tenant snapshots kept in memory
+
+    # Semantic routing rules
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')  # e.g. all-MiniLM-L6-v2; unset uses the hashing embedder
+    EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', 512))
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 100000))
+    SEMANTIC_DEFAULT_THRESHOLD = float(os.getenv('SEMANTIC_DEFAULT_THRESHOLD', 0.75))
+    SEMANTIC_MAX_CHARS = int(os.getenv('SEMANTIC_MAX_CHARS', 4000))
+    SEMANTIC_BUDGET_MS = float(os.getenv('SEMANTIC_BUDGET_MS', 20))
+
+    # Sensitive-data detection for "pii" routing rules; larger uploads are scanned up to this size
+    PII_MAX_FILE_BYTES = int(os.getenv('PII_MAX_FILE_BYTES', 10 * 1024 * 1024))
+    PII_VECTOR_MIN_CHARS = int(os.getenv('PII_VECTOR_MIN_CHARS', 16384))  # shorter texts use the regex scanner
+
+    # Rule evaluation planner
+    PLANNER_SAMPLE_EVERY = int(os.getenv('PLANNER_SAMPLE_EVERY', 16))
+    PLANNER_REPLAN_EVERY = int(os.getenv('PLANNER_REPLAN_EVERY', 64))
+    PLANNER_EWMA_ALPHA = float(os.getenv('PLANNER_EWMA_ALPHA', 0.1))
+
+    # Opt-in traffic capture (NDJSON); prompt bodies are only stored when CAPTURE_BODIES is true
+    CAPTURE_PATH = os.getenv('CAPTURE_PATH')
+    CAPTURE_SAMPLE_RATE = float(os.getenv('CAPTURE_SAMPLE_RATE', 0.01))
+    CAPTURE_BODIES = os.getenv('CAPTURE_BODIES', 'false').lower() == 'true'
+    CAPTURE_QUEUE_SIZE = int(os.getenv('CAPTURE_QUEUE_SIZE', 10000))
+    CAPTURE_REPLAY_SECRET = os.getenv('CAPTURE_REPLAY_SECRET')  # X-Replay value that keeps replayed traffic out of the log
+
+    # Usage accounting
+    USAGE_ENABLED = os.getenv('USAGE_ENABLED', 'true').lower() == 'true'
+    USAGE_BUFFER_SIZE = int(os.getenv('USAGE_BUFFER_SIZE', 50000))
+    USAGE_FLUSH_BATCH = int(os.getenv('USAGE_FLUSH_BATCH', 1000))
+    USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', 5))
+
+    # Conversation sessions: hot sessions in memory, full history in PostgreSQL
+    SESSION_MEMORY_LIMIT = int(os.getenv('SESSION_MEMORY_LIMIT', 10000))
+    SESSION_MAX_TURNS = int(os.getenv('SESSION_MAX_TURNS', 40))  # user + assistant turns kept in memory and sent upstream
+    SESSION_MAX_CONTEXT_CHARS = int(os.getenv('SESSION_MAX_CONTEXT_CHARS', 32000))
+    SESSION_WRITE_QUEUE_SIZE = int(os.getenv('SESSION_WRITE_QUEUE_SIZE', 50000))
@@ -0,0 +1,327 @@
+import itertools
+import logging
+import os
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import deadline
+import metrics
+import sqlite_backend
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+# Pooled connection; close() hands it back to the pool instead of closing the socket
+class PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.put(self._conn)
+            self._conn = None
+
+
+# Fixed-size connection pool; callers block up to DB_POOL_TIMEOUT for a free connection
+class ConnectionPool:
+    def __init__(self, dsn, min_size, max_size, on_error=None, lazy=False):
+        self.pid = os.getpid()
+        self.on_error = on_error or record_error
+        self.max_size = max_size
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0 if lazy else min_size, max_size, dsn)
+        self.pool.minconn = min_size  # a lazy pool opens nothing up front but still keeps min_size idle connections
+
+    def get(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(f"no free database connection within {timeout:g} s")
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use += 1
+        return PooledConnection(self, conn)
+
+    def put(self, conn):
+        broken = bool(conn.closed)
+        if broken:
+            self.on_error("connection lost")
+        if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+                self.on_error("connection lost")
+        self.pool.putconn(conn, close=broken)
+        with self.lock:
+            self.in_use -= 1
+        self.slots.release()
+
+    def status(self):
+        with self.lock:
+            in_use = self.in_use
+        return {"max": self.max_size, "open": in_use + len(self.pool._pool), "in_use": in_use}
+
+    def close(self):
+        self.pool.closeall()
+
+
+pool = None
+pool_lock = threading.Lock()
+last_ok = None  # monotonic time of the last successful checkout
+last_error = None  # (monotonic time, message) of the last failed one
+
+def record_error(message):
+    global last_error
+    last_error = (time.monotonic(), message)
+    metrics.incr("db.errors")
+
+# DATABASE_URL=sqlite:///... runs on the embedded SQLite backend instead of PostgreSQL
+def using_sqlite():
+    return sqlite_backend.is_sqlite(Config.SQLALCHEMY_DATABASE_URI)
+
+# Pool of the current process, created on first use and recreated after fork
+def get_pool():
+    global pool
+    if pool is None or pool.pid != os.getpid():
+        with pool_lock:
+            if pool is None or pool.pid != os.getpid():
+                if using_sqlite():
+                    pool = sqlite_backend.SqlitePool(Config.SQLALCHEMY_DATABASE_URI, Config.DB_POOL_MIN, Config.DB_POOL_MAX, PooledConnection)
+                else:
+                    pool = ConnectionPool(Config.SQLALCHEMY_DATABASE_URI, Config.DB_POOL_MIN, Config.DB_POOL_MAX)
+    return pool
+
+# Connection from `pool`; inside a request deadline the wait and every statement are bounded by the remaining budget
+def checkout(pool):
+    start = time.perf_counter()
+    conn = pool.get(deadline.bounded(Config.DB_POOL_TIMEOUT))
+    metrics.observe("db.acquire", (time.perf_counter() - start) * 1000)
+    left = deadline.remaining()
+    if left is not None and isinstance(pool, sqlite_backend.SqlitePool):
+        conn.set_deadline(time.monotonic() + left)
+    elif left is not None:
+        # Lasts until the transaction ends; the pool rolls back on return, which resets it
+        try:
+            conn.cursor().execute("SET LOCAL statement_timeout = %s;", (max(1, int(left * 1000)),))
+        except psycopg2.Error:
+            conn.close()
+            raise
+    return conn
+
+# Connection to the primary, for writes and reads that must see them
+def connect_db():
+    global last_ok
+    deadline.check("database")
+    try:
+        conn = checkout(get_pool())
+        last_ok = time.monotonic()
+        return conn
+    except psycopg2.Error as e:
+        logger.error(f"Database connection error: {e}")
+        record_error(str(e).strip())
+        return None
+
+
+# ---- read replicas ----
+
+# Read tokens are WAL positions ("16/B374D848"): a server that has replayed up to a write's token has seen that write
+def parse_token(value):
+    try:
+        high, low = value.split("/")
+        return (int(high, 16) << 32) | int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+def format_token(position):
+    return f"{position >> 32:X}/{position & 0xFFFFFFFF:X}"
+
+# How far the server's data goes: replayed WAL on a replica, written WAL on the primary
+POSITION_SQL = "CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END"
+
+def read_position(cur):
+    if using_sqlite():
+        return 0
+    cur.execute(f"SELECT ({POSITION_SQL})::text;")
+    return parse_token(cur.fetchone()[0]) or 0
+
+last_write = 0  # position of this process's latest committed write; its own reads never go behind it
+last_write_lock = threading.Lock()
+
+# Read token for everything committed on `conn` so far; None if it could not be read (the write itself stands)
+def write_token(conn):
+    global last_write
+    if using_sqlite():
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_current_wal_lsn()::text;")
+        position = parse_token(cur.fetchone()[0])
+    except psycopg2.Error as e:
+        logger.warning(f"Could not read the write position: {e}")
+        return None
+    with last_write_lock:
+        last_write = max(last_write, position)
+    return format_token(position)
+
+
+# Streaming replica with its own pool and the lag measured the last time it served a read
+class Replica:
+    def __init__(self, dsn):
+        params = psycopg2.extensions.parse_dsn(dsn)
+        self.name = f"{params.get('host', 'localhost')}:{params.get('port', 5432)}"
+        # Lazy, so an unreachable replica cannot fail start-up
+        self.pool = ConnectionPool(dsn, Config.DB_POOL_MIN, Config.DB_POOL_MAX, on_error=self.record_error, lazy=True)
+        self.position = 0
+        self.lag = None
+        self.checked_at = None
+        self.error = None
+
+    def record_error(self, message):
+        self.error = message
+        self.checked_at = time.monotonic()
+        metrics.incr("db.replica_errors")
+
+    def measured_recently(self):
+        return self.checked_at is not None and time.monotonic() - self.checked_at < Config.REPLICA_CHECK_INTERVAL
+
+    # Failing or lagging at the last measurement; rechecked once that is REPLICA_CHECK_INTERVAL old
+    def skipped(self):
+        return self.measured_recently() and (self.error is not None or self.lag > Config.REPLICA_MAX_LAG)
+
+    # Replay lag is 0 while caught up with what it received, else the age of the last replayed commit
+    def measure(self, cur):
+        cur.execute(f"""
+            SELECT ({POSITION_SQL})::text,
+                   CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM clock_timestamp() - pg_last_xact_replay_timestamp()), 0) END;
+        """)
+        position, lag = cur.fetchone()
+        self.position = parse_token(position) or 0
+        self.lag = float(lag)
+        self.checked_at = time.monotonic()
+        self.error = None
+
+    # Connection if the replica is within REPLICA_MAX_LAG and has replayed up to `needed`, else None
+    def connect(self, needed):
+        try:
+            conn = checkout(self.pool)
+        except psycopg2.Error as e:
+            logger.warning(f"Replica {self.name} unavailable: {e}")
+            self.record_error(str(e).strip())
+            return None
+        try:
+            if not self.measured_recently() or self.error is not None or self.position < needed:
+                self.measure(conn.cursor())
+        except psycopg2.Error as e:
+            conn.close()
+            logger.warning(f"Replica {self.name} check failed: {e}")
+            self.record_error(str(e).strip())
+            return None
+        if self.lag > Config.REPLICA_MAX_LAG or self.position < needed:
+            conn.close()
+            return None
+        return conn
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "pool": self.pool.status(),
+            "lag_s": round(self.lag, 3) if self.lag is not None else None,
+            "position": format_token(self.position) if self.position else None,
+            "checked_age_s": round(now - self.checked_at, 3) if self.checked_at is not None else None,
+            "error": self.error,
+        }
+
+
+replicas = []
+replicas_pid = None
+replica_turn = itertools.count()
+
+# Replicas of the current process, created on first use and recreated after fork
+def get_replicas():
+    global replicas, replicas_pid
+    if replicas_pid != os.getpid():
+        with pool_lock:
+            if replicas_pid != os.getpid():
+                replicas = [] if using_sqlite() else [Replica(dsn) for dsn in Config.DATABASE_REPLICA_URLS]
+                replicas_pid = os.getpid()
+    return replicas
+
+# Connection for read-only queries: the next replica (round robin) that is within REPLICA_MAX_LAG and has
+# replayed both `token` and this process's own writes, else the primary
+def connect_replica(token=None):
+    candidates = get_replicas()
+    if not candidates:
+        return connect_db()
+    deadline.check("database")
+    needed = max(token or 0, last_write)
+    first = next(replica_turn)
+    for i in range(len(candidates)):
+        replica = candidates[(first + i) % len(candidates)]
+        if replica.skipped():
+            continue
+        conn = replica.connect(needed)
+        if conn is not None:
+            metrics.incr("db.replica_reads")
+            return conn
+    metrics.incr("db.replica_fallbacks")
+    return connect_db()
+
+# Open DB_POOL_MIN connections and check one of them, so the first requests skip the connect
+def warm_pool():
+    conn = connect_db()
+    if conn is None:
+        return False
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1;")
+        cur.fetchone()
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"Database check failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+# Pool usage and the outcome of recent checkouts, from memory only
+def pool_status():
+    now = time.monotonic()
+    status = pool.status() if pool is not None and pool.pid == os.getpid() else None
+    error_at, message = last_error or (None, None)
+    return {
+        "pool": status,
+        "connected": last_ok is not None and (error_at is None or last_ok > error_at),
+        "last_ok_age_s": round(now - last_ok, 3) if last_ok is not None else None,
+        "last_error": message,
+        "last_error_age_s": round(now - error_at, 3) if error_at is not None else None,
+        "replicas": [replica.status() for replica in replicas] if replicas_pid == os.getpid() else [],
+    }
+
+# Cheap fingerprint of the routing policy version, models, tenants, file-routing targets and deployments
+def get_fingerprint(cur):
+    if using_sqlite():
+        cur.execute(sqlite_backend.FINGERPRINT_SQL)
+        return cur.fetchone()
+    cur.execute("""
+        SELECT (SELECT COALESCE(MAX(version), 0) FROM routing_policy_changes),
+               (SELECT md5(COALESCE(string_agg(name || ':' || COALESCE(tenant_id::text, ''), ',' ORDER BY name), '')) FROM models),
+               (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) FROM tenants),
+               (SELECT md5(COALESCE(string_agg(tenant_id || ':' || model_name || ':' || provider, ',' ORDER BY tenant_id), '')) FROM file_routing),
+               (SELECT md5(COALESCE(string_agg(model_name || ':' || name || ':' || base_url || ':' || COALESCE(api_key_env, '') || ':' || weight,
+                                               ',' ORDER BY id), '')) FROM model_deployments),
+               (SELECT md5(COALESCE(string_agg(model_name || ':' || fallback_model || ':' || position, ',' ORDER BY id), '')) FROM model_fallbacks);
+    """)
+    return cur.fetchone()
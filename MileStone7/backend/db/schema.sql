@@ -1,10 +1,136 @@
+-- Business units with their own models, routing rules and file-routing target
+CREATE TABLE tenants (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) UNIQUE NOT NULL
+);
+INSERT INTO tenants (name) VALUES ('default');
+
+-- API keys, stored as keyed SHA-256 hashes; scopes is a comma-separated list of chat/admin
+CREATE TABLE api_keys (
+    id SERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL DEFAULT '',
+    key_prefix VARCHAR(16) NOT NULL,
+    key_hash CHAR(64) UNIQUE NOT NULL,
+    scopes VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    revoked_at TIMESTAMP
+);
+
+-- Models with a NULL tenant_id are visible to every tenant
 CREATE TABLE models (
     id SERIAL PRIMARY KEY,
-    name TEXT UNIQUE NOT NULL
+    name TEXT UNIQUE NOT NULL,
+    tenant_id INTEGER REFERENCES tenants(id) ON DELETE CASCADE
 );
 CREATE TABLE routing_policies (
     id SERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL DEFAULT 1 REFERENCES tenants(id) ON DELETE CASCADE,
     model_name VARCHAR(255) NOT NULL,
     regex_pattern TEXT NOT NULL,
-    redirect_model VARCHAR(255) NOT NULL
+    redirect_model VARCHAR(255) NOT NULL,
+    rule_type VARCHAR(20) NOT NULL DEFAULT 'regex',
+    similarity_threshold REAL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    action VARCHAR(10) NOT NULL DEFAULT 'redirect'
+);
+
+-- Exemplar phrases of semantic routing rules
+CREATE TABLE routing_policy_exemplars (
+    id SERIAL PRIMARY KEY,
+    policy_id INTEGER NOT NULL REFERENCES routing_policies(id) ON DELETE CASCADE,
+    phrase TEXT NOT NULL
+);
+CREATE INDEX routing_policy_exemplars_policy_id_idx ON routing_policy_exemplars (policy_id);
+
+-- Change log behind the /regex-rules ETag and delta feed
+CREATE TABLE routing_policy_changes (
+    version BIGSERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL DEFAULT 1,
+    rule_id INTEGER NOT NULL,
+    op VARCHAR(10) NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX routing_policy_changes_tenant_id_idx ON routing_policy_changes (tenant_id, version);
+CREATE INDEX routing_policies_model_name_idx ON routing_policies (tenant_id, model_name, id);
+CREATE INDEX routing_policies_redirect_model_idx ON routing_policies (tenant_id, redirect_model, id);
+
+-- Model that receives a second copy of every chat request, per tenant
+CREATE TABLE file_routing (
+    tenant_id INTEGER PRIMARY KEY REFERENCES tenants(id) ON DELETE CASCADE,
+    model_name VARCHAR(255) NOT NULL,
+    provider VARCHAR(255) NOT NULL
+);
+
+-- Ordered fallback targets used while a model's provider is degraded
+CREATE TABLE model_fallbacks (
+    id SERIAL PRIMARY KEY,
+    model_name VARCHAR(255) NOT NULL,
+    fallback_model TEXT NOT NULL REFERENCES models(name),
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX model_fallbacks_model_name_idx ON model_fallbacks (model_name, position);
+
+-- Deployments (regions, API keys) serving one model; requests are balanced across them by weight and live load.
+-- api_key_env names the environment variable holding the key (the provider's key when NULL).
+CREATE TABLE model_deployments (
+    id SERIAL PRIMARY KEY,
+    model_name TEXT NOT NULL REFERENCES models(name) ON DELETE CASCADE,
+    name VARCHAR(64) NOT NULL,
+    base_url TEXT NOT NULL,
+    api_key_env VARCHAR(255),
+    weight REAL NOT NULL DEFAULT 1 CHECK (weight > 0),
+    UNIQUE (model_name, name)
+);
+
+-- Server-side conversation sessions; model/redirect hold the incremental routing state
+CREATE TABLE conversation_sessions (
+    id CHAR(32) PRIMARY KEY,
+    tenant_id INTEGER NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    model VARCHAR(255),
+    redirect_model VARCHAR(255),
+    redirect_provider VARCHAR(255),
+    turn_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE conversation_turns (
+    id BIGSERIAL PRIMARY KEY,
+    session_id CHAR(32) NOT NULL REFERENCES conversation_sessions(id) ON DELETE CASCADE,
+    role VARCHAR(16) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX conversation_turns_session_id_idx ON conversation_turns (session_id, id);
+
+-- Per-request usage, written in batches by the usage flusher
+CREATE TABLE usage_records (
+    id BIGSERIAL PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL,
+    requested_provider VARCHAR(255),
+    requested_model VARCHAR(255),
+    provider VARCHAR(255),
+    model VARCHAR(255),
+    redirected BOOLEAN NOT NULL,
+    has_file BOOLEAN NOT NULL,
+    prompt_chars INTEGER NOT NULL,
+    response_chars INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    status SMALLINT NOT NULL
+);
+CREATE INDEX usage_records_created_at_idx ON usage_records (created_at);
+
+-- Per-minute usage rollups served by /usage
+CREATE TABLE usage_rollups (
+    minute TIMESTAMPTZ NOT NULL,
+    provider VARCHAR(255) NOT NULL,
+    model VARCHAR(255) NOT NULL,
+    requests INTEGER NOT NULL,
+    redirects INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    prompt_chars BIGINT NOT NULL,
+    response_chars BIGINT NOT NULL,
+    latency_ms_total DOUBLE PRECISION NOT NULL,
+    errors INTEGER NOT NULL,
+    PRIMARY KEY (minute, provider, model)
 );
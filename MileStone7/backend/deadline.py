@@ -0,0 +1,72 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Time budget of the current request. Every stage that can wait (admission queue, database, session
+# lock, provider call, coalesced wait) bounds its wait by the remaining budget and fails fast with
+# DeadlineExceeded naming the stage once it runs out.
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage, budget_ms):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+        self.budget_ms = budget_ms
+
+
+class Deadline:
+    def __init__(self, budget_s):
+        self.budget_s = budget_s
+        self.expires_at = time.monotonic() + budget_s
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+
+current_deadline = contextvars.ContextVar("deadline", default=None)
+
+# Budget in seconds from the client's X-Request-Timeout-Ms header, else REQUEST_TIMEOUT, capped at REQUEST_MAX_TIMEOUT
+def budget_from_header(value):
+    try:
+        budget = float(value) / 1000 if value else Config.REQUEST_TIMEOUT
+    except ValueError:
+        budget = Config.REQUEST_TIMEOUT
+    return max(0.001, min(budget, Config.REQUEST_MAX_TIMEOUT))
+
+@contextmanager
+def scope(budget_s):
+    token = current_deadline.set(Deadline(budget_s))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+# Seconds left for the current request (None outside a deadline scope), never negative
+def remaining():
+    deadline = current_deadline.get()
+    return max(0.0, deadline.remaining()) if deadline is not None else None
+
+# `default` bounded by the remaining budget
+def bounded(default):
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
+
+def check(stage):
+    deadline = current_deadline.get()
+    if deadline is not None and deadline.remaining() <= 0:
+        fail(stage)
+
+# Raise DeadlineExceeded for `stage`; for waits that timed out on the remaining budget
+def fail(stage):
+    deadline = current_deadline.get()
+    budget_ms = round(deadline.budget_s * 1000) if deadline is not None else None
+    metrics.incr(f"deadline.exceeded.{stage}")
+    logger.warning(f"Deadline of {budget_ms} ms exceeded during {stage}")
+    raise DeadlineExceeded(stage, budget_ms)
@@ -0,0 +1,124 @@
+import logging
+import os
+import random
+import threading
+import breaker
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Several deployments (regions, API keys) of one model, from the model_deployments table. Each request
+# picks one by weighted power-of-two-choices, or by least outstanding requests with LOAD_BALANCER=
+# least_outstanding, scoring a deployment by its latency EWMA times the requests it would queue behind,
+# divided by its weight. Every deployment has its own circuit breaker; open ones are not picked.
+
+P2C = "p2c"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+# Live load of one deployment; kept across directory reloads so a reload does not forget it
+class DeploymentStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.latency_ms = None
+        self.requests = 0
+        self.errors = 0
+
+    def started(self):
+        with self.lock:
+            self.outstanding += 1
+
+    def finished(self, latency_ms, ok):
+        alpha = Config.DEPLOYMENT_EWMA_ALPHA
+        with self.lock:
+            self.outstanding -= 1
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+                return
+            self.latency_ms = latency_ms if self.latency_ms is None else (1 - alpha) * self.latency_ms + alpha * latency_ms
+
+
+stats = {}
+stats_lock = threading.Lock()
+
+def get_stats(key):
+    entry = stats.get(key)
+    if entry is None:
+        with stats_lock:
+            entry = stats.setdefault(key, DeploymentStats())
+    return entry
+
+
+class Deployment:
+    def __init__(self, model_name, name, base_url, api_key_env, weight):
+        self.model_name = model_name  # "provider/model" as in the models table
+        self.provider = model_name.split("/")[0]
+        self.name = name
+        self.base_url = base_url
+        self.api_key_env = api_key_env
+        self.weight = weight
+        self.key = f"{model_name}@{name}"  # breaker and stats key
+        self.client_key = f"{self.provider}@{base_url}@{api_key_env or ''}"  # deployments on one endpoint share a client
+        self.stats = get_stats(self.key)
+
+    # Keys never live in the database: the deployment names the environment variable that holds it
+    def api_key(self):
+        if self.api_key_env:
+            return os.getenv(self.api_key_env)
+        return Config.PROVIDER_API_KEYS.get(self.provider)
+
+    def available(self):
+        return breaker.available(self.key)
+
+    def score(self, latency_ms):
+        return (self.stats.latency_ms or latency_ms) * (self.stats.outstanding + 1) / self.weight
+
+
+class DeploymentPool:
+    def __init__(self, deployments):
+        self.deployments = deployments
+
+    def available(self):
+        return any(deployment.available() for deployment in self.deployments)
+
+    # Deployment for the next attempt, skipping `tried` and open circuits; None when none is left
+    def pick(self, tried=()):
+        candidates = [d for d in self.deployments if d not in tried and d.available()]
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        # Unmeasured deployments are scored with the pool's mean latency, so they get tried without being flooded
+        measured = [d.stats.latency_ms for d in candidates if d.stats.latency_ms is not None]
+        latency_ms = sum(measured) / len(measured) if measured else 1.0
+        if Config.LOAD_BALANCER == LEAST_OUTSTANDING:
+            best = min(d.score(latency_ms) for d in candidates)
+            return random.choice([d for d in candidates if d.score(latency_ms) == best])
+        first = random.choices(candidates, weights=[d.weight for d in candidates])[0]
+        rest = [d for d in candidates if d is not first]
+        second = random.choices(rest, weights=[d.weight for d in rest])[0]
+        return first if first.score(latency_ms) <= second.score(latency_ms) else second
+
+
+# model_deployments rows -> {model name: DeploymentPool}
+def build_pools(rows):
+    pools = {}
+    for model_name, name, base_url, api_key_env, weight in rows:
+        if weight <= 0:
+            logger.warning(f"Deployment {name} of {model_name} has weight {weight}, skipping")
+            continue
+        pools.setdefault(model_name, []).append(Deployment(model_name, name, base_url, api_key_env, weight))
+    return {model_name: DeploymentPool(deployments) for model_name, deployments in pools.items()}
+
+def snapshot():
+    with stats_lock:
+        entries = list(stats.items())
+    return {key: {
+        "outstanding": entry.outstanding,
+        "latency_ewma_ms": round(entry.latency_ms, 2) if entry.latency_ms is not None else None,
+        "requests": entry.requests,
+        "errors": entry.errors,
+    } for key, entry in entries}
+
+metrics.register_collector("deployments", snapshot)
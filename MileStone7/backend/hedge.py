@@ -0,0 +1,132 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+import deadline
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Hedged provider calls against long-tailed upstream latency. A call that has not answered within the
+# HEDGE_PERCENTILE latency of its endpoint gets a duplicate, and whichever answers first is returned.
+# The loser cannot be interrupted mid-request (the HTTP clients block), so it is cancelled if it has not
+# started and otherwise left to finish in the background with its result dropped; its latency still feeds
+# the breaker and load stats. Calls only move to a worker thread when a hedge is possible at all.
+
+THRESHOLD_REFRESH = 1.0  # seconds a computed threshold is reused
+
+
+# Token bucket capping hedges at HEDGE_BUDGET of calls
+class Budget:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = Config.HEDGE_BURST
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(Config.HEDGE_BURST, self.tokens + Config.HEDGE_BUDGET)
+
+    def available(self):
+        return self.tokens >= 1
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+budget = Budget()
+thresholds = {}  # endpoint key -> (delay in seconds or None, computed at)
+
+# Hedge delay in seconds for an endpoint (a provider or a deployment key); None until it has HEDGE_MIN_SAMPLES calls
+def threshold(key):
+    cached = thresholds.get(key)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] < THRESHOLD_REFRESH:
+        return cached[0]
+    latency_ms = metrics.series_percentile(f"provider.{key}", Config.HEDGE_PERCENTILE, Config.HEDGE_MIN_SAMPLES)
+    delay = max(latency_ms, Config.HEDGE_MIN_DELAY_MS) / 1000 if latency_ms is not None else None
+    thresholds[key] = (delay, now)
+    return delay
+
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+# Worker threads of the current process, created on first use and recreated after fork
+def get_executor():
+    global executor, executor_pid
+    if executor_pid != os.getpid():
+        with executor_lock:
+            if executor_pid != os.getpid():
+                executor = ThreadPoolExecutor(Config.HEDGE_MAX_THREADS, thread_name_prefix="hedge")
+                executor_pid = os.getpid()
+    return executor
+
+# Run `fn` in a worker thread with the caller's context, so the request deadline carries over
+def submit(fn, *args):
+    return get_executor().submit(contextvars.copy_context().run, fn, *args)
+
+# call(target), hedged with call(alternate()) once it is slower than the endpoint's threshold. `key` names the
+# endpoint whose latency sets the threshold; `alternate` picks the hedge's target (default: the same one).
+def run(call, key, target=None, alternate=None):
+    if not Config.HEDGE_ENABLED:
+        return call(target)
+    metrics.incr("hedge.calls")
+    budget.earn()
+    delay = threshold(key)
+    if delay is None or not budget.available():
+        return call(target)
+
+    primary = submit(call, target)
+    try:
+        return primary.result(timeout=deadline.bounded(delay))
+    except FutureTimeout:
+        pass
+    left = deadline.remaining()
+    if left is not None and left <= 0:
+        return primary.result()
+    if not budget.spend():
+        metrics.incr("hedge.over_budget")
+        return primary.result()
+
+    hedge_target = alternate() if alternate is not None else target
+    logger.debug(f"Hedging {key} after {delay * 1000:.0f} ms")
+    metrics.incr("hedge.issued")
+    hedged = submit(call, hedge_target)
+    pending = {primary, hedged}
+    last_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                last_error = future.exception()
+                continue
+            metrics.incr("hedge.wins" if future is hedged else "hedge.primary_wins")
+            for loser in pending:
+                loser.cancel()
+            return future.result()
+    raise last_error
+
+def snapshot():
+    counters = metrics.counters
+    calls = counters.get("hedge.calls", 0)
+    issued = counters.get("hedge.issued", 0)
+    return {
+        "enabled": Config.HEDGE_ENABLED,
+        "budget_tokens": round(budget.tokens, 2),
+        "calls": calls,
+        "issued": issued,
+        "hedge_rate": round(issued / calls, 4) if calls else None,
+        "wins": counters.get("hedge.wins", 0),
+        "win_rate": round(counters.get("hedge.wins", 0) / issued, 4) if issued else None,
+        "thresholds_ms": {key: round(delay * 1000, 1) for key, (delay, _) in list(thresholds.items()) if delay is not None},
+    }
+
+metrics.register_collector("hedging", snapshot)
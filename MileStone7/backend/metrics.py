@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from config import Config
+
+# In-process metrics surface served by /metrics
+lock = threading.Lock()
+counters = defaultdict(int)
+timings = defaultdict(lambda: deque(maxlen=Config.METRICS_WINDOW))
+collectors = {}
+
+
+def incr(name, value=1):
+    with lock:
+        counters[name] += value
+
+# Record one timing sample in milliseconds
+def observe(name, value_ms):
+    with lock:
+        timings[name].append(value_ms)
+
+# Time a request stage into `stages` (ms) and the stage.<name> timing series
+@contextmanager
+def stage(stages, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stages[name] = round(elapsed_ms, 3)
+        observe(f"stage.{name}", elapsed_ms)
+
+# Register a function whose result is published under `name` in the snapshot
+def register_collector(name, fn):
+    collectors[name] = fn
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# p-th percentile (ms) of a timing series, or None while it has fewer than `min_samples` samples
+def series_percentile(name, p, min_samples=1):
+    with lock:
+        values = timings.get(name)
+        if values is None or len(values) < min_samples:
+            return None
+        values = list(values)
+    return percentile(sorted(values), p)
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+def snapshot():
+    with lock:
+        result = {
+            "counters": dict(counters),
+            "timings_ms": {name: list(values) for name, values in timings.items()},
+        }
+    result["timings_ms"] = {name: summarize(values) for name, values in result["timings_ms"].items()}
+    for name, fn in collectors.items():
+        result[name] = fn()
+    return result
@@ -0,0 +1,124 @@
+import argparse
+import http.client
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Local stand-in for the OpenAI, Anthropic and Gemini APIs, for offline pooling and latency tests
+stats = {"connections": 0, "requests": 0}
+stats_lock = threading.Lock()
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+    latency = 0.0
+    handshake_latency = 0.0
+
+    def setup(self):
+        super().setup()
+        with stats_lock:
+            stats["connections"] += 1
+        # Simulates TCP/TLS setup cost, paid once per connection
+        time.sleep(self.handshake_latency)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with stats_lock:
+                self.send_json(200, dict(stats))
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with stats_lock:
+            stats["requests"] += 1
+        time.sleep(self.latency)
+
+        if self.path.endswith("/chat/completions"):
+            text = f"OpenAI mock: {len(request['messages'][-1]['content'])} chars"
+            self.send_json(200, {"choices": [{"message": {"role": "assistant", "content": text}}]})
+        elif self.path.endswith("/messages"):
+            text = f"Anthropic mock: {len(request['messages'][-1]['content'])} chars"
+            self.send_json(200, {"content": [{"type": "text", "text": text}]})
+        elif ":generateContent" in self.path:
+            text = f"Gemini mock: {len(request['contents'][-1]['parts'][0]['text'])} chars"
+            self.send_json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+
+def start_server(port=0, latency_ms=0, handshake_ms=0):
+    MockUpstreamHandler.latency = latency_ms / 1000
+    MockUpstreamHandler.handshake_latency = handshake_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockUpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Compare pooled keep-alive requests with a new connection per request
+def run_benchmark(requests, handshake_ms):
+    from config import Config
+    import providers
+
+    server = start_server(handshake_ms=handshake_ms)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    Config.PROVIDER_BASE_URLS = {"openai": base_url, "anthropic": base_url, "gemini": base_url}
+    body = json.dumps({"model": "gpt-4o", "messages": [{"role": "user", "content": "hello"}]})
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        conn.request("POST", "/v1/chat/completions", body=body, headers={"Content-Type": "application/json", "Connection": "close"})
+        conn.getresponse().read()
+        conn.close()
+    unpooled = time.perf_counter() - start
+    unpooled_connections = stats["connections"]
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        providers.get_provider_response("openai", "gpt-4o", "hello")
+    pooled = time.perf_counter() - start
+    pooled_connections = stats["connections"] - unpooled_connections
+
+    print(f"new connection per request: {unpooled / requests * 1000:7.3f} ms/request, {unpooled_connections} connections")
+    print(f"pooled keep-alive:          {pooled / requests * 1000:7.3f} ms/request, {pooled_connections} connections")
+    providers.close_clients()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic/Gemini upstream")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--handshake-ms", type=float, default=0)
+    parser.add_argument("--bench", type=int, metavar="REQUESTS", help="run the pooling benchmark and exit")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench, args.handshake_ms)
+    else:
+        logging.basicConfig(level=logging.DEBUG)
+        server = start_server(args.port, args.latency_ms, args.handshake_ms)
+        print(f"Mock upstream listening on http://127.0.0.1:{server.server_port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
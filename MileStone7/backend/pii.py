@@ -0,0 +1,232 @@
+import logging
+import re
+import time
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Sensitive-data detectors for routing rules of type "pii": Luhn-valid card numbers, emails, phone
+# numbers and national IDs (US SSN, Aadhaar). One pass over the text finds every candidate, a run
+# of at least 7 digits or an '@' followed by a domain, and only candidates are classified in Python.
+# Large texts are scanned with NumPy (digit runs from vectorized masks); short ones, or any text
+# without NumPy, with a regex whose leading character class lets the engine skip ordinary prose in C.
+
+CARD = "card"
+EMAIL = "email"
+PHONE = "phone"
+NATIONAL_ID = "national_id"
+KINDS = (CARD, EMAIL, PHONE, NATIONAL_ID)
+
+# NumPy is optional; without it every text takes the regex path
+np = None
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+DOMAIN = r"[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}"
+# Up to two separators between consecutive digits, e.g. "4111 1111 ..." or "(555) 123-4567"
+candidate_pattern = re.compile(rf"[@+(0-9](?:(?<=@){DOMAIN}|(?<!@)(?:[ .\-()]{{0,2}}[0-9]){{6,}})")
+email_domain_pattern = re.compile(rf"@{DOMAIN}")
+ssn_pattern = re.compile(r"([0-9]{3})[- ]([0-9]{2})[- ]([0-9]{4})")
+aadhaar_pattern = re.compile(r"[2-9][0-9]{3} ?[0-9]{4} ?[0-9]{4}")
+phone_pattern = re.compile(
+    r"(?:\+?1[ .-]?)?(?:\([0-9]{3}\)|[0-9]{3})[ .-]?[0-9]{3}[ .-]?[0-9]{4}"  # North American
+    r"|(?:\+?91[ .-]?)?[6-9][0-9]{4}[ .-]?[0-9]{5}"  # Indian mobile
+    r"|\+[0-9]{1,3}[ .-]?(?:\([0-9]{1,4}\)[ .-]?)?[0-9]{2,5}(?:[ .-]?[0-9]{2,5}){1,4}"  # any, with country code
+)
+SEPARATORS = " .-()"
+email_local_chars = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-")
+word_chars = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+strip_separators = str.maketrans("", "", SEPARATORS + "+")
+
+
+def luhn_valid(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = ord(digit) - 48
+        if position % 2:
+            value = value * 2 - 9 if value > 4 else value * 2
+        total += value
+    return total % 10 == 0
+
+# Verhoeff check digit, used by Aadhaar numbers
+verhoeff_d = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (1, 2, 3, 4, 0, 6, 7, 8, 9, 5), (2, 3, 4, 0, 1, 7, 8, 9, 5, 6),
+    (3, 4, 0, 1, 2, 8, 9, 5, 6, 7), (4, 0, 1, 2, 3, 9, 5, 6, 7, 8), (5, 9, 8, 7, 6, 0, 4, 3, 2, 1),
+    (6, 5, 9, 8, 7, 1, 0, 4, 3, 2), (7, 6, 5, 9, 8, 2, 1, 0, 4, 3), (8, 7, 6, 5, 9, 3, 2, 1, 0, 4),
+    (9, 8, 7, 6, 5, 4, 3, 2, 1, 0),
+)
+verhoeff_p = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (1, 5, 7, 6, 2, 8, 3, 0, 9, 4), (5, 8, 0, 3, 7, 9, 6, 1, 4, 2),
+    (8, 9, 1, 6, 0, 4, 3, 5, 2, 7), (9, 4, 5, 3, 1, 2, 6, 8, 7, 0), (4, 2, 8, 6, 5, 7, 3, 9, 0, 1),
+    (2, 7, 9, 3, 8, 0, 6, 4, 1, 5), (7, 0, 4, 6, 9, 1, 3, 2, 5, 8),
+)
+
+def verhoeff_valid(digits):
+    check = 0
+    for position, digit in enumerate(reversed(digits)):
+        check = verhoeff_d[check][verhoeff_p[position % 8][ord(digit) - 48]]
+    return check == 0
+
+def ssn_valid(match):
+    area, group, serial = match.groups()
+    return area not in ("000", "666") and area[0] != "9" and group != "00" and serial != "0000"
+
+# Kind of a numeric candidate, or None
+def classify_number(candidate):
+    digits = candidate.translate(strip_separators)
+    count = len(digits)
+    if 13 <= count <= 19 and candidate[0] not in "+(" and luhn_valid(digits):
+        return CARD
+    if count == 9:
+        match = ssn_pattern.fullmatch(candidate)
+        if match and ssn_valid(match):
+            return NATIONAL_ID
+    if count == 12 and aadhaar_pattern.fullmatch(candidate) and verhoeff_valid(digits):
+        return NATIONAL_ID
+    if 8 <= count <= 15 and phone_pattern.fullmatch(candidate):
+        return PHONE
+    return None
+
+def add_number(text, start, end, findings):
+    if start > 0 and text[start - 1] in "+(" and text[start] not in "+(":
+        start -= 1
+    # Part of a longer word or number, e.g. a hash or an identifier
+    if (start > 0 and text[start - 1] in word_chars) or (end < len(text) and text[end] in word_chars):
+        return
+    kind = classify_number(text[start:end])
+    if kind is not None:
+        findings.append((kind, start, end))
+
+# The email around the '@' at `at`; the local part is found by walking back from it
+def add_email(text, at, findings, end=None):
+    if end is None:
+        match = email_domain_pattern.match(text, at)
+        if match is None:
+            return
+        end = match.end()
+    start = at
+    while start > 0 and at - start < 64 and text[start - 1] in email_local_chars:
+        start -= 1
+    if start < at:
+        findings.append((EMAIL, start, end))
+
+separator_table = None
+
+# (start, end) of every run of at least 7 digits with at most two separators between neighbours
+def digit_runs(text):
+    global separator_table
+    if separator_table is None:
+        separator_table = np.zeros(256, dtype=bool)
+        separator_table[[ord(char) for char in SEPARATORS]] = True
+    if text.isascii():
+        codes = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    else:
+        # Code points above 255 are never separators, so they are clipped to index the table
+        codes = np.minimum(np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32), 255).astype(np.uint8)
+    # Unsigned wrap-around makes this one comparison: only '0'..'9' end up below 10
+    positions = np.flatnonzero(codes - np.uint8(48) < 10)
+    if len(positions) < 7:
+        return []
+    gaps = np.diff(positions)
+    first = separator_table[codes[positions[:-1] + 1]]
+    second = separator_table[codes[np.minimum(positions[:-1] + 2, len(codes) - 1)]]
+    joined = (gaps == 1) | ((gaps == 2) & first) | ((gaps == 3) & first & second)
+    breaks = np.flatnonzero(~joined)
+    run_starts = np.concatenate(([0], breaks + 1))
+    run_ends = np.concatenate((breaks, [len(positions) - 1]))
+    long_runs = run_ends - run_starts >= 6
+    return zip(positions[run_starts[long_runs]].tolist(), (positions[run_ends[long_runs]] + 1).tolist())
+
+# Sensitive spans in `text` as (kind, start, end), in order of position
+def scan(text):
+    findings = []
+    if len(text) >= Config.PII_VECTOR_MIN_CHARS and load_numpy() is not None:
+        for start, end in digit_runs(text):
+            add_number(text, start, end, findings)
+        at = text.find("@")
+        while at != -1:
+            add_email(text, at, findings)
+            at = text.find("@", at + 1)
+        findings.sort(key=lambda finding: finding[1])
+        return findings
+
+    for match in candidate_pattern.finditer(text):
+        start, end = match.span()
+        if text[start] == "@":
+            add_email(text, start, findings, end)
+        else:
+            add_number(text, start, end, findings)
+    return findings
+
+
+# What one request contains: spans in the prompt plus the kinds found in an uploaded text file
+class Findings:
+    def __init__(self, spans, file_kinds=()):
+        self.spans = spans
+        self.kinds = frozenset(kind for kind, _, _ in spans) | frozenset(file_kinds)
+
+    def counts(self):
+        counts = {}
+        for kind, _, _ in self.spans:
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+# Uploaded file as text, if it is a text file within PII_MAX_FILE_BYTES; binary formats (PDF, images) are not scanned
+def file_text(file):
+    if file is None or not (file.mimetype or "").startswith(("text/", "application/json", "application/csv")):
+        return None
+    data = file.stream.read(Config.PII_MAX_FILE_BYTES)
+    file.stream.seek(0)
+    return data.decode("utf-8", errors="replace")
+
+# Scan a prompt and its uploaded file in one go
+def scan_request(prompt, file=None):
+    text = file_text(file)
+    findings = Findings(scan(prompt), (kind for kind, _, _ in scan(text)) if text else ())
+    for kind in findings.kinds:
+        metrics.incr(f"pii.{kind}")
+    return findings
+
+
+# Scanner throughput on a synthetic corpus of prose with sensitive data sprinkled in
+if __name__ == '__main__':
+    import random
+    import sys
+
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    random.seed(7)
+    words = ("the of and to in is for on that with as by this from at be are it an or was we can our your "
+             "payment invoice account order shipped 2024 3 items version 1.2 meeting at 10:30 room 42 "
+             "please review the attached report and contact support if anything looks wrong").split()
+    samples = ["4111 1111 1111 1111", "jane.doe@example.com", "+1 (555) 123-4567", "123-45-6789",
+               "2345 6789 0124", "5500-0000-0000-0004", "call 555.987.6543"]
+    chunks = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        chunk = " ".join(random.choices(words, k=200))
+        if random.random() < 0.3:
+            chunk += " " + random.choice(samples)
+        chunks.append(chunk)
+        size += len(chunk) + 1
+    corpus = "\n".join(chunks)
+
+    for label, min_chars in (("vectorized", 0), ("regex", len(corpus) + 1)):
+        if min_chars == 0 and load_numpy() is None:
+            print("NumPy is not installed, skipping the vectorized scanner")
+            continue
+        Config.PII_VECTOR_MIN_CHARS = min_chars
+        scan(corpus[:10000])
+        start = time.perf_counter()
+        found = scan(corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: scanned {len(corpus) / 1e6:.1f} MB in {elapsed * 1000:.0f} ms, "
+              f"{len(corpus) / 1e6 / elapsed:.0f} MB/s; findings {Findings(found).counts()}")
@@ -0,0 +1,297 @@
+import http.client
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+import breaker
+import deadline
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# httpx (and h2 for HTTP/2) are optional and only imported once a real upstream is configured
+httpx = None
+http2_available = False
+optional_imports_done = False
+
+def load_httpx():
+    global httpx, http2_available, optional_imports_done
+    if optional_imports_done:
+        return
+    try:
+        import httpx as httpx_module
+        httpx = httpx_module
+    except ImportError:
+        httpx = None
+    try:
+        import h2  # noqa: F401  (enables HTTP/2 in httpx)
+        http2_available = True
+    except ImportError:
+        http2_available = False
+    optional_imports_done = True
+
+
+class ProviderError(Exception):
+    pass
+
+
+# Canned responses used for providers that have no upstream endpoint configured
+provider_stubs = {
+    "openai": lambda prompt: {
+        "provider": "openai",
+        "model": "gpt-3.5",
+        "response": f"OpenAI: Processed your prompt with advanced language understanding. Response ID: openai_response_001"
+    },
+    "anthropic": lambda prompt: {
+        "provider": "anthropic",
+        "model": "claude-v1",
+        "response": f"Anthropic: Your prompt has been interpreted with ethical AI principles. Response ID: anthropic_response_002"
+    },
+    "gemini": lambda prompt: {
+        "provider": "gemini",
+        "model": "gemini-alpha",
+        "response": f"Gemini: Your prompt has been processed with cutting-edge AI capabilities. Response ID: gemini_response_003"
+    }
+}
+
+
+# Keep-alive connection pool on top of http.client, used when httpx is not installed
+class ConnectionPool:
+    def __init__(self, base_url, size, connect_timeout, read_timeout):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def new_connection(self, timeout=None):
+        conn_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = conn_class(self.host, self.port, timeout=min(self.connect_timeout, timeout) if timeout is not None else self.connect_timeout)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def release(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def post(self, path, body, headers, timeout=None):
+        for attempt in range(2):
+            try:
+                conn = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self.new_connection(timeout)
+                reused = False
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout if timeout is not None else self.read_timeout)
+                conn.request("POST", self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # A pooled connection may have been closed by the server while idle; retry once on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# Shared client for one upstream provider: connection pool, concurrency limit and timeouts
+class ProviderClient:
+    def __init__(self, name, base_url, api_key):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or ""
+        self.slots = threading.BoundedSemaphore(Config.PROVIDER_MAX_CONCURRENCY)
+        if httpx is not None:
+            self.http = httpx.Client(
+                base_url=self.base_url,
+                http2=http2_available,
+                limits=httpx.Limits(
+                    max_connections=Config.PROVIDER_POOL_SIZE,
+                    max_keepalive_connections=Config.PROVIDER_POOL_SIZE,
+                ),
+                timeout=httpx.Timeout(Config.PROVIDER_READ_TIMEOUT, connect=Config.PROVIDER_CONNECT_TIMEOUT),
+            )
+        else:
+            self.http = ConnectionPool(
+                self.base_url, Config.PROVIDER_POOL_SIZE,
+                Config.PROVIDER_CONNECT_TIMEOUT, Config.PROVIDER_READ_TIMEOUT,
+            )
+
+    def post_json(self, path, payload, headers, timeout=None):
+        if not self.slots.acquire(timeout=min(Config.PROVIDER_QUEUE_TIMEOUT, timeout) if timeout is not None else Config.PROVIDER_QUEUE_TIMEOUT):
+            deadline.check("provider")
+            raise ProviderError(f"{self.name}: concurrency limit reached")
+        try:
+            body = json.dumps(payload).encode()
+            headers = {"Content-Type": "application/json", **headers}
+            if httpx is not None:
+                response = self.http.post(path, content=body, headers=headers, timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT)
+                status, data = response.status_code, response.content
+            else:
+                status, data = self.http.post(path, body, headers, timeout)
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise ProviderError(f"{self.name}: upstream request failed: {e}") from e
+        finally:
+            self.slots.release()
+
+        if status >= 400:
+            raise ProviderError(f"{self.name}: upstream returned HTTP {status}")
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise ProviderError(f"{self.name}: invalid upstream JSON") from e
+
+    def close(self):
+        self.http.close()
+
+
+# Earlier (role, content) turns of a conversation plus the new prompt, as OpenAI/Anthropic messages
+def chat_messages(prompt, history):
+    messages = [{"role": role, "content": content} for role, content in history or ()]
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+# Request/response shapes of the OpenAI, Anthropic and Gemini compatible APIs
+def call_openai(client, model, prompt, timeout=None, history=None):
+    data = client.post_json(
+        "/v1/chat/completions",
+        {"model": model, "messages": chat_messages(prompt, history)},
+        {"Authorization": f"Bearer {client.api_key}"},
+        timeout,
+    )
+    return data["choices"][0]["message"]["content"]
+
+def call_anthropic(client, model, prompt, timeout=None, history=None):
+    data = client.post_json(
+        "/v1/messages",
+        {"model": model, "max_tokens": Config.PROVIDER_MAX_TOKENS, "messages": chat_messages(prompt, history)},
+        {"x-api-key": client.api_key, "anthropic-version": "2023-06-01"},
+        timeout,
+    )
+    return data["content"][0]["text"]
+
+def call_gemini(client, model, prompt, timeout=None, history=None):
+    contents = [{"role": "model" if message["role"] == "assistant" else "user", "parts": [{"text": message["content"]}]}
+                for message in chat_messages(prompt, history)]
+    data = client.post_json(
+        f"/v1beta/models/{model}:generateContent",
+        {"contents": contents},
+        {"x-goog-api-key": client.api_key},
+        timeout,
+    )
+    return data["candidates"][0]["content"]["parts"][0]["text"]
+
+provider_calls = {
+    "openai": call_openai,
+    "anthropic": call_anthropic,
+    "gemini": call_gemini,
+}
+
+clients = {}
+clients_lock = threading.Lock()
+
+# Shared client for a provider (or one of a model's deployments), or None when it has no upstream endpoint configured
+def get_client(provider, deployment=None):
+    key = provider if deployment is None else deployment.client_key
+    client = clients.get(key)
+    if client is not None:
+        return client
+    base_url = Config.PROVIDER_BASE_URLS.get(provider) if deployment is None else deployment.base_url
+    if not base_url:
+        return None
+    with clients_lock:
+        if key not in clients:
+            load_httpx()
+            name = provider if deployment is None else deployment.key
+            logger.info(f"Creating upstream client for {name} at {base_url} (httpx={httpx is not None}, http2={http2_available})")
+            api_key = Config.PROVIDER_API_KEYS.get(provider) if deployment is None else deployment.api_key()
+            clients[key] = ProviderClient(name, base_url, api_key)
+        return clients[key]
+
+# Close every pooled upstream connection
+def close_clients():
+    with clients_lock:
+        for client in clients.values():
+            client.close()
+        clients.clear()
+
+# Function to get provider's response; `history` holds earlier (role, content) turns of a session.
+# With a `deployment` (deployments.Deployment) the call goes to that endpoint, under its own breaker.
+def get_provider_response(provider, model, prompt, timeout=None, history=None, deployment=None):
+    logger.debug(f"Received provider: {provider}, model: {model}, prompt: {prompt}")
+
+    if provider not in provider_calls:
+        logger.error(f"Unsupported provider/model combination: {provider}/{model}")
+        return None
+
+    client = get_client(provider, deployment)
+    if client is None:
+        response = provider_stubs[provider](prompt)
+    else:
+        health_key = provider if deployment is None else deployment.key
+        if not breaker.allow(health_key):
+            metrics.incr(f"breaker.{health_key}.rejected")
+            raise ProviderError(f"{health_key}: circuit open")
+        if deployment is not None:
+            deployment.stats.started()
+        start = time.perf_counter()
+        ok = None  # the call's verdict on the endpoint's health; None when it says nothing
+        try:
+            text = provider_calls[provider](client, model, prompt, timeout, history)
+            ok = True
+        except (KeyError, IndexError, TypeError) as e:
+            ok = False
+            raise ProviderError(f"{health_key}: unexpected upstream response shape: {e}") from e
+        except ProviderError:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # Running out of a caller's budget tighter than the read timeout says nothing about the provider's health
+            if timeout is None or timeout >= Config.PROVIDER_READ_TIMEOUT or elapsed_ms < timeout * 1000:
+                ok = False
+            raise
+        finally:
+            # Also reached by DeadlineExceeded: a half-open probe must be handed back either way
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if ok is None:
+                breaker.release(health_key)
+            else:
+                breaker.record(health_key, elapsed_ms, ok)
+            if deployment is not None:
+                deployment.stats.finished(elapsed_ms, bool(ok))
+        metrics.observe(f"provider.{health_key}", elapsed_ms)
+        logger.debug(f"{health_key} answered in {elapsed_ms:.1f} ms")
+        response = {"provider": provider, "model": model, "response": text}
+        if deployment is not None:
+            response["deployment"] = deployment.name
+
+    logger.debug(f"Generated response: {response}")
+    return response
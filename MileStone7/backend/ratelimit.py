@@ -0,0 +1,245 @@
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+import deadline
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Shared-memory layout: magic, per-worker (pid, in_flight, waiting) slots, then token buckets
+MAGIC = 0x554E42524C310001
+HEADER = struct.Struct("<Q")
+WORKER = struct.Struct("<qqq")
+BUCKET = struct.Struct("<Qdd")  # key hash, tokens, last refill
+PROBE_LIMIT = 8
+
+
+class RateLimited(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Token buckets and an in-flight counter kept in an mmap'ed file, so every worker process on the host shares them
+class SharedLimiter:
+    def __init__(self, path, worker_slots, bucket_slots):
+        self.path = path
+        self.worker_slots = worker_slots
+        self.bucket_slots = bucket_slots
+        self.workers_offset = HEADER.size
+        self.buckets_offset = self.workers_offset + worker_slots * WORKER.size
+        self.size = self.buckets_offset + bucket_slots * BUCKET.size
+        self.thread_lock = threading.Lock()
+        self.pid = os.getpid()
+        self.worker_index = None
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked():
+            if os.fstat(self.fd).st_size != self.size:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+            self.mm = mmap.mmap(self.fd, self.size)
+            if HEADER.unpack_from(self.mm, 0)[0] != MAGIC:
+                self.mm[:] = bytes(self.size)
+                HEADER.pack_into(self.mm, 0, MAGIC)
+
+    # flock serializes processes; the thread lock is needed because threads of one process share the flock
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    # ---- per-worker in-flight accounting ----
+
+    def read_worker(self, index):
+        return list(WORKER.unpack_from(self.mm, self.workers_offset + index * WORKER.size))
+
+    def write_worker(self, index, values):
+        WORKER.pack_into(self.mm, self.workers_offset + index * WORKER.size, *values)
+
+    # Slot of this process, claimed on first use (called with the lock held)
+    def own_worker(self):
+        if self.worker_index is not None:
+            return self.worker_index
+        for index in range(self.worker_slots):
+            pid, _, _ = self.read_worker(index)
+            if pid == 0 or pid == self.pid or not pid_alive(pid):
+                self.write_worker(index, [self.pid, 0, 0])
+                self.worker_index = index
+                return index
+        raise RuntimeError("No free rate limiter worker slot; raise RATE_LIMIT_WORKER_SLOTS")
+
+    # Total in-flight and waiting requests across workers (called with the lock held)
+    def totals(self, sweep=False):
+        in_flight = waiting = 0
+        for index in range(self.worker_slots):
+            pid, count, queued = self.read_worker(index)
+            if pid == 0:
+                continue
+            # Counts left behind by a crashed worker are dropped
+            if sweep and pid != self.pid and not pid_alive(pid):
+                self.write_worker(index, [0, 0, 0])
+                continue
+            in_flight += count
+            waiting += queued
+        return in_flight, waiting
+
+    def adjust(self, in_flight=0, waiting=0):
+        index = self.own_worker()
+        pid, count, queued = self.read_worker(index)
+        self.write_worker(index, [pid, count + in_flight, queued + waiting])
+
+    def try_enter(self, cap):
+        in_flight, _ = self.totals()
+        if in_flight >= cap:
+            in_flight, _ = self.totals(sweep=True)
+        if in_flight < cap:
+            self.adjust(in_flight=1)
+            return True
+        return False
+
+    # Take one of `cap` global in-flight slots, waiting in a bounded queue for up to `timeout` seconds
+    def admit(self, cap, queue_max, timeout):
+        with self.locked():
+            if self.try_enter(cap):
+                return
+            _, waiting = self.totals()
+            if waiting >= queue_max:
+                raise RateLimited("Server is at capacity", Config.ADMISSION_RETRY_AFTER)
+            self.adjust(waiting=1)
+
+        deadline = time.monotonic() + timeout
+        delay = 0.002
+        try:
+            while True:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                with self.locked():
+                    if self.try_enter(cap):
+                        return
+                if time.monotonic() >= deadline:
+                    raise RateLimited("Timed out waiting for capacity", Config.ADMISSION_RETRY_AFTER)
+        finally:
+            with self.locked():
+                self.adjust(waiting=-1)
+
+    def release(self):
+        with self.locked():
+            self.adjust(in_flight=-1)
+
+    # ---- token buckets ----
+
+    # Offset of the bucket for `key_hash`, evicting the stalest bucket in the probe window when full
+    def find_bucket(self, key_hash):
+        start = key_hash % self.bucket_slots
+        victim = None
+        victim_updated = None
+        for probe in range(PROBE_LIMIT):
+            offset = self.buckets_offset + ((start + probe) % self.bucket_slots) * BUCKET.size
+            stored_hash, _, updated = BUCKET.unpack_from(self.mm, offset)
+            if stored_hash == key_hash:
+                return offset, False
+            if stored_hash == 0:
+                return offset, True
+            if victim is None or updated < victim_updated:
+                victim, victim_updated = offset, updated
+        return victim, True
+
+    # Take `cost` tokens from the bucket for `key`; returns 0 if allowed, else seconds until it would be
+    def take(self, key, rate, burst, cost=1.0):
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+        now = time.monotonic()
+        with self.locked():
+            offset, fresh = self.find_bucket(key_hash)
+            if fresh:
+                tokens = burst
+            else:
+                _, tokens, updated = BUCKET.unpack_from(self.mm, offset)
+                tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                BUCKET.pack_into(self.mm, offset, key_hash, tokens - cost, now)
+                return 0
+            BUCKET.pack_into(self.mm, offset, key_hash, tokens, now)
+            return (cost - tokens) / rate
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+limiter = None
+limiter_lock = threading.Lock()
+
+# Limiter for the current process; reopened after fork so each worker gets its own flock
+def get_limiter():
+    global limiter
+    if limiter is None or limiter.pid != os.getpid():
+        with limiter_lock:
+            if limiter is None or limiter.pid != os.getpid():
+                limiter = SharedLimiter(Config.RATE_LIMIT_SHM_PATH, Config.RATE_LIMIT_WORKER_SLOTS, Config.RATE_LIMIT_BUCKETS)
+    return limiter
+
+# Raise RateLimited when the client has exhausted its token bucket
+def check_client(client_key):
+    if not Config.RATE_LIMIT_ENABLED:
+        return
+    retry_after = get_limiter().take(f"client:{client_key}", Config.CLIENT_RATE, Config.CLIENT_BURST)
+    if retry_after:
+        metrics.incr("ratelimit.client_rejected")
+        raise RateLimited("Client rate limit exceeded", retry_after)
+
+# Raise RateLimited when the provider has exhausted its token bucket
+def check_provider(provider):
+    if not Config.RATE_LIMIT_ENABLED or provider not in Config.PROVIDER_RATE_LIMITS:
+        return
+    rate, burst = Config.PROVIDER_RATE_LIMITS[provider]
+    retry_after = get_limiter().take(f"provider:{provider}", rate, burst)
+    if retry_after:
+        metrics.incr(f"ratelimit.provider.{provider}.rejected")
+        raise RateLimited(f"Provider {provider} rate limit exceeded", retry_after)
+
+# Hold one global in-flight slot for the duration of the block; batch requests only get BATCH_ADMISSION_SHARE
+# of MAX_IN_FLIGHT, so interactive ones are still admitted while batch work fills the scheduler queues
+@contextmanager
+def admission(batch=False):
+    if not Config.RATE_LIMIT_ENABLED:
+        yield
+        return
+    shared = get_limiter()
+    cap = max(1, int(Config.MAX_IN_FLIGHT * Config.BATCH_ADMISSION_SHARE)) if batch else Config.MAX_IN_FLIGHT
+    try:
+        shared.admit(cap, Config.ADMISSION_QUEUE_SIZE, deadline.bounded(Config.ADMISSION_QUEUE_TIMEOUT))
+    except RateLimited:
+        metrics.incr("ratelimit.admission_rejected")
+        deadline.check("admission")
+        raise
+    try:
+        yield
+    finally:
+        shared.release()
+
+def retry_after_header(retry_after):
+    return str(max(1, math.ceil(retry_after)))
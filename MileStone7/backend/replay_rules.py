@@ -0,0 +1,238 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+import pii
+import routing
+from db import connect_db
+
+# Dry-run a candidate rule set against a recorded prompt log, without touching live routing.
+#
+#   python replay_rules.py --log prompts.ndjson --rules candidate.json [--include-live [--tenant NAME]] [--json]
+#
+# The log is NDJSON with "model" and "prompt" fields (the gateway's capture log works as is;
+# records captured without prompt bodies are skipped). The rules file is a JSON list in the
+# POST /regex-rules format: pattern, originalModel, redirectModel, type, action, exemplars, threshold, priority.
+# Redirects resolve against the models --tenant can see, as live routing would; rules redirecting to
+# a model that does not exist count hits but never redirect.
+
+BUCKETS_PER_OCTAVE = 4
+BUCKET_COUNT = 64 * BUCKETS_PER_OCTAVE
+
+
+# Log-scale histogram bucket for a duration in ns
+def bucket(elapsed_ns):
+    return min(BUCKET_COUNT - 1, int(math.log2(max(elapsed_ns, 1)) * BUCKETS_PER_OCTAVE))
+
+# Upper bound in microseconds of the bucket holding the p-th percentile
+def histogram_percentile(counts, p):
+    total = sum(counts)
+    if not total:
+        return None
+    target = math.ceil(total * p / 100)
+    running = 0
+    for index, count in enumerate(counts):
+        running += count
+        if running >= target:
+            return round(2 ** ((index + 1) / BUCKETS_PER_OCTAVE) / 1000, 3)
+
+# Candidate rules file -> (policies, exemplars) rows in the routing.fetch_policies shape, with negative ids
+def load_candidates(path):
+    with open(path) as f:
+        candidates = json.load(f)
+    policies = []
+    exemplars = {}
+    for index, rule in enumerate(candidates, start=1):
+        rule_id = -index
+        policies.append((
+            rule_id,
+            rule["originalModel"],
+            rule.get("type", routing.REGEX),
+            rule.get("pattern", ""),
+            rule.get("redirectModel", ""),
+            rule.get("threshold"),
+            int(rule.get("priority") or 0),
+            rule.get("action") or routing.REDIRECT,
+        ))
+        if rule.get("exemplars"):
+            exemplars[rule_id] = rule["exemplars"]
+    return policies, exemplars
+
+# Models the tenant can see, plus its live (policies, exemplars) when `include_live` is set
+def load_live(tenant, include_live):
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM tenants WHERE name = %s;", (tenant,))
+        row = cur.fetchone()
+        if row is None:
+            sys.exit(f"Unknown tenant: {tenant}")
+        cur.execute("SELECT name FROM models WHERE tenant_id IS NULL OR tenant_id = %s ORDER BY name;", (row[0],))
+        model_names = [name for (name,) in cur.fetchall()]
+        if not include_live:
+            return model_names, [], {}
+        policies, exemplars = routing.fetch_policies(cur, row[0])
+        return model_names, list(policies), exemplars
+    finally:
+        conn.close()
+
+def read_log(path, chunk_size):
+    chunk = []
+    skipped = 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get("prompt") or not record.get("model"):
+                skipped += 1
+                continue
+            chunk.append((record["model"], record["prompt"]))
+            if len(chunk) >= chunk_size:
+                yield chunk, skipped
+                chunk, skipped = [], 0
+    if chunk or skipped:
+        yield chunk, skipped
+
+
+worker_snapshot = None
+
+def init_worker(model_names, policies, exemplars):
+    global worker_snapshot
+    worker_snapshot = routing.PolicySnapshot(None, model_names, policies, exemplars)
+
+# Evaluate every rule on every prompt of the chunk, in the planner's order: priority tiers, each ordered
+# by expected cost per hit. The first redirect rule that matches and resolves wins, as in live routing;
+# redact rules only count hits. The planner here starts from static cost estimates, so where rules of
+# one tier overlap, live routing (ordered by measured costs) may pick a different one of them.
+def evaluate_chunk(args):
+    chunk, skipped = args
+    snapshot = worker_snapshot
+    hits = {}
+    wins = {}
+    histograms = {}
+    unmatched = 0
+    for model, prompt in chunk:
+        scores = None
+        findings = None
+        winner = None
+        for rule in snapshot.plans.get(model, []) + snapshot.redactions.get(model, []):
+            start = time.perf_counter_ns()
+            if rule.literal is not None:
+                matched = rule.literal in prompt
+            elif rule.type == routing.REGEX:
+                matched = rule.pattern.search(prompt) is not None
+            elif rule.type == routing.PII:
+                if findings is None:
+                    findings = pii.Findings(pii.scan(prompt))
+                matched = not rule.kinds.isdisjoint(findings.kinds)
+            else:
+                if scores is None:
+                    scores = snapshot.semantic_scores(model, prompt)
+                matched = scores[rule.semantic_index] >= rule.threshold
+            elapsed_ns = time.perf_counter_ns() - start
+
+            histogram = histograms.get(rule.id)
+            if histogram is None:
+                histogram = histograms[rule.id] = [0] * BUCKET_COUNT
+            histogram[bucket(elapsed_ns)] += 1
+            if matched:
+                hits[rule.id] = hits.get(rule.id, 0) + 1
+                if (winner is None and rule.action == routing.REDIRECT
+                        and snapshot.resolve_redirect(rule.redirect_model) is not None):
+                    winner = rule
+        if winner is None:
+            unmatched += 1
+        else:
+            wins[winner.id] = wins.get(winner.id, 0) + 1
+    return len(chunk), skipped, unmatched, hits, wins, histograms
+
+def replay(log_path, model_names, policies, exemplars, workers, chunk_size):
+    # Snapshots take policies ordered by priority, then id (candidates after live rules), as fetch_policies returns them
+    policies = sorted(policies, key=lambda policy: (-policy[6], policy[0] if policy[0] > 0 else -policy[0] + 1e9))
+    totals = {"prompts": 0, "skipped": 0, "unmatched": 0}
+    hits = {}
+    wins = {}
+    histograms = {}
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(model_names, policies, exemplars)) as pool:
+        for count, skipped, unmatched, chunk_hits, chunk_wins, chunk_histograms in pool.imap_unordered(
+                evaluate_chunk, read_log(log_path, chunk_size)):
+            totals["prompts"] += count
+            totals["skipped"] += skipped
+            totals["unmatched"] += unmatched
+            for rule_id, value in chunk_hits.items():
+                hits[rule_id] = hits.get(rule_id, 0) + value
+            for rule_id, value in chunk_wins.items():
+                wins[rule_id] = wins.get(rule_id, 0) + value
+            for rule_id, counts in chunk_histograms.items():
+                merged = histograms.setdefault(rule_id, [0] * BUCKET_COUNT)
+                for index, value in enumerate(counts):
+                    merged[index] += value
+
+    rules = []
+    redirects = {}
+    for rule_id, model_name, rule_type, pattern, redirect_model, _, priority, action in policies:
+        counts = histograms.get(rule_id, [])
+        rules.append({
+            "id": rule_id,
+            "candidate": rule_id < 0,
+            "model_name": model_name,
+            "type": rule_type,
+            "action": action,
+            "pattern": pattern,
+            "redirect_model": redirect_model,
+            "priority": priority,
+            "evaluations": sum(counts),
+            "hits": hits.get(rule_id, 0),
+            "redirects": wins.get(rule_id, 0),
+            "match_us": {f"p{p}": histogram_percentile(counts, p) for p in (50, 95, 99)},
+        })
+        if action == routing.REDIRECT:
+            redirects[redirect_model] = redirects.get(redirect_model, 0) + wins.get(rule_id, 0)
+    return {"totals": totals, "redirect_distribution": redirects, "rules": rules}
+
+def print_report(report):
+    totals = report["totals"]
+    print(f"prompts: {totals['prompts']}  skipped: {totals['skipped']}  unmatched: {totals['unmatched']}")
+    print("redirects:")
+    for redirect_model, count in sorted(report["redirect_distribution"].items(), key=lambda item: -item[1]):
+        share = count / totals["prompts"] * 100 if totals["prompts"] else 0
+        print(f"  {redirect_model:<24} {count:>10} ({share:.2f}%)")
+    print(f"{'rule':>6} {'model':<16} {'type':<9} {'action':<8} {'prio':>4} {'hits':>9} {'redirects':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}  pattern")
+    for rule in report["rules"]:
+        label = f"{'*' if rule['candidate'] else ''}{abs(rule['id'])}"
+        timings = [rule["match_us"][key] for key in ("p50", "p95", "p99")]
+        timings = [f"{t:>9.3f}" if t is not None else f"{'-':>9}" for t in timings]
+        print(f"{label:>6} {rule['model_name']:<16} {rule['type']:<9} {rule['action']:<8} {rule['priority']:>4} {rule['hits']:>9} {rule['redirects']:>9} "
+              f"{' '.join(timings)}  {rule['pattern'][:40]}")
+    print("(* = candidate rule)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a prompt log against candidate routing rules")
+    parser.add_argument("--log", required=True, help="NDJSON prompt log")
+    parser.add_argument("--rules", help="candidate rules (JSON list in POST /regex-rules format)")
+    parser.add_argument("--include-live", action="store_true", help="evaluate the candidates together with the live rules")
+    parser.add_argument("--tenant", default=routing.DEFAULT_TENANT, help="tenant whose models (and live rules) are used")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    policies, exemplars = load_candidates(args.rules) if args.rules else ([], {})
+    model_names, live_policies, live_exemplars = load_live(args.tenant, args.include_live)
+    policies += live_policies
+    exemplars.update(live_exemplars)
+    if not policies:
+        sys.exit("No rules to evaluate: pass --rules and/or --include-live")
+
+    report = replay(args.log, model_names, policies, exemplars, args.workers, args.chunk_size)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
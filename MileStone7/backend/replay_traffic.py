@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import metrics
+
+# Play a capture log (see capture.py) back against any gateway build.
+#
+#   python replay_traffic.py capture.ndjson --target http://localhost:5006 [--speed 2] [--concurrency 32]
+#
+# --speed 1 keeps the original inter-arrival times, 2 plays twice as fast, 0 sends as fast as possible.
+# Requests carry X-Replay with the gateway's CAPTURE_REPLAY_SECRET (--replay-secret, or the same environment
+# variable) so a capturing target does not record them again.
+# Records captured without prompt bodies are replayed with a deterministic filler prompt of the same size.
+
+FILLER_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+                "incididunt ut labore et dolore magna aliqua").split()
+
+
+# Same prompt every run for a given record: seeded from the captured hash
+def synthesize_prompt(entry):
+    rng = random.Random(entry.get("prompt_sha256", ""))
+    words = []
+    size = 0
+    while size < entry.get("prompt_chars", 1):
+        word = rng.choice(FILLER_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:entry.get("prompt_chars", 1)] or "x"
+
+def synthesize_file(entry):
+    meta = entry["file"]
+    seed = hashlib.sha256(f"{meta.get('name')}:{meta.get('size')}".encode()).digest()
+    data = (seed * (meta.get("size", 0) // len(seed) + 1))[:meta.get("size", 0)]
+    return meta.get("name") or "upload.bin", meta.get("content_type") or "application/octet-stream", data
+
+def encode_multipart(fields, file=None):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    if file is not None:
+        filename, content_type, data = file
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def load_capture(path, limit=None):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+            if limit and len(entries) >= limit:
+                break
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries
+
+
+class Replayer:
+    def __init__(self, target, speed, concurrency, headers, replay_secret=None):
+        parts = urlsplit(target)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.speed = speed
+        self.headers = headers
+        self.replay_secret = replay_secret
+        self.pool = ThreadPoolExecutor(concurrency)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.lags = []
+        self.errors = 0
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self.local.conn = conn_class(self.host, self.port, timeout=120)
+        return conn
+
+    def send(self, entry, scheduled_at):
+        lag_ms = (time.perf_counter() - scheduled_at) * 1000
+        fields = {
+            "provider": entry.get("provider") or "",
+            "model": entry.get("model") or "",
+            "prompt": entry.get("prompt") or synthesize_prompt(entry),
+        }
+        body, content_type = encode_multipart(fields, synthesize_file(entry) if entry.get("file") else None)
+        headers = {"Content-Type": content_type}
+        if self.replay_secret:
+            headers["X-Replay"] = self.replay_secret
+        if entry.get("tenant"):
+            headers["X-Tenant"] = entry["tenant"]
+        headers.update(self.headers)
+        start = time.perf_counter()
+        try:
+            conn = self.connection()
+            conn.request("POST", "/v1/chat/completions", body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except Exception as e:
+            self.local.conn = None
+            with self.lock:
+                self.errors += 1
+            print(f"request failed: {e}", file=sys.stderr)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.latencies.setdefault(status, []).append(elapsed_ms)
+            self.lags.append(lag_ms)
+
+    # Dispatch every entry at its (scaled) original offset from the first one
+    def run(self, entries):
+        if not entries:
+            return 0.0
+        first_ts = entries[0]["ts"]
+        start = time.perf_counter()
+        for entry in entries:
+            scheduled_at = start
+            if self.speed > 0:
+                scheduled_at += (entry["ts"] - first_ts) / self.speed
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.pool.submit(self.send, entry, scheduled_at)
+        self.pool.shutdown(wait=True)
+        return time.perf_counter() - start
+
+    def report(self, wall_seconds):
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"replayed {total} requests in {wall_seconds:.2f} s ({total / wall_seconds if wall_seconds else 0:.1f} req/s), {self.errors} transport errors")
+        for status, values in sorted(self.latencies.items()):
+            summary = metrics.summarize(values)
+            print(f"  HTTP {status}: {summary['count']:>7} requests  p50={summary['p50']:.1f} ms  p95={summary['p95']:.1f} ms  p99={summary['p99']:.1f} ms")
+        if self.lags:
+            summary = metrics.summarize(self.lags)
+            print(f"  dispatch lag behind schedule: p50={summary['p50']:.1f} ms  p99={summary['p99']:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay captured gateway traffic")
+    parser.add_argument("capture", help="NDJSON capture log")
+    parser.add_argument("--target", default="http://localhost:5006")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--header", action="append", default=[], help="extra header, e.g. 'X-API-Key: ...'")
+    parser.add_argument("--replay-secret", default=os.getenv("CAPTURE_REPLAY_SECRET"),
+                        help="target's CAPTURE_REPLAY_SECRET, so replayed requests are not captured")
+    args = parser.parse_args()
+
+    extra_headers = dict(header.split(":", 1) for header in args.header)
+    extra_headers = {name.strip(): value.strip() for name, value in extra_headers.items()}
+    entries = load_capture(args.capture, args.limit)
+    replayer = Replayer(args.target, args.speed, args.concurrency, extra_headers, args.replay_secret)
+    replayer.report(replayer.run(entries))
@@ -0,0 +1,662 @@
+import itertools
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import psycopg2
+import deployments
+import metrics
+import pii
+from config import Config
+from db import connect_replica, get_fingerprint, read_position
+
+logger = logging.getLogger(__name__)
+
+# NumPy is only needed by semantic rules, so it is imported when the first one is compiled
+np = None
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+REGEX = "regex"
+SEMANTIC = "semantic"
+PII = "pii"
+LITERAL = "literal"
+RULE_TYPES = (REGEX, SEMANTIC, PII)
+
+# What a matching rule does: send the prompt to its redirect model, or mask the matched spans and keep the model
+REDIRECT = "redirect"
+REDACT = "redact"
+ACTIONS = (REDIRECT, REDACT)
+
+DEFAULT_TENANT = "default"
+
+word_pattern = re.compile(r"\w+")
+
+
+# Dependency-free embedder: signed feature hashing of words and character trigrams
+class HashingEmbedder:
+    def __init__(self, dim):
+        self.dim = dim
+
+    def features(self, text):
+        words = word_pattern.findall(text.lower())
+        features = list(words)
+        for word in words:
+            padded = f" {word} "
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in self.features(text)), dtype=np.uint32)
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+            matrix[row] = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+# Local sentence-transformers model, used when EMBEDDING_MODEL is set
+class SentenceTransformerEmbedder:
+    def __init__(self, name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(name, device="cpu")
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+embedder = None
+embedder_lock = threading.Lock()
+embedding_cache = {}
+
+def get_embedder():
+    global embedder
+    if embedder is None:
+        with embedder_lock:
+            if embedder is None:
+                if Config.EMBEDDING_MODEL:
+                    try:
+                        embedder = SentenceTransformerEmbedder(Config.EMBEDDING_MODEL)
+                    except ImportError:
+                        logger.warning("sentence-transformers is not installed, using the hashing embedder")
+                if embedder is None:
+                    embedder = HashingEmbedder(Config.EMBEDDING_DIM)
+    return embedder
+
+# Embed exemplar phrases, reusing vectors from earlier snapshots
+def embed_exemplars(phrases):
+    missing = [phrase for phrase in dict.fromkeys(phrases) if phrase not in embedding_cache]
+    if missing:
+        if len(embedding_cache) + len(missing) > Config.EMBEDDING_CACHE_SIZE:
+            embedding_cache.clear()
+        for phrase, vector in zip(missing, get_embedder().embed(missing)):
+            embedding_cache[phrase] = vector
+    return np.stack([embedding_cache[phrase] for phrase in phrases])
+
+
+# Exemplar vectors of one model's semantic rules, grouped contiguously per rule
+class SemanticIndex:
+    def __init__(self, phrases, starts):
+        self.matrix = embed_exemplars(phrases)
+        self.starts = np.array(starts)
+
+    # Best similarity of the prompt vector against each rule's exemplars
+    def scores(self, vector):
+        return np.maximum.reduceat(self.matrix @ vector, self.starts)
+
+
+# Measured evaluation cost and hit rate of one rule, kept across snapshot reloads
+class RuleStats:
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.cost_ns = None
+
+    def record(self, elapsed_ns, matched):
+        self.evaluations += 1
+        self.hits += matched
+        alpha = Config.PLANNER_EWMA_ALPHA
+        self.cost_ns = elapsed_ns if self.cost_ns is None else (1 - alpha) * self.cost_ns + alpha * elapsed_ns
+
+    # Laplace-smoothed so unmeasured rules are neither favoured nor buried
+    def hit_rate(self):
+        return (self.hits + 1) / (self.evaluations + 2)
+
+
+rule_stats = {}  # rule id -> RuleStats, for the rules of cached snapshots
+
+# Forget the measurements of rules no cached snapshot holds any more
+def drop_rule_stats(rule_ids):
+    for rule_id in rule_ids:
+        rule_stats.pop(rule_id, None)
+
+# Static cost guesses (ns) used until a rule has been measured
+default_costs = {LITERAL: 200, REGEX: 2000, SEMANTIC: 500000, PII: 300}
+
+
+class Rule:
+    def __init__(self, rule_id, rule_type, pattern, redirect_model, threshold, priority=0, kinds=None, action=REDIRECT):
+        self.id = rule_id
+        self.type = rule_type
+        self.action = action
+        self.pattern = pattern
+        self.kinds = kinds  # sensitive-data kinds a PII rule fires on
+        self.redirect_model = redirect_model
+        self.threshold = threshold
+        self.priority = priority
+        self.semantic_index = None  # position in the model's SemanticIndex
+        self.stats = rule_stats.setdefault(rule_id, RuleStats())
+        # Patterns without metacharacters are plain substring checks
+        self.literal = pattern.pattern if pattern is not None and re.escape(pattern.pattern) == pattern.pattern else None
+
+    def kind(self):
+        return LITERAL if self.literal is not None else self.type
+
+    # Expected cost of reaching a match; tiers are ordered by this, lowest first
+    def score(self):
+        cost = self.stats.cost_ns if self.stats.cost_ns is not None else default_costs[self.kind()]
+        return cost / self.stats.hit_rate()
+
+
+# Evaluation order: priority tiers highest first, each tier ordered by measured cost per hit
+def plan_rules(rules):
+    plan = []
+    for _, tier in itertools.groupby(rules, key=lambda rule: rule.priority):
+        plan.extend(sorted(tier, key=Rule.score))
+    return plan
+
+
+# Compiled view of the models and routing policies at one version; only the evaluation plans change
+class PolicySnapshot:
+    def __init__(self, fingerprint, model_names, policies, exemplars):
+        self.fingerprint = fingerprint
+        self.model_names = model_names
+        self.rules = {}
+        self.plans = {}
+        self.counters = {}
+        self.indexes = {}
+        self.redirects = {}
+        self.redactions = {}
+        self.pii_models = set()
+        self.rule_ids = set()
+
+        # Policies arrive ordered by priority (highest first), then id
+        for rule_id, model_name, rule_type, pattern, redirect_model, threshold, priority, action in policies:
+            if action == REDACT and rule_type == SEMANTIC:
+                logger.error(f"Semantic rule {rule_id} has no spans to redact, skipping")
+                continue
+            if rule_type == SEMANTIC:
+                if load_numpy() is None:
+                    logger.error(f"NumPy is not installed, skipping semantic rule {rule_id}")
+                    continue
+                if not exemplars.get(rule_id):
+                    logger.warning(f"Semantic rule {rule_id} has no exemplars, skipping")
+                    continue
+                # A stored threshold of 0 is valid (match everything), so only a missing one takes the default
+                if threshold is None:
+                    threshold = Config.SEMANTIC_DEFAULT_THRESHOLD
+                rule = Rule(rule_id, SEMANTIC, None, redirect_model, threshold, priority)
+            elif rule_type == PII:
+                # The pattern lists the kinds it fires on, comma-separated; empty means any
+                kinds = frozenset(filter(None, (kind.strip() for kind in pattern.split(","))))
+                rule = Rule(rule_id, PII, None, redirect_model, None, priority, kinds or frozenset(pii.KINDS), action)
+                self.pii_models.add(model_name)
+            else:
+                try:
+                    rule = Rule(rule_id, REGEX, re.compile(pattern), redirect_model, None, priority, action=action)
+                except re.error as e:
+                    logger.error(f"Invalid regex in rule {rule_id}: {e}")
+                    continue
+            self.rule_ids.add(rule_id)
+            if action == REDACT:
+                # Every matching redact rule applies, so they stay out of the first-match plan
+                self.redactions.setdefault(model_name, []).append(rule)
+                continue
+            self.rules.setdefault(model_name, []).append(rule)
+
+        for model_name, rules in self.rules.items():
+            phrases = []
+            starts = []
+            for rule in rules:
+                if rule.type == SEMANTIC:
+                    rule.semantic_index = len(starts)
+                    starts.append(len(phrases))
+                    phrases.extend(exemplars[rule.id])
+            if phrases:
+                self.indexes[model_name] = SemanticIndex(phrases, starts)
+            self.plans[model_name] = plan_rules(rules)
+            self.counters[model_name] = itertools.count(1)
+
+    # Provider of the first model whose name contains the redirect model
+    def resolve_redirect(self, redirect_model):
+        if redirect_model not in self.redirects:
+            provider = None
+            for name in self.model_names:
+                if redirect_model in name:
+                    provider = name.split("/")[0]
+                    break
+            self.redirects[redirect_model] = provider
+        return self.redirects[redirect_model]
+
+    # Per-rule semantic scores for the prompt. SEMANTIC_BUDGET_MS is a latency target, not a cutoff: a slower
+    # embedding still decides the match, and is only logged and counted in routing.semantic_over_budget
+    def semantic_scores(self, model, prompt):
+        start = time.perf_counter()
+        vector = get_embedder().embed([prompt[:Config.SEMANTIC_MAX_CHARS]])[0]
+        scores = self.indexes[model].scores(vector)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("routing.semantic", elapsed_ms)
+        if elapsed_ms > Config.SEMANTIC_BUDGET_MS:
+            metrics.incr("routing.semantic_over_budget")
+            logger.warning(f"Semantic routing took {elapsed_ms:.1f} ms, over the {Config.SEMANTIC_BUDGET_MS} ms budget")
+        return scores
+
+    # Whether rules of `model` need the request scanned for sensitive data
+    def scans_pii(self, model):
+        return model in self.pii_models
+
+    # First matching rule for the prompt in planned order, as (redirect_model, provider).
+    # `findings` is the request's pii.Findings; without it the prompt is scanned when a PII rule is reached.
+    def match(self, model, prompt, findings=None):
+        plan = self.plans.get(model)
+        if not plan:
+            logger.debug("No matching routing policy found.")
+            return None, None
+
+        # Every PLANNER_SAMPLE_EVERY-th match is timed to feed the planner
+        sample = next(self.counters[model])
+        measure = sample % Config.PLANNER_SAMPLE_EVERY == 0
+        scores = None
+        result = None, None
+        for rule in plan:
+            if measure:
+                start = time.perf_counter_ns()
+            if rule.literal is not None:
+                matched = rule.literal in prompt
+            elif rule.type == REGEX:
+                matched = rule.pattern.search(prompt) is not None
+            elif rule.type == PII:
+                if findings is None:
+                    findings = pii.Findings(pii.scan(prompt))
+                matched = not rule.kinds.isdisjoint(findings.kinds)
+            else:
+                if scores is None:
+                    scores = self.semantic_scores(model, prompt)
+                matched = scores[rule.semantic_index] >= rule.threshold
+            if measure:
+                rule.stats.record(time.perf_counter_ns() - start, matched)
+            if not matched:
+                continue
+
+            logger.debug(f"Prompt matched {rule.type} rule {rule.id}")
+            provider = self.resolve_redirect(rule.redirect_model)
+            if provider is not None:
+                logger.debug(f"Redirecting to model: {rule.redirect_model} with provider: {provider}")
+                result = rule.redirect_model, provider
+                break
+        else:
+            logger.debug("No matching routing policy found.")
+
+        if measure and sample % (Config.PLANNER_SAMPLE_EVERY * Config.PLANNER_REPLAN_EVERY) == 0:
+            self.plans[model] = plan_rules(self.rules[model])
+        return result
+
+    # Whether `model` has redact rules
+    def redacts(self, model):
+        return model in self.redactions
+
+    # Spans of the prompt to mask as (start, end, label), in order of position. PII rules reuse the
+    # spans of `findings`; regex rules contribute all of their matches.
+    def redaction_spans(self, model, prompt, findings=None):
+        spans = []
+        for rule in self.redactions.get(model, ()):
+            if rule.type == PII:
+                if findings is None:
+                    findings = pii.Findings(pii.scan(prompt))
+                spans.extend((start, end, kind) for kind, start, end in findings.spans if kind in rule.kinds)
+            else:
+                spans.extend((match.start(), match.end(), "redacted") for match in rule.pattern.finditer(prompt)
+                             if match.end() > match.start())
+        if spans:
+            metrics.incr("routing.redactions", len(spans))
+        spans.sort()
+        return spans
+
+    # Planner decisions per model, in evaluation order
+    def plan_report(self):
+        report = {}
+        for model, plan in self.plans.items():
+            report[model] = [{
+                "id": rule.id,
+                "priority": rule.priority,
+                "kind": rule.kind(),
+                "redirect_model": rule.redirect_model,
+                "cost_us": round(rule.stats.cost_ns / 1000, 3) if rule.stats.cost_ns is not None else None,
+                "hit_rate": round(rule.stats.hit_rate(), 4),
+                "evaluations": rule.stats.evaluations,
+                "score": round(rule.score(), 1),
+            } for rule in plan]
+        return report
+
+
+# The prompt with every span replaced by its label, e.g. "[CARD]", in one pass; overlapping spans merge
+def redact(prompt, spans):
+    parts = []
+    position = 0
+    for start, end, label in spans:
+        if end <= position:
+            continue
+        if start >= position:
+            parts.append(prompt[position:start])
+            parts.append(f"[{label.upper()}]")
+        position = end
+    parts.append(prompt[position:])
+    return "".join(parts)
+
+
+# Policies (priority DESC, id) and exemplars of one tenant as stored in the database
+def fetch_policies(cur, tenant_id):
+    cur.execute("""
+        SELECT id, model_name, rule_type, regex_pattern, redirect_model, similarity_threshold, priority, action
+        FROM routing_policies WHERE tenant_id = %s ORDER BY priority DESC, id;
+    """, (tenant_id,))
+    policies = cur.fetchall()
+    cur.execute("""
+        SELECT e.policy_id, e.phrase FROM routing_policy_exemplars e
+        JOIN routing_policies p ON p.id = e.policy_id
+        WHERE p.tenant_id = %s ORDER BY e.policy_id, e.id;
+    """, (tenant_id,))
+    exemplars = {}
+    for policy_id, phrase in cur.fetchall():
+        exemplars.setdefault(policy_id, []).append(phrase)
+    return policies, exemplars
+
+
+class UnknownTenant(Exception):
+    pass
+
+class PoliciesUnavailable(Exception):
+    pass
+
+
+# Which tenants exist and what each one owns: models, rule versions, file-routing target.
+# Small enough to hold for thousands of tenants; the compiled rules live in per-tenant snapshots.
+class Directory:
+    def __init__(self, fingerprint, position, tenants, versions, models, policy_models, file_routes, pools, fallbacks):
+        self.fingerprint = fingerprint
+        self.position = position  # database position it was read at; snapshots are loaded from at least there
+        self.tenants = tenants  # name -> id
+        self.tenant_names = {tenant_id: name for name, tenant_id in tenants.items()}
+        self.versions = versions  # tenant id -> latest rule change version
+        self.shared_models = [name for name, tenant_id in models if tenant_id is None]
+        self.shared_model_set = set(self.shared_models)
+        self.tenant_models = {}
+        for name, tenant_id in models:
+            if tenant_id is not None:
+                self.tenant_models.setdefault(tenant_id, set()).add(name)
+        self.policy_models = policy_models  # tenant id -> model names that have rules
+        self.file_routes = file_routes  # tenant id -> (model, provider)
+        self.pools = pools  # "provider/model" -> deployments.DeploymentPool, for models with several deployments
+        self.fallbacks = fallbacks  # model name -> ordered [(provider, model)] fallback targets
+        self.visible = {}
+
+    def tenant_id(self, name):
+        tenant_id = self.tenants.get(name or DEFAULT_TENANT)
+        if tenant_id is None:
+            raise UnknownTenant(name)
+        return tenant_id
+
+    # Shared models plus the tenant's own, sorted by name
+    def model_names(self, tenant_id):
+        own = self.tenant_models.get(tenant_id)
+        if not own:
+            return self.shared_models
+        if tenant_id not in self.visible:
+            self.visible[tenant_id] = sorted(self.shared_model_set | own)
+        return self.visible[tenant_id]
+
+    def has_model(self, tenant_id, name):
+        return name in self.shared_model_set or name in self.tenant_models.get(tenant_id, ())
+
+    # Tenants without their own models or rules all see the same /models listing
+    def customized(self, tenant_id):
+        return tenant_id in self.tenant_models or tenant_id in self.policy_models
+
+def load_directory(cur, fingerprint, position):
+    cur.execute("SELECT name, id FROM tenants;")
+    tenants = dict(cur.fetchall())
+    cur.execute("SELECT tenant_id, MAX(version) FROM routing_policy_changes GROUP BY tenant_id;")
+    versions = dict(cur.fetchall())
+    cur.execute("SELECT name, tenant_id FROM models ORDER BY name;")
+    models = cur.fetchall()
+    cur.execute("SELECT DISTINCT tenant_id, model_name FROM routing_policies ORDER BY tenant_id, model_name;")
+    policy_models = {}
+    for tenant_id, model_name in cur.fetchall():
+        policy_models.setdefault(tenant_id, []).append(model_name)
+    cur.execute("SELECT tenant_id, model_name, provider FROM file_routing;")
+    file_routes = {tenant_id: (model_name, provider) for tenant_id, model_name, provider in cur.fetchall()}
+    cur.execute("SELECT model_name, name, base_url, api_key_env, weight FROM model_deployments ORDER BY model_name, id;")
+    pools = deployments.build_pools(cur.fetchall())
+    cur.execute("SELECT model_name, fallback_model FROM model_fallbacks ORDER BY model_name, position, id;")
+    fallbacks = {}
+    for model_name, fallback_model in cur.fetchall():
+        fallbacks.setdefault(model_name, []).append(tuple(fallback_model.split("/", 1)))
+    return Directory(fingerprint, position, tenants, versions, models, policy_models, file_routes, pools, fallbacks)
+
+directory = None
+directory_checked_at = 0.0  # last refresh attempt; failed attempts also wait out the interval
+directory_verified_at = None  # last time the directory was confirmed current against the database
+directory_error = None
+directory_position = 0  # database position of the last successful check
+directory_lock = threading.Lock()
+
+def directory_current(token):
+    if token is not None and token > directory_position:
+        return False
+    # Until a first load succeeds or fails, callers queue on the lock behind it instead of getting None
+    if directory is None and directory_error is None:
+        return False
+    return time.monotonic() - directory_checked_at < Config.POLICY_CACHE_CHECK_INTERVAL
+
+# Current tenant directory, rechecked against the database at most every POLICY_CACHE_CHECK_INTERVAL seconds,
+# or right away for a read token (see db.py) the last check had not reached yet.
+# While the database is down the last directory keeps being served.
+def get_directory(token=None):
+    global directory, directory_checked_at, directory_verified_at, directory_error, directory_position
+    if directory_current(token):
+        return directory
+
+    with directory_lock:
+        if directory_current(token):
+            return directory
+        directory_checked_at = time.monotonic()
+        # Never from a replica behind the last check, so the directory cannot step back to an older version
+        conn = connect_replica(max(token or 0, directory_position))
+        if conn is None:
+            logger.error("Database connection failed during policy refresh")
+            directory_error = "Database connection failed"
+            return directory
+        try:
+            cur = conn.cursor()
+            position = read_position(cur)
+            fingerprint = get_fingerprint(cur)
+            if directory is None or directory.fingerprint != fingerprint:
+                start = time.perf_counter()
+                directory = load_directory(cur, fingerprint, position)
+                logger.info(f"Loaded tenant directory {fingerprint} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            directory_position = max(directory_position, position)
+            directory_verified_at = time.monotonic()
+            directory_error = None
+        except psycopg2.Error as e:
+            logger.error(f"Error refreshing routing policies: {e}")
+            directory_error = str(e).strip()
+        finally:
+            conn.close()
+        return directory
+
+# Force the next get_directory() to recheck the database
+def invalidate():
+    global directory_checked_at
+    directory_checked_at = 0.0
+
+# Freshness of the cached directory, without touching the database
+def cache_status():
+    return {
+        "loaded": directory is not None,
+        "age_s": round(time.monotonic() - directory_verified_at, 3) if directory_verified_at is not None else None,
+        "last_error": directory_error,
+    }
+
+# Deployment pool of a "provider/model", or None when the provider's single endpoint serves it
+def get_pool(provider, model):
+    current = get_directory()
+    return current.pools.get(f"{provider}/{model}") if current is not None else None
+
+# Ordered (provider, model) fallback targets configured for a model
+def get_fallbacks(model):
+    current = get_directory()
+    return current.fallbacks.get(model, []) if current is not None else []
+
+# Tenant id for a tenant name (the default tenant when None)
+def resolve_tenant(name):
+    current = get_directory()
+    if current is None:
+        raise PoliciesUnavailable()
+    return current.tenant_id(name)
+
+# Name of a tenant id, or None when unknown
+def tenant_name(tenant_id):
+    current = get_directory()
+    return current.tenant_names.get(tenant_id) if current is not None else None
+
+# (model, provider) that also receives the tenant's chat requests, if one is set
+def get_file_route(tenant_id, token=None):
+    current = get_directory(token)
+    return current.file_routes.get(tenant_id) if current is not None else None
+
+
+# Shared by every tenant without rules, so they never load or hold a snapshot of their own
+empty_snapshot = PolicySnapshot(None, [], [], {})
+
+snapshots = OrderedDict()  # tenant id -> PolicySnapshot, least recently used first
+snapshots_lock = threading.Lock()
+snapshot_load_lock = threading.Lock()
+
+def cached_snapshot(tenant_id, fingerprint):
+    with snapshots_lock:
+        cached = snapshots.get(tenant_id)
+        if cached is not None and cached.fingerprint == fingerprint:
+            snapshots.move_to_end(tenant_id)
+            return cached
+    return None
+
+# Compiled policies of one tenant, loaded on first use and evicted least-recently-used beyond TENANT_CACHE_SIZE
+def get_snapshot(tenant_id):
+    current = get_directory()
+    if current is None:
+        return None
+    if tenant_id not in current.policy_models:
+        return empty_snapshot
+
+    # A snapshot stays valid until the tenant's rules or the models it can see change
+    fingerprint = (current.versions.get(tenant_id), current.fingerprint[1])
+    cached = cached_snapshot(tenant_id, fingerprint)
+    if cached is not None:
+        return cached
+
+    with snapshot_load_lock:
+        cached = cached_snapshot(tenant_id, fingerprint)
+        if cached is not None:
+            return cached
+        # Never from a replica behind the directory, or an old rule set would be cached under the new version
+        conn = connect_replica(current.position)
+        if conn is None:
+            logger.error("Database connection failed during policy load")
+            return snapshots.get(tenant_id)
+        try:
+            start = time.perf_counter()
+            policies, exemplars = fetch_policies(conn.cursor(), tenant_id)
+            loaded = PolicySnapshot(fingerprint, current.model_names(tenant_id), policies, exemplars)
+            logger.info(f"Loaded routing policies of tenant {tenant_id} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except psycopg2.Error as e:
+            logger.error(f"Error loading routing policies of tenant {tenant_id}: {e}")
+            return snapshots.get(tenant_id)
+        finally:
+            conn.close()
+
+        metrics.incr("routing.tenant_loads")
+        with snapshots_lock:
+            previous = snapshots.get(tenant_id)
+            if previous is not None:
+                drop_rule_stats(previous.rule_ids - loaded.rule_ids)
+            snapshots[tenant_id] = loaded
+            snapshots.move_to_end(tenant_id)
+            while len(snapshots) > Config.TENANT_CACHE_SIZE:
+                _, evicted = snapshots.popitem(last=False)
+                drop_rule_stats(evicted.rule_ids)
+                metrics.incr("routing.tenant_evictions")
+        return loaded
+
+def cache_stats():
+    with snapshots_lock:
+        return {"cached_tenants": len(snapshots), "capacity": Config.TENANT_CACHE_SIZE}
+
+metrics.register_collector("tenant_policies", cache_stats)
+
+# Compile the rules of up to `limit` tenants ahead of traffic, most recently changed first; returns how many
+def preload(limit):
+    current = get_directory()
+    if current is None:
+        return 0
+    tenants = sorted(current.policy_models, key=lambda tenant_id: current.versions.get(tenant_id, 0), reverse=True)
+    loaded = 0
+    for tenant_id in tenants[:min(limit, Config.TENANT_CACHE_SIZE)]:
+        if get_snapshot(tenant_id) is not None:
+            loaded += 1
+    return loaded
+
+
+# Semantic matching latency with N exemplars
+if __name__ == '__main__':
+    import random
+    import sys
+
+    exemplar_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_rule = 50
+    vocabulary = ("payment card number account bank transfer invoice salary medical patient diagnosis "
+                  "password credential token address phone email passport contract lawsuit merger "
+                  "weather recipe travel music movie football code bug deploy server database").split()
+    random.seed(7)
+    phrases = [" ".join(random.choices(vocabulary, k=6)) for _ in range(exemplar_count)]
+    policies = []
+    exemplars = {}
+    for rule_id in range(1, exemplar_count // per_rule + 1):
+        policies.append((rule_id, "gpt-4o", SEMANTIC, "", "gemini-alpha", 0.99, 0, REDIRECT))
+        exemplars[rule_id] = phrases[(rule_id - 1) * per_rule:rule_id * per_rule]
+
+    start = time.perf_counter()
+    bench = PolicySnapshot(None, ["gemini/gemini-alpha"], policies, exemplars)
+    print(f"built index of {exemplar_count} exemplars in {len(policies)} rules: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    prompts = [" ".join(random.choices(vocabulary, k=random.randint(5, 60))) for _ in range(500)]
+    timings = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        bench.match("gpt-4o", prompt)
+        timings.append((time.perf_counter() - start) * 1000)
+    summary = metrics.summarize(timings)
+    print(f"match latency over {len(prompts)} prompts: p50={summary['p50']:.3f} ms p95={summary['p95']:.3f} ms p99={summary['p99']:.3f} ms "
+          f"(budget {Config.SEMANTIC_BUDGET_MS} ms)")
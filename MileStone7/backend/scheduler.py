@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+import deadline
+import metrics
+from config import Config
+from ratelimit import RateLimited
+
+logger = logging.getLogger(__name__)
+
+# Order in which a worker process's requests reach the providers once SCHEDULER_CONCURRENCY calls are in
+# flight. Interactive requests go first; batch requests take whatever capacity is left, plus at least
+# SCHEDULER_BATCH_MIN_SHARE of the grants while both wait, so they are never starved. Within a class,
+# start-time fair queuing shares capacity between flows (API keys, or tenants for keyless requests) in
+# proportion to their weights, so one bulk job cannot crowd out the others. A request that waits longer
+# than its class's queue timeout (or its deadline) fails with 429.
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+CLASSES = (INTERACTIVE, BATCH)
+FLOW_TAGS_MAX = 4096  # finish tags kept before stale ones are dropped
+
+
+# Class of a request from its X-Priority header; unknown values get the default class
+def request_class(value):
+    value = (value or "").strip().lower()
+    return value if value in CLASSES else Config.SCHEDULER_DEFAULT_CLASS
+
+# API key, or tenant for requests without one
+def flow_id(api_key, tenant_id):
+    return f"key:{api_key.id}" if api_key is not None else f"tenant:{tenant_id}"
+
+
+class Waiter:
+    __slots__ = ("event", "granted", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+# Start-time fair queue of one class: each request is tagged with the virtual time at which its flow
+# may start, and the smallest tag is served first
+class FairQueue:
+    def __init__(self):
+        self.heap = []  # (start tag, sequence, waiter)
+        self.waiting = 0
+        self.virtual_time = 0.0
+        self.finish_tags = {}  # flow -> finish tag of its latest request
+        self.sequence = itertools.count()
+
+    # Tag a request of `flow`; requests served right away are tagged too, so fairness covers them
+    def tag(self, flow):
+        start = max(self.virtual_time, self.finish_tags.get(flow, 0.0))
+        self.finish_tags[flow] = start + 1.0 / Config.SCHEDULER_FLOW_WEIGHTS.get(flow, 1.0)
+        if len(self.finish_tags) > FLOW_TAGS_MAX:
+            # A flow whose finish tag is behind the virtual time would start at the virtual time anyway
+            self.finish_tags = {key: tag for key, tag in self.finish_tags.items() if tag > self.virtual_time}
+        return start
+
+    def push(self, start, waiter):
+        heapq.heappush(self.heap, (start, next(self.sequence), waiter))
+        self.waiting += 1
+
+    def pop(self):
+        while self.heap:
+            start, _, waiter = heapq.heappop(self.heap)
+            if waiter.cancelled:
+                continue
+            self.waiting -= 1
+            self.virtual_time = start
+            return waiter
+        return None
+
+    def cancel(self, waiter):
+        waiter.cancelled = True
+        self.waiting -= 1
+
+
+class Scheduler:
+    def __init__(self, capacity):
+        self.pid = os.getpid()
+        self.capacity = capacity
+        self.busy = 0
+        self.lock = threading.Lock()
+        self.queues = {request_class: FairQueue() for request_class in CLASSES}
+        self.interactive_streak = 0  # interactive grants in a row while batch requests waited
+
+    # Take a dispatch slot, waiting up to `timeout` seconds behind higher-priority and fairer-share requests
+    def acquire(self, request_class, flow, timeout):
+        queue = self.queues[request_class]
+        with self.lock:
+            start = queue.tag(flow)
+            if self.busy < self.capacity and not any(q.waiting for q in self.queues.values()):
+                self.busy += 1
+                queue.virtual_time = max(queue.virtual_time, start)
+                return
+            if queue.waiting >= Config.SCHEDULER_QUEUE_SIZES[request_class]:
+                raise RateLimited(f"The {request_class} queue is full", Config.ADMISSION_RETRY_AFTER)
+            waiter = Waiter()
+            queue.push(start, waiter)
+
+        if waiter.event.wait(timeout):
+            return
+        with self.lock:
+            # Granted between the timeout and taking the lock
+            if waiter.granted:
+                return
+            queue.cancel(waiter)
+        raise RateLimited(f"Timed out in the {request_class} queue", Config.ADMISSION_RETRY_AFTER)
+
+    # Hand the slot straight to the next waiter, if any
+    def release(self):
+        with self.lock:
+            waiter = self.next_waiter()
+            if waiter is None:
+                self.busy -= 1
+                return
+            waiter.granted = True
+            waiter.event.set()
+
+    def next_waiter(self):
+        interactive, batch = self.queues[INTERACTIVE], self.queues[BATCH]
+        if batch.waiting and (not interactive.waiting or self.batch_turn()):
+            self.interactive_streak = 0
+            return batch.pop()
+        waiter = interactive.pop()
+        if waiter is not None and batch.waiting:
+            self.interactive_streak += 1
+        return waiter
+
+    # Whether batch is owed a grant to keep its SCHEDULER_BATCH_MIN_SHARE
+    def batch_turn(self):
+        share = Config.SCHEDULER_BATCH_MIN_SHARE
+        return share > 0 and self.interactive_streak >= 1 / share - 1
+
+    def status(self):
+        with self.lock:
+            return {
+                "capacity": self.capacity,
+                "busy": self.busy,
+                "waiting": {request_class: queue.waiting for request_class, queue in self.queues.items()},
+            }
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+# Scheduler of the current process, created on first use and recreated after fork
+def get_scheduler():
+    global scheduler
+    if scheduler is None or scheduler.pid != os.getpid():
+        with scheduler_lock:
+            if scheduler is None or scheduler.pid != os.getpid():
+                scheduler = Scheduler(Config.SCHEDULER_CONCURRENCY)
+    return scheduler
+
+# Hold a dispatch slot for the duration of the block; the wait is bounded by the class's queue timeout and the deadline
+@contextmanager
+def slot(request_class, flow):
+    if not Config.SCHEDULER_ENABLED:
+        yield
+        return
+    current = get_scheduler()
+    start = time.perf_counter()
+    try:
+        current.acquire(request_class, flow, deadline.bounded(Config.SCHEDULER_QUEUE_TIMEOUTS[request_class]))
+    except RateLimited:
+        metrics.incr(f"scheduler.{request_class}.rejected")
+        deadline.check("scheduler")
+        raise
+    metrics.observe(f"scheduler.{request_class}.wait", (time.perf_counter() - start) * 1000)
+    try:
+        yield
+    finally:
+        current.release()
+
+def snapshot():
+    return scheduler.status() if scheduler is not None and scheduler.pid == os.getpid() else None
+
+metrics.register_collector("scheduler", snapshot)
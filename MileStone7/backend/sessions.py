@@ -0,0 +1,269 @@
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+import psycopg2
+import metrics
+from config import Config
+from db import connect_db
+
+logger = logging.getLogger(__name__)
+
+# Server-side conversation sessions. The most recently used sessions live in memory with their last
+# SESSION_MAX_TURNS turns; every turn is also appended to PostgreSQL by a background writer, so an
+# evicted session is reloaded from conversation_turns on demand. Each worker process caches its own
+# copy, so a cached session is checked against its row's turn counter before use: a session another
+# worker has advanced is reloaded, and one another worker deleted is dropped. Turns still queued in
+# another worker's writer are not visible until flushed.
+
+
+class Session:
+    def __init__(self, session_id, tenant_id, checked_model=None, redirect=None, turns=(), turn_count=0):
+        self.id = session_id
+        self.tenant_id = tenant_id
+        self.checked_model = checked_model  # model whose rules the retained turns were matched against
+        self.redirect = redirect  # (model, provider) an earlier turn was redirected to; sticks for the session
+        self.turns = deque(turns, maxlen=Config.SESSION_MAX_TURNS)  # (role, content)
+        self.turn_count = turn_count  # turns ever appended, including ones still queued for the writer
+        self.lock = threading.Lock()  # one turn at a time per session within this worker
+
+    # Take over the state of a copy freshly loaded from the database
+    def sync(self, loaded):
+        self.checked_model = loaded.checked_model
+        self.redirect = loaded.redirect
+        self.turns = loaded.turns
+        self.turn_count = loaded.turn_count
+
+    def user_turns(self):
+        return [content for role, content in self.turns if role == "user"]
+
+    # Retained turns sent to the provider with the next prompt, newest kept within SESSION_MAX_CONTEXT_CHARS
+    def context(self):
+        history = []
+        size = 0
+        for role, content in reversed(self.turns):
+            size += len(content)
+            if size > Config.SESSION_MAX_CONTEXT_CHARS:
+                break
+            history.append((role, content))
+        history.reverse()
+        return history
+
+    def append(self, prompt, answer):
+        self.turns.append(("user", prompt))
+        self.turns.append(("assistant", answer))
+        self.turn_count += 2
+        enqueue(("turns", self.id, self.checked_model, self.redirect, [("user", prompt), ("assistant", answer)]))
+
+    def describe(self):
+        return {
+            "session_id": self.id,
+            "model": self.checked_model,
+            "redirect": {"model": self.redirect[0], "provider": self.redirect[1]} if self.redirect else None,
+            "turns": [{"role": role, "content": content} for role, content in self.turns],
+        }
+
+
+sessions = OrderedDict()  # session id -> Session, least recently used first
+sessions_lock = threading.Lock()
+
+def remember(session):
+    with sessions_lock:
+        sessions[session.id] = session
+        sessions.move_to_end(session.id)
+        while len(sessions) > Config.SESSION_MEMORY_LIMIT:
+            sessions.popitem(last=False)
+            metrics.incr("sessions.evicted")
+
+# New empty session, stored synchronously so any worker can pick it up
+def create(tenant_id):
+    session = Session(uuid.uuid4().hex, tenant_id)
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO conversation_sessions (id, tenant_id) VALUES (%s, %s);", (session.id, tenant_id))
+        conn.commit()
+    finally:
+        conn.close()
+    remember(session)
+    metrics.incr("sessions.created")
+    return session
+
+# Turn counter of the session's row; None when the session no longer exists
+def stored_turn_count(session_id):
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT turn_count FROM conversation_sessions WHERE id = %s;", (session_id,))
+        row = cur.fetchone()
+        return row[0] if row is not None else None
+    finally:
+        conn.close()
+
+def load(session_id):
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT tenant_id, model, redirect_model, redirect_provider, turn_count
+            FROM conversation_sessions WHERE id = %s;
+        """, (session_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        tenant_id, model, redirect_model, redirect_provider, turn_count = row
+        cur.execute("""
+            SELECT role, content FROM (
+                SELECT id, role, content FROM conversation_turns WHERE session_id = %s ORDER BY id DESC LIMIT %s
+            ) recent ORDER BY id;
+        """, (session_id, Config.SESSION_MAX_TURNS))
+        redirect = (redirect_model, redirect_provider) if redirect_model else None
+        return Session(session_id, tenant_id, model, redirect, cur.fetchall(), turn_count)
+    finally:
+        conn.close()
+
+def forget(session_id):
+    with sessions_lock:
+        sessions.pop(session_id, None)
+
+# Session of the tenant, from memory or reloaded from the database; None when unknown or deleted
+def get(session_id, tenant_id):
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is not None:
+            sessions.move_to_end(session_id)
+    if session is None:
+        metrics.incr("sessions.loaded")
+        session = load(session_id)
+        if session is None:
+            return None
+        remember(session)
+    elif session.tenant_id == tenant_id:
+        # Another worker may have deleted or advanced the session since it was cached here
+        stored = stored_turn_count(session_id)
+        if stored is None:
+            forget(session_id)
+            metrics.incr("sessions.invalidated")
+            return None
+        if stored > session.turn_count:
+            loaded = load(session_id)
+            if loaded is None:
+                forget(session_id)
+                return None
+            # Refreshed in place under the turn lock, so a turn running in this worker keeps one consistent object
+            with session.lock:
+                session.sync(loaded)
+            metrics.incr("sessions.refreshed")
+    return session if session.tenant_id == tenant_id else None
+
+# Deleted synchronously, so other workers drop their cached copy on next use
+def delete(session_id, tenant_id):
+    session = get(session_id, tenant_id)
+    if session is None:
+        return False
+    forget(session_id)
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM conversation_sessions WHERE id = %s;", (session_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+
+# ---- write-behind of turns ----
+
+pending = deque()
+pending_lock = threading.Lock()
+writer = None
+writer_lock = threading.Lock()
+wake = threading.Event()
+
+def enqueue(op):
+    start_writer()
+    with pending_lock:
+        if len(pending) >= Config.SESSION_WRITE_QUEUE_SIZE:
+            pending.popleft()
+            metrics.incr("sessions.writes_dropped")
+        pending.append(op)
+    wake.set()
+
+def write_ops(ops):
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        for _, session_id, model, redirect, turns in ops:
+            redirect_model, redirect_provider = redirect or (None, None)
+            cur.execute("""
+                UPDATE conversation_sessions
+                SET model = %s, redirect_model = %s, redirect_provider = %s, turn_count = turn_count + %s, updated_at = NOW()
+                WHERE id = %s;
+            """, (model, redirect_model, redirect_provider, len(turns), session_id))
+            if cur.rowcount == 0:
+                continue  # deleted while its turns were queued
+            cur.executemany(
+                "INSERT INTO conversation_turns (session_id, role, content) VALUES (%s, %s, %s);",
+                [(session_id, role, content) for role, content in turns]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def flush():
+    with pending_lock:
+        ops = list(pending)
+        pending.clear()
+    if not ops:
+        return
+    try:
+        write_ops(ops)
+    except psycopg2.Error as e:
+        logger.error(f"Session write of {len(ops)} operations failed: {e}")
+        metrics.incr("sessions.write_failed")
+        with pending_lock:
+            room = max(0, Config.SESSION_WRITE_QUEUE_SIZE - len(pending))
+            pending.extendleft(reversed(ops[-room:] if room else []))
+        time.sleep(1)
+        return
+    metrics.incr("sessions.writes", len(ops))
+
+def write_loop():
+    while True:
+        wake.wait(1)
+        wake.clear()
+        flush()
+
+def start_writer():
+    global writer
+    if writer is not None:
+        return
+    with writer_lock:
+        if writer is None:
+            writer = threading.Thread(target=write_loop, name="session-writer", daemon=True)
+            writer.start()
+            atexit.register(flush)
+
+def stats():
+    with sessions_lock:
+        cached = len(sessions)
+    with pending_lock:
+        queued = len(pending)
+    return {"cached_sessions": cached, "capacity": Config.SESSION_MEMORY_LIMIT, "pending_writes": queued}
+
+metrics.register_collector("sessions", stats)
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+import psycopg2
+import psycopg2.pool
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Embedded SQLite (WAL mode) behind the same pool interface as PostgreSQL, selected with
+# DATABASE_URL=sqlite:///path/to/gateway.db (or sqlite:///:memory: for throwaway runs). The
+# connections speak the subset of the psycopg2 API the gateway uses: %s placeholders, NOW() and
+# md5(), and psycopg2 exception types, so callers need no changes. Only a single process should
+# write to the file; there are no replicas.
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "schema_sqlite.sql")
+MEMORY_URI = "file:gateway?mode=memory&cache=shared"
+
+placeholder = re.compile(r"%(s|%)")
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("TIMESTAMPTZ", lambda value: datetime.fromisoformat(value.decode()))
+
+
+def is_sqlite(dsn):
+    return dsn.startswith("sqlite:")
+
+# sqlite:///relative.db, sqlite:////absolute.db or sqlite:///:memory:
+def database_path(dsn):
+    path = dsn.split(":", 1)[1]
+    if path.startswith("///"):
+        path = path[3:]
+    return path or ":memory:"
+
+def translate(query):
+    return placeholder.sub(lambda m: "?" if m.group(1) == "s" else "%", query)
+
+# sqlite3 errors surface as the psycopg2 classes every caller already handles
+def translated_error(e):
+    if isinstance(e, sqlite3.IntegrityError):
+        return psycopg2.IntegrityError(str(e))
+    if isinstance(e, sqlite3.OperationalError):
+        return psycopg2.OperationalError(str(e))
+    return psycopg2.DatabaseError(str(e))
+
+def now():
+    return datetime.now(timezone.utc).isoformat(" ")
+
+def md5(value):
+    return hashlib.md5(str(value).encode()).hexdigest() if value is not None else None
+
+
+class Cursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, params=()):
+        try:
+            self.cursor.execute(translate(query), params or ())
+        except sqlite3.Error as e:
+            raise translated_error(e) from e
+
+    def executemany(self, query, params):
+        try:
+            self.cursor.executemany(translate(query), params)
+        except sqlite3.Error as e:
+            raise translated_error(e) from e
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class Connection:
+    def __init__(self, target, uri):
+        self.conn = sqlite3.connect(target, uri=uri, timeout=Config.DB_POOL_TIMEOUT,
+                                    detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON;")
+        if not uri:
+            self.conn.execute("PRAGMA journal_mode = WAL;")
+            self.conn.execute("PRAGMA synchronous = NORMAL;")
+        self.conn.create_function("NOW", 0, now)
+        self.conn.create_function("md5", 1, md5, deterministic=True)
+        self.closed = 0
+
+    def cursor(self):
+        return Cursor(self.conn.cursor())
+
+    def commit(self):
+        try:
+            self.conn.commit()
+        except sqlite3.Error as e:
+            raise translated_error(e) from e
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # Statements abort once the request deadline passes, like statement_timeout on PostgreSQL
+    def set_deadline(self, expires_at):
+        self.conn.set_progress_handler(lambda: time.monotonic() > expires_at, 1000)
+
+    def reset(self):
+        self.conn.set_progress_handler(None, 0)
+        if self.conn.in_transaction:
+            self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+        self.closed = 1
+
+
+# Same interface as db.ConnectionPool; idle connections are reused, up to max_size open at once.
+# `wrap` is db.PooledConnection, whose close() hands the connection back here.
+class SqlitePool:
+    def __init__(self, dsn, min_size, max_size, wrap):
+        self.pid = os.getpid()
+        self.wrap = wrap
+        path = database_path(dsn)
+        self.target, self.uri = (MEMORY_URI, True) if path == ":memory:" else (path, False)
+        self.max_size = max_size
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = []
+        self.in_use = 0
+        self.lock = threading.Lock()
+        # Kept open so a shared in-memory database lives as long as the pool
+        self.keeper = Connection(self.target, self.uri)
+        self.create_schema()
+        self.idle.extend(Connection(self.target, self.uri) for _ in range(min_size))
+
+    # A new database file gets the gateway schema and the default tenant
+    def create_schema(self):
+        tables = self.keeper.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table';").fetchone()[0]
+        if tables == 0:
+            with open(SCHEMA_PATH) as f:
+                self.keeper.conn.executescript(f.read())
+            logger.info(f"Created SQLite schema in {self.target}")
+
+    def get(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(f"no free database connection within {timeout:g} s")
+        try:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+                self.in_use += 1
+            if conn is None:
+                conn = Connection(self.target, self.uri)
+        except sqlite3.Error as e:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+            raise translated_error(e) from e
+        return self.wrap(self, conn)
+
+    def put(self, conn):
+        try:
+            conn.reset()
+            keep = not conn.closed
+        except sqlite3.Error:
+            conn.close()
+            keep = False
+        with self.lock:
+            if keep:
+                self.idle.append(conn)
+            self.in_use -= 1
+        self.slots.release()
+
+    def status(self):
+        with self.lock:
+            return {"max": self.max_size, "open": self.in_use + len(self.idle), "in_use": self.in_use}
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+        self.keeper.close()
+
+
+# db.get_fingerprint for SQLite, which has no string_agg(... ORDER BY ...)
+FINGERPRINT_SQL = """
+    SELECT (SELECT COALESCE(MAX(version), 0) FROM routing_policy_changes),
+           (SELECT md5(COALESCE(group_concat(entry, ','), '')) FROM
+                (SELECT name || ':' || COALESCE(tenant_id, '') AS entry FROM models ORDER BY name)),
+           (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) FROM tenants),
+           (SELECT md5(COALESCE(group_concat(entry, ','), '')) FROM
+                (SELECT tenant_id || ':' || model_name || ':' || provider AS entry FROM file_routing ORDER BY tenant_id)),
+           (SELECT md5(COALESCE(group_concat(entry, ','), '')) FROM
+                (SELECT model_name || ':' || name || ':' || base_url || ':' || COALESCE(api_key_env, '') || ':' || weight AS entry
+                 FROM model_deployments ORDER BY id)),
+           (SELECT md5(COALESCE(group_concat(entry, ','), '')) FROM
+                (SELECT model_name || ':' || fallback_model || ':' || position AS entry FROM model_fallbacks ORDER BY id));
+"""
@@ -0,0 +1,101 @@
+import os
+import sys
+import threading
+
+# The gateway reads its configuration at import time, so the test environment is set up first:
+# the embedded SQLite backend in memory, no auth, and none of the background writers.
+os.environ.update(
+    DATABASE_URL="sqlite:///:memory:",
+    AUTH_ENABLED="false",
+    STARTUP_WARM_UP="false",
+    RATE_LIMIT_ENABLED="false",
+    USAGE_ENABLED="false",
+    HEDGE_ENABLED="false",
+    LOG_LEVEL="WARNING",
+)
+os.environ.pop("CAPTURE_PATH", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import app as appmod
+import breaker
+import db
+import routing
+import sessions
+
+# Emptied between tests; tenants keep the schema's default tenant
+TABLES = ("api_keys", "conversation_sessions", "routing_policy_changes", "routing_policies", "file_routing",
+          "model_fallbacks", "model_deployments", "models")
+
+
+@pytest.fixture(scope="session")
+def gateway():
+    return appmod.create_app()
+
+@pytest.fixture(autouse=True)
+def clean_state(gateway):
+    with sessions.pending_lock:
+        sessions.pending.clear()
+    conn = db.connect_db()
+    cur = conn.cursor()
+    for table in TABLES:
+        cur.execute(f"DELETE FROM {table};")
+    conn.commit()
+    conn.close()
+    routing.directory = None
+    routing.directory_error = None
+    routing.invalidate()
+    routing.snapshots.clear()
+    routing.rule_stats.clear()
+    appmod.models_cache.clear()
+    sessions.sessions.clear()
+    breaker.health.clear()
+    yield
+
+@pytest.fixture
+def client(gateway):
+    return gateway.test_client()
+
+# Insert "provider/model" rows visible to every tenant
+@pytest.fixture
+def add_models():
+    def add(*names):
+        conn = db.connect_db()
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO models (name) VALUES (%s);", [(name,) for name in names])
+        conn.commit()
+        conn.close()
+        routing.invalidate()
+    return add
+
+# Add a routing rule through the admin API and return its id
+@pytest.fixture
+def add_rule(client):
+    def add(pattern, original="gpt-4o", redirect="llama-3", **fields):
+        body = {"pattern": pattern, "originalModel": original, "redirectModel": redirect, "type": "regex"}
+        body.update(fields)
+        response = client.post("/regex-rules", json=body)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()["id"]
+    return add
+
+
+# Stand-in for the upstream providers: records every call and answers with the model and prompt
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, provider, model, prompt, timeout=None, history=None, deployment=None):
+        with self.lock:
+            self.calls.append({"provider": provider, "model": model, "prompt": prompt, "history": history})
+        self.release.wait(5)
+        return {"response": f"{model}: {prompt}"}
+
+@pytest.fixture
+def provider(monkeypatch):
+    fake = FakeProvider()
+    monkeypatch.setattr(appmod, "get_provider_response", fake)
+    return fake
@@ -0,0 +1,144 @@
+import threading
+import time
+import coalesce
+from deadline import DeadlineExceeded
+from providers import ProviderError
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.001)
+
+def test_concurrent_duplicates_share_one_call():
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return {"response": "shared"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalesce.run(1, "openai", "gpt-4o", "same", upstream)))
+               for _ in range(3)]
+    joined = coalesce.stats["joined"]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: coalesce.stats["joined"] == joined + 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"response": "shared"}] * 3
+    # Each caller gets its own copy to annotate
+    assert len({id(result) for result in results}) == 3
+    assert not coalesce.inflight
+
+def test_upstream_error_reaches_every_waiter():
+    release = threading.Event()
+
+    def upstream():
+        release.wait(5)
+        raise ProviderError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            coalesce.run(1, "openai", "gpt-4o", "failing", upstream)
+        except ProviderError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    joined = coalesce.stats["joined"]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: coalesce.stats["joined"] == joined + 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ["upstream down"] * 2
+
+def test_different_prompts_are_not_coalesced():
+    calls = []
+    coalesce.run(1, "openai", "gpt-4o", "one", lambda: calls.append(1))
+    coalesce.run(1, "openai", "gpt-4o", "two", lambda: calls.append(1))
+    assert len(calls) == 2
+
+def test_tenants_do_not_share_calls():
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return {"response": "private"}
+
+    threads = [threading.Thread(target=coalesce.run, args=(tenant_id, "openai", "gpt-4o", "same", upstream))
+               for tenant_id in (1, 2)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(calls) == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+def test_joiner_retries_when_the_leader_runs_out_of_time():
+    release = threading.Event()
+    attempts = []
+
+    def leader_upstream():
+        attempts.append("leader")
+        release.wait(5)
+        raise DeadlineExceeded("provider", 10)
+
+    def joiner_upstream():
+        attempts.append("joiner")
+        return {"response": "fresh"}
+
+    results = []
+
+    def lead():
+        try:
+            coalesce.run(1, "openai", "gpt-4o", "retry", leader_upstream)
+        except DeadlineExceeded:
+            results.append("leader timed out")
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    wait_for(lambda: attempts == ["leader"])
+    joined = coalesce.stats["joined"]
+    joiner = threading.Thread(target=lambda: results.append(coalesce.run(1, "openai", "gpt-4o", "retry", joiner_upstream)))
+    joiner.start()
+    wait_for(lambda: coalesce.stats["joined"] == joined + 1)
+    release.set()
+    leader.join(5)
+    joiner.join(5)
+
+    assert attempts == ["leader", "joiner"]
+    assert sorted(map(str, results)) == sorted(["leader timed out", str({"response": "fresh"})])
+
+def test_duplicate_chat_requests_reach_the_provider_once(gateway, add_models, provider):
+    add_models("openai/gpt-4o")
+    provider.release.clear()
+    statuses = []
+
+    def chat():
+        response = gateway.test_client().post(
+            "/v1/chat/completions", data={"provider": "openai", "model": "gpt-4o", "prompt": "hello"})
+        statuses.append(response.status_code)
+
+    joined = coalesce.stats["joined"]
+    threads = [threading.Thread(target=chat) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: coalesce.stats["joined"] == joined + 1)
+    provider.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert statuses == [200, 200]
+    assert len(provider.calls) == 1
@@ -0,0 +1,41 @@
+import auth
+import db
+from config import Config
+
+
+def test_models_listing_answers_304_until_models_change(client, add_models):
+    add_models("openai/gpt-4o", "meta/llama-3")
+    first = client.get("/models")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"].startswith("public")
+    etag = first.headers["ETag"]
+
+    again = client.get("/models", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+    add_models("anthropic/claude-3")
+    changed = client.get("/models", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert {"provider": "anthropic", "model": "claude-3"} in changed.get_json()
+
+def test_no_models_is_404(client):
+    assert client.get("/models").status_code == 404
+
+def test_models_listing_is_private_when_keys_pick_the_tenant(client, add_models, monkeypatch):
+    add_models("openai/gpt-4o")
+    raw_key = auth.generate_key()
+    conn = db.connect_db()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO api_keys (tenant_id, key_prefix, key_hash, scopes) VALUES (1, %s, %s, 'chat');",
+                (raw_key[:10], auth.hash_key(raw_key)))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(Config, "AUTH_ENABLED", True)
+
+    assert client.get("/models").status_code == 401
+    response = client.get("/models", headers={"X-API-Key": raw_key})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"].startswith("private")
+    assert "X-API-Key" in response.headers["Vary"]
@@ -0,0 +1,56 @@
+import pytest
+import breaker
+import deployments
+import providers
+from deadline import DeadlineExceeded
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(providers, "get_client", lambda provider, deployment=None: object())
+    calls = {}
+    monkeypatch.setattr(providers, "provider_calls", calls)
+    return calls
+
+# A breaker past its cooldown, so the next allow() turns it half-open and claims the probe
+def cooled_down_breaker(key):
+    breaker.health.pop(key, None)
+    health = breaker.get_health(key)
+    health.record(5000.0, False)
+    health.open()
+    health.opened_at -= 3600
+    return health
+
+def out_of_time(client, model, prompt, timeout, history):
+    raise DeadlineExceeded("provider", 100)
+
+def test_deadline_during_a_probe_hands_the_probe_back(upstream):
+    upstream["openai"] = out_of_time
+    health = cooled_down_breaker("openai")
+
+    with pytest.raises(DeadlineExceeded):
+        providers.get_provider_response("openai", "gpt-4o", "hi")
+    assert health.state == breaker.HALF_OPEN
+    assert not health.probe_in_flight
+    assert breaker.allow("openai")
+
+def test_deadline_does_not_leak_deployment_load(upstream):
+    upstream["openai"] = out_of_time
+    deployment = deployments.Deployment("openai/gpt-4o", "test-eu", "http://localhost:1", None, 1.0)
+    breaker.health.pop(deployment.key, None)
+
+    with pytest.raises(DeadlineExceeded):
+        providers.get_provider_response("openai", "gpt-4o", "hi", deployment=deployment)
+    assert deployment.stats.outstanding == 0
+    assert breaker.get_health(deployment.key).samples == 0
+
+def test_failed_probe_reopens_the_circuit(upstream):
+    def failing(client, model, prompt, timeout, history):
+        raise providers.ProviderError("boom")
+    upstream["openai"] = failing
+    health = cooled_down_breaker("openai")
+
+    with pytest.raises(providers.ProviderError):
+        providers.get_provider_response("openai", "gpt-4o", "hi")
+    assert health.state == breaker.OPEN
+    assert not health.probe_in_flight
@@ -0,0 +1,56 @@
+import pytest
+import capture
+import routing
+from config import Config
+
+
+@pytest.fixture(autouse=True)
+def models(add_models):
+    add_models("openai/gpt-4o", "meta/llama-3")
+
+
+def chat(client, prompt, provider="openai", model="gpt-4o"):
+    return client.post("/v1/chat/completions", data={"provider": provider, "model": model, "prompt": prompt})
+
+def test_redact_rules_mask_matches_before_dispatch(client, add_rule, provider):
+    add_rule(r"sk-\w+", action="redact")
+    add_rule("email", type="pii", action="redact")
+
+    response = chat(client, "key sk-abc123 mail jane@example.com ok")
+    assert response.status_code == 200
+    assert provider.calls[0]["prompt"] == "key [REDACTED] mail [EMAIL] ok"
+    assert provider.calls[0]["model"] == "gpt-4o"
+
+def test_redaction_leaves_other_models_alone(client, add_rule, provider):
+    add_rule(r"sk-\w+", action="redact")
+
+    chat(client, "key sk-abc123", provider="meta", model="llama-3")
+    assert provider.calls[0]["prompt"] == "key sk-abc123"
+
+def test_redirect_still_applies_to_a_redacted_prompt(client, add_rule, provider):
+    add_rule(r"sk-\w+", action="redact")
+    add_rule("escalate", redirect="llama-3")
+
+    chat(client, "escalate sk-abc123")
+    assert provider.calls[0]["model"] == "llama-3"
+    assert provider.calls[0]["prompt"] == "escalate [REDACTED]"
+
+def test_semantic_rules_cannot_redact(client):
+    response = client.post("/regex-rules", json={
+        "pattern": "", "originalModel": "gpt-4o", "type": "semantic", "action": "redact", "exemplars": ["x"],
+    })
+    assert response.status_code == 400
+
+def test_overlapping_spans_merge():
+    spans = [(1, 4, "x"), (2, 6, "y"), (7, 8, "z")]
+    assert routing.redact("abcdefghi", spans) == "a[X]g[Z]i"
+
+def test_capture_records_the_redacted_prompt(client, add_rule, provider, monkeypatch):
+    add_rule(r"sk-\w+", action="redact")
+    entries = []
+    monkeypatch.setattr(Config, "CAPTURE_BODIES", True)
+    monkeypatch.setattr(capture, "sampled", lambda: True)
+    monkeypatch.setattr(capture, "record", entries.append)
+
+    chat(client, "key sk-abc123")
+    assert entries[0]["prompt"] == "key [REDACTED]"
@@ -0,0 +1,44 @@
+import json
+import replay_rules
+
+
+def write_log(tmp_path, prompts, model="gpt-4o"):
+    path = tmp_path / "prompts.ndjson"
+    path.write_text("".join(json.dumps({"model": model, "prompt": prompt}) + "\n" for prompt in prompts))
+    return str(path)
+
+def candidates(tmp_path, rules):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(rules))
+    return replay_rules.load_candidates(str(path))
+
+def run(tmp_path, rules, prompts, model_names):
+    policies, exemplars = candidates(tmp_path, rules)
+    return replay_rules.replay(write_log(tmp_path, prompts), model_names, policies, exemplars, 1, 100)
+
+def by_id(report):
+    return {rule["id"]: rule for rule in report["rules"]}
+
+def test_redirects_to_unknown_models_never_win(tmp_path):
+    report = run(tmp_path, [
+        {"pattern": "refund", "originalModel": "gpt-4o", "redirectModel": "missing-model"},
+        {"pattern": "refund", "originalModel": "gpt-4o", "redirectModel": "llama-3"},
+    ], ["refund please", "hello"], ["meta/llama-3", "openai/gpt-4o"])
+
+    rules = by_id(report)
+    assert rules[-1]["hits"] == 1 and rules[-1]["redirects"] == 0
+    assert rules[-2]["redirects"] == 1
+    assert report["totals"]["unmatched"] == 1
+
+def test_tiers_are_evaluated_in_planner_order(tmp_path):
+    # Same priority: the literal rule is cheaper, so the planner tries it before the earlier regex
+    report = run(tmp_path, [
+        {"pattern": "ref.nd", "originalModel": "gpt-4o", "redirectModel": "llama-3"},
+        {"pattern": "refund", "originalModel": "gpt-4o", "redirectModel": "claude-3"},
+        {"pattern": "urgent", "originalModel": "gpt-4o", "redirectModel": "llama-3", "priority": 5},
+    ], ["refund", "urgent refund"], ["anthropic/claude-3", "meta/llama-3", "openai/gpt-4o"])
+
+    rules = by_id(report)
+    assert rules[-2]["redirects"] == 1
+    assert rules[-1]["redirects"] == 0
+    assert rules[-3]["redirects"] == 1
@@ -0,0 +1,71 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def models(add_models):
+    add_models("openai/gpt-4o", "openai/gpt-4o-mini", "meta/llama-3")
+
+
+def test_pages_follow_next_after_until_exhausted(client, add_rule):
+    ids = [add_rule(f"pattern-{i}") for i in range(5)]
+
+    seen = []
+    after = None
+    pages = 0
+    while True:
+        query = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        body = client.get("/regex-rules", query_string=query).get_json()
+        seen.extend(rule[0] for rule in body["rules"])
+        pages += 1
+        after = body["next_after"]
+        if after is None:
+            break
+
+    assert seen == ids
+    assert pages == 3
+
+def test_filters_by_original_model(client, add_rule):
+    add_rule("a", original="gpt-4o")
+    mini = add_rule("b", original="gpt-4o-mini")
+
+    body = client.get("/regex-rules", query_string={"model_name": "gpt-4o-mini"}).get_json()
+    assert [rule[0] for rule in body["rules"]] == [mini]
+
+def test_rejects_non_positive_limit(client):
+    assert client.get("/regex-rules", query_string={"limit": 0}).status_code == 400
+
+def test_delta_lists_upserts_and_deletes_since_version(client, add_rule):
+    kept = add_rule("kept")
+    removed = add_rule("removed")
+    version = client.get("/regex-rules").get_json()["version"]
+
+    added = add_rule("added")
+    assert client.delete(f"/regex-rules/{removed}").status_code == 200
+
+    body = client.get("/regex-rules", query_string={"since": version}).get_json()
+    assert [rule[0] for rule in body["upserts"]] == [added]
+    assert body["deletes"] == [removed]
+    assert body["version"] > version
+    assert kept not in body["deletes"]
+
+def test_unchanged_listing_answers_304(client, add_rule):
+    add_rule("x")
+    first = client.get("/regex-rules")
+    etag = first.headers["ETag"]
+
+    again = client.get("/regex-rules", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+def test_rule_change_or_other_query_gets_a_new_etag(client, add_rule):
+    add_rule("x")
+    etag = client.get("/regex-rules").headers["ETag"]
+
+    other_page = client.get("/regex-rules", query_string={"limit": 1}, headers={"If-None-Match": etag})
+    assert other_page.status_code == 200
+
+    add_rule("y")
+    changed = client.get("/regex-rules", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(changed.get_json()["rules"]) == 2
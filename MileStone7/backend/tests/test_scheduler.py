@@ -0,0 +1,79 @@
+import threading
+import time
+import pytest
+import scheduler
+from config import Config
+from ratelimit import RateLimited
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.001)
+
+# Queue one request per (class, flow) behind a full scheduler, then release the slot and
+# return the order in which they were granted
+def grant_order(current, requests):
+    order = []
+    threads = []
+
+    def run(request_class, flow):
+        current.acquire(request_class, flow, 5)
+        order.append((request_class, flow))
+        current.release()
+
+    for request_class, flow in requests:
+        queued = current.queues[request_class].waiting
+        thread = threading.Thread(target=run, args=(request_class, flow))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: current.queues[request_class].waiting == queued + 1)
+    current.release()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_interactive_requests_overtake_waiting_batch():
+    current = scheduler.Scheduler(1)
+    current.acquire(scheduler.INTERACTIVE, "tenant:1", 1)
+
+    order = grant_order(current, [(scheduler.BATCH, "tenant:1"), (scheduler.BATCH, "tenant:2"),
+                                  (scheduler.INTERACTIVE, "tenant:3")])
+    assert order[0] == (scheduler.INTERACTIVE, "tenant:3")
+    assert [flow for _, flow in order[1:]] == ["tenant:1", "tenant:2"]
+
+def test_batch_keeps_its_minimum_share(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEDULER_BATCH_MIN_SHARE", 0.5)
+    current = scheduler.Scheduler(1)
+    current.acquire(scheduler.INTERACTIVE, "tenant:1", 1)
+
+    order = grant_order(current, [(scheduler.BATCH, "tenant:9")] +
+                        [(scheduler.INTERACTIVE, f"tenant:{i}") for i in range(4)])
+    # Every other grant goes to batch while both classes wait
+    assert order[1] == (scheduler.BATCH, "tenant:9")
+
+def test_flows_share_a_class_by_weight(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEDULER_FLOW_WEIGHTS", {"key:heavy": 3.0})
+    queue = scheduler.FairQueue()
+    flows = {}
+    for _ in range(8):
+        for flow in ("key:heavy", "key:light"):
+            waiter = scheduler.Waiter()
+            flows[waiter] = flow
+            queue.push(queue.tag(flow), waiter)
+
+    served = [flows[queue.pop()] for _ in range(8)]
+    assert served.count("key:heavy") == 6
+    assert served.count("key:light") == 2
+
+def test_waiting_past_the_timeout_is_rate_limited():
+    current = scheduler.Scheduler(1)
+    current.acquire(scheduler.INTERACTIVE, "tenant:1", 1)
+
+    with pytest.raises(RateLimited):
+        current.acquire(scheduler.INTERACTIVE, "tenant:2", 0.01)
+    assert current.queues[scheduler.INTERACTIVE].waiting == 0
+    current.release()
+    assert current.status()["busy"] == 0
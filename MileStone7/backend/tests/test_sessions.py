@@ -0,0 +1,81 @@
+import pytest
+import db
+import sessions
+
+
+@pytest.fixture(autouse=True)
+def models(add_models):
+    add_models("openai/gpt-4o", "meta/llama-3")
+
+
+def start(client):
+    response = client.post("/sessions")
+    assert response.status_code == 201
+    return response.get_json()["session_id"]
+
+def turn(client, session_id, prompt):
+    return client.post("/v1/chat/completions", data={
+        "provider": "openai", "model": "gpt-4o", "prompt": prompt, "session_id": session_id,
+    })
+
+def test_redirect_sticks_for_the_rest_of_the_session(client, add_rule, provider):
+    add_rule("escalate", redirect="llama-3")
+    session_id = start(client)
+
+    assert turn(client, session_id, "hello").status_code == 200
+    turn(client, session_id, "please escalate")
+    turn(client, session_id, "thanks")
+
+    assert [call["model"] for call in provider.calls] == ["gpt-4o", "llama-3", "llama-3"]
+    # Later turns carry the earlier ones as history
+    assert provider.calls[2]["history"][0] == ("user", "hello")
+    assert client.get(f"/sessions/{session_id}").get_json()["redirect"]["model"] == "llama-3"
+
+def test_sessions_without_a_match_are_not_redirected(client, add_rule, provider):
+    add_rule("escalate", redirect="llama-3")
+    session_id = start(client)
+
+    turn(client, session_id, "hello")
+    turn(client, session_id, "again")
+    assert [call["model"] for call in provider.calls] == ["gpt-4o", "gpt-4o"]
+
+def test_unknown_session_is_404(client, provider):
+    assert turn(client, "0" * 32, "hello").status_code == 404
+    assert not provider.calls
+
+def test_turns_from_another_worker_are_picked_up(client, provider):
+    session_id = start(client)
+    turn(client, session_id, "first")
+    sessions.flush()
+
+    # Another worker serves a turn of the same session and flushes it
+    elsewhere = sessions.load(session_id)
+    elsewhere.redirect = ("llama-3", "meta")
+    elsewhere.append("second", "answer")
+    sessions.flush()
+
+    turn(client, session_id, "third")
+    assert provider.calls[-1]["model"] == "llama-3"
+    assert [content for role, content in provider.calls[-1]["history"] if role == "user"] == ["first", "second"]
+
+def test_delete_by_another_worker_ends_the_session(client, provider):
+    session_id = start(client)
+    turn(client, session_id, "first")
+    sessions.flush()
+
+    conn = db.connect_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM conversation_sessions WHERE id = %s;", (session_id,))
+    conn.commit()
+    conn.close()
+
+    assert turn(client, session_id, "second").status_code == 404
+    assert client.get(f"/sessions/{session_id}").status_code == 404
+
+def test_deleted_session_stays_deleted(client, provider):
+    session_id = start(client)
+    turn(client, session_id, "first")
+
+    assert client.delete(f"/sessions/{session_id}").status_code == 200
+    sessions.flush()
+    assert client.get(f"/sessions/{session_id}").status_code == 404
@@ -0,0 +1,180 @@
+import atexit
+import csv
+import io
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import db
+import metrics
+from config import Config
+from db import connect_db, connect_replica
+
+logger = logging.getLogger(__name__)
+
+# Per-request usage records, buffered in memory and written to PostgreSQL off the request path.
+# Raw rows go to usage_records via COPY; per-minute rollups are upserted into usage_rollups in the
+# same transaction, so /usage never scans raw rows.
+
+COLUMNS = ("created_at", "requested_provider", "requested_model", "provider", "model", "redirected",
+           "has_file", "prompt_chars", "response_chars", "latency_ms", "status")
+
+buffer = deque()
+buffer_lock = threading.Lock()
+flusher = None
+flusher_lock = threading.Lock()
+wake = threading.Event()
+
+
+def record(entry):
+    start_flusher()
+    with buffer_lock:
+        if len(buffer) >= Config.USAGE_BUFFER_SIZE:
+            buffer.popleft()
+            metrics.incr("usage.dropped")
+        buffer.append(entry)
+        if len(buffer) >= Config.USAGE_FLUSH_BATCH:
+            wake.set()
+
+def drain():
+    with buffer_lock:
+        batch = list(buffer)
+        buffer.clear()
+    return batch
+
+# Per-minute rollup deltas for a batch, keyed by (minute, provider, model)
+def rollup(batch):
+    rollups = {}
+    for entry in batch:
+        minute = entry["created_at"].replace(second=0, microsecond=0)
+        key = (minute, entry["provider"] or "", entry["model"] or "")
+        row = rollups.setdefault(key, [0, 0, 0, 0, 0, 0.0, 0])
+        row[0] += 1
+        row[1] += entry["redirected"]
+        row[2] += entry["has_file"]
+        row[3] += entry["prompt_chars"]
+        row[4] += entry["response_chars"]
+        row[5] += entry["latency_ms"]
+        row[6] += entry["status"] >= 400
+    return rollups
+
+def write_batch(batch):
+    conn = connect_db()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        if db.using_sqlite():
+            cur.executemany(
+                f"INSERT INTO usage_records ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))});",
+                [[entry[column] for column in COLUMNS] for entry in batch]
+            )
+        else:
+            data = io.StringIO()
+            writer = csv.writer(data)
+            for entry in batch:
+                writer.writerow([entry[column] for column in COLUMNS])
+            data.seek(0)
+            cur.copy_expert(f"COPY usage_records ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", data)
+        cur.executemany("""
+            INSERT INTO usage_rollups (minute, provider, model, requests, redirects, files,
+                                       prompt_chars, response_chars, latency_ms_total, errors)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (minute, provider, model) DO UPDATE SET
+                requests = usage_rollups.requests + EXCLUDED.requests,
+                redirects = usage_rollups.redirects + EXCLUDED.redirects,
+                files = usage_rollups.files + EXCLUDED.files,
+                prompt_chars = usage_rollups.prompt_chars + EXCLUDED.prompt_chars,
+                response_chars = usage_rollups.response_chars + EXCLUDED.response_chars,
+                latency_ms_total = usage_rollups.latency_ms_total + EXCLUDED.latency_ms_total,
+                errors = usage_rollups.errors + EXCLUDED.errors;
+        """, [key + tuple(values) for key, values in sorted(rollup(batch).items())])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def flush():
+    batch = drain()
+    if not batch:
+        return
+    start = time.perf_counter()
+    try:
+        write_batch(batch)
+    except psycopg2.Error as e:
+        logger.error(f"Usage flush of {len(batch)} records failed: {e}")
+        metrics.incr("usage.flush_failed")
+        # Put the batch back in front of newer records, within the buffer bound
+        with buffer_lock:
+            room = max(0, Config.USAGE_BUFFER_SIZE - len(buffer))
+            buffer.extendleft(reversed(batch[-room:] if room else []))
+            metrics.incr("usage.dropped", len(batch) - min(room, len(batch)))
+        return
+    metrics.incr("usage.flushed", len(batch))
+    metrics.observe("usage.flush", (time.perf_counter() - start) * 1000)
+
+def flush_loop():
+    while True:
+        wake.wait(Config.USAGE_FLUSH_INTERVAL)
+        wake.clear()
+        flush()
+
+def start_flusher():
+    global flusher
+    if flusher is not None:
+        return
+    with flusher_lock:
+        if flusher is None:
+            flusher = threading.Thread(target=flush_loop, name="usage-flusher", daemon=True)
+            flusher.start()
+            atexit.register(flush)
+
+def now():
+    return datetime.now(timezone.utc)
+
+# Aggregated usage from the rollup table, grouped by model or by minute
+def query_rollups(group, minutes, provider=None, model=None):
+    conn = connect_replica()
+    if conn is None:
+        return None
+    try:
+        cur = conn.cursor()
+        filters = ["minute >= %s"]
+        params = [now() - timedelta(minutes=minutes)]
+        if provider:
+            filters.append("provider = %s")
+            params.append(provider)
+        if model:
+            filters.append("model = %s")
+            params.append(model)
+        keys = "provider, model" if group == "model" else "minute"
+        cur.execute(f"""
+            SELECT {keys}, SUM(requests), SUM(redirects), SUM(files), SUM(prompt_chars),
+                   SUM(response_chars), SUM(latency_ms_total), SUM(errors)
+            FROM usage_rollups WHERE {' AND '.join(filters)}
+            GROUP BY {keys} ORDER BY {keys};
+        """, params)
+        rows = []
+        key_names = keys.split(", ")
+        for row in cur.fetchall():
+            keys_part = dict(zip(key_names, row[:len(key_names)]))
+            if "minute" in keys_part:
+                keys_part["minute"] = keys_part["minute"].isoformat()
+            requests, redirects, files, prompt_chars, response_chars, latency_total, errors = row[len(key_names):]
+            rows.append({
+                **keys_part,
+                "requests": int(requests),
+                "redirects": int(redirects),
+                "files": int(files),
+                "prompt_chars": int(prompt_chars),
+                "response_chars": int(response_chars),
+                "avg_latency_ms": round(latency_total / requests, 3) if requests else None,
+                "errors": int(errors),
+            })
+        return rows
+    finally:
+        conn.close()
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { useNavigate } from "react-router-dom";
 import "./AdminPanel.css";
@@ -6,33 +6,84 @@ import "./AdminPanel.css";
 function AdminPanel() {
   const navigate = useNavigate();
   const [regexRules, setRegexRules] = useState([]);
-  const [newRule, setNewRule] = useState({ pattern: "", originalModel: "", redirectModel: "" });
+  const emptyRule = { type: "regex", action: "redirect", pattern: "", exemplars: "", threshold: "", priority: "", originalModel: "", redirectModel: "" };
+  const [newRule, setNewRule] = useState(emptyRule);
   const [fileUploadModel, setFileUploadModel] = useState(""); // State for file upload routing
+  const rulesVersion = useRef(null); // Rule set version the table is in sync with
+  const rulesEtag = useRef(null); // ETag of the first page, to skip refetching an unchanged rule set
 
   useEffect(() => {
     fetchRules();
     fetchFileUploadModel();
   }, []);
 
-  // Fetch existing regex rules
+  const toRule = (rule) => ({
+    id: rule[0],
+    originalModel: rule[1],
+    pattern: rule[2],
+    redirectModel: rule[3],
+    type: rule[4],
+    threshold: rule[5],
+    priority: rule[6],
+    action: rule[7]
+  });
+
+  // Fetch existing regex rules page by page
   const fetchRules = async () => {
     try {
-      const res = await axios.get("http://localhost:5006/regex-rules");
-      if (Array.isArray(res.data)) {
-        setRegexRules(res.data.map(rule => ({
-          id: rule[0], 
-          originalModel: rule[1], 
-          pattern: rule[2], 
-          redirectModel: rule[3]
-        })));
-      } else {
-        console.error("Unexpected API response format:", res.data);
-      }
+      let rules = [];
+      let after = null;
+      let version = null;
+      let etag = null;
+      do {
+        const firstPage = after === null;
+        const res = await axios.get("http://localhost:5006/regex-rules", {
+          params: firstPage ? {} : { after },
+          headers: firstPage && rulesEtag.current ? { "If-None-Match": rulesEtag.current } : {},
+          validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+        });
+        if (res.status === 304) {
+          return;
+        }
+        if (firstPage) {
+          etag = res.headers.etag ?? null;
+        }
+        if (!Array.isArray(res.data?.rules)) {
+          console.error("Unexpected API response format:", res.data);
+          return;
+        }
+        rules = rules.concat(res.data.rules.map(toRule));
+        version = version ?? res.data.version;
+        after = res.data.next_after;
+      } while (after !== null);
+      rulesVersion.current = version;
+      rulesEtag.current = etag;
+      setRegexRules(rules);
     } catch (error) {
       console.error("Error fetching rules:", error);
     }
   };
 
+  // Fetch only the rules changed since the version we already have
+  const fetchRuleChanges = async () => {
+    if (rulesVersion.current === null) {
+      return fetchRules();
+    }
+    try {
+      const res = await axios.get("http://localhost:5006/regex-rules", {
+        params: { since: rulesVersion.current },
+      });
+      const upserts = res.data.upserts.map(toRule);
+      const changed = new Set([...res.data.deletes, ...upserts.map(rule => rule.id)]);
+      rulesVersion.current = res.data.version;
+      setRegexRules(prevRules =>
+        prevRules.filter(rule => !changed.has(rule.id)).concat(upserts).sort((a, b) => a.id - b.id)
+      );
+    } catch (error) {
+      console.error("Error fetching rule changes:", error);
+    }
+  };
+
   // Fetch file upload routing model
   const fetchFileUploadModel = async () => {
     try {
@@ -45,16 +96,18 @@ function AdminPanel() {
 
   // Add a new regex rule
   const handleAddRule = async () => {
-    if (!newRule.pattern || !newRule.originalModel || !newRule.redirectModel) {
+    const exemplars = newRule.exemplars.split("\n").map(phrase => phrase.trim()).filter(Boolean);
+    const hasCondition = newRule.type === "semantic" ? exemplars.length > 0 : newRule.type === "pii" || newRule.pattern;
+    if (!hasCondition || !newRule.originalModel || (newRule.action === "redirect" && !newRule.redirectModel)) {
       console.warn("Missing fields:", newRule);
       return;
     }
     try {
-      await axios.post("http://localhost:5006/regex-rules", newRule, {
+      await axios.post("http://localhost:5006/regex-rules", { ...newRule, exemplars }, {
         headers: { "Content-Type": "application/json" },
       });
-      fetchRules();
-      setNewRule({ pattern: "", originalModel: "", redirectModel: "" });
+      fetchRuleChanges();
+      setNewRule(emptyRule);
     } catch (error) {
       console.error("Error adding rule:", error.response?.data || error);
     }
@@ -64,7 +117,7 @@ function AdminPanel() {
   const handleDeleteRule = async (id) => {
     try {
       await axios.delete(`http://localhost:5006/regex-rules/${id}`);
-      fetchRules();
+      fetchRuleChanges();
     } catch (error) {
       console.error("Error deleting rule:", error);
     }
@@ -94,23 +147,67 @@ function AdminPanel() {
       {/* Regex Rules Section */}
       <div className="add-rule-form">
         <h3>Regex-Based Routing</h3>
-        <input
-          type="text"
-          placeholder="Regex Pattern"
-          value={newRule.pattern}
-          onChange={(e) => setNewRule({ ...newRule, pattern: e.target.value })}
-        />
+        <select
+          value={newRule.type}
+          onChange={(e) => setNewRule({
+            ...newRule,
+            type: e.target.value,
+            action: e.target.value === "semantic" ? "redirect" : newRule.action,
+          })}
+        >
+          <option value="regex">Regex</option>
+          <option value="semantic">Semantic</option>
+          <option value="pii">PII (sensitive data)</option>
+        </select>
+        <select
+          value={newRule.action}
+          onChange={(e) => setNewRule({ ...newRule, action: e.target.value })}
+        >
+          <option value="redirect">Redirect</option>
+          {newRule.type !== "semantic" && <option value="redact">Redact (mask matches, keep model)</option>}
+        </select>
+        {newRule.type === "semantic" ? (
+          <>
+            <textarea
+              placeholder="Exemplar phrases, one per line"
+              value={newRule.exemplars}
+              onChange={(e) => setNewRule({ ...newRule, exemplars: e.target.value })}
+            />
+            <input
+              type="number"
+              step="0.05"
+              placeholder="Similarity Threshold"
+              value={newRule.threshold}
+              onChange={(e) => setNewRule({ ...newRule, threshold: e.target.value })}
+            />
+          </>
+        ) : (
+          <input
+            type="text"
+            placeholder={newRule.type === "pii" ? "Kinds: card,email,phone,national_id (empty = any)" : "Regex Pattern"}
+            value={newRule.pattern}
+            onChange={(e) => setNewRule({ ...newRule, pattern: e.target.value })}
+          />
+        )}
         <input
           type="text"
           placeholder="Original Model"
           value={newRule.originalModel}
           onChange={(e) => setNewRule({ ...newRule, originalModel: e.target.value })}
         />
+        {newRule.action === "redirect" && (
+          <input
+            type="text"
+            placeholder="Redirect Model"
+            value={newRule.redirectModel}
+            onChange={(e) => setNewRule({ ...newRule, redirectModel: e.target.value })}
+          />
+        )}
         <input
-          type="text"
-          placeholder="Redirect Model"
-          value={newRule.redirectModel}
-          onChange={(e) => setNewRule({ ...newRule, redirectModel: e.target.value })}
+          type="number"
+          placeholder="Priority (higher runs first)"
+          value={newRule.priority}
+          onChange={(e) => setNewRule({ ...newRule, priority: e.target.value })}
         />
         <button onClick={handleAddRule}>Add Rule</button>
       </div>
@@ -121,15 +218,21 @@ function AdminPanel() {
             <th>Regex Pattern</th>
             <th>Original Model</th>
             <th>Redirect Model</th>
+            <th>Priority</th>
             <th>Actions</th>
           </tr>
         </thead>
         <tbody>
           {regexRules.map((rule) => (
             <tr key={rule.id}>
-              <td>{rule.pattern || "N/A" }</td>
+              <td>
+                {rule.type === "semantic" ? `semantic ≥ ${rule.threshold}`
+                  : rule.type === "pii" ? `pii: ${rule.pattern || "any"}`
+                  : (rule.pattern || "N/A")}
+              </td>
               <td>{rule.originalModel}</td>
-              <td>{rule.redirectModel}</td>
+              <td>{rule.action === "redact" ? "(redact)" : rule.redirectModel}</td>
+              <td>{rule.priority}</td>
               <td>
                 <button onClick={() => handleDeleteRule(rule.id)}>Delete</button>
               </td>
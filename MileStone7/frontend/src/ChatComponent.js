@@ -12,6 +12,7 @@ function ChatCompletion() {
   const [file, setFile] = useState(null); // Added file state
   const [response, setResponse] = useState("");
   const [messages, setMessages] = useState([]); // For chat history
+  const [sessionId, setSessionId] = useState(null); // Server-side conversation, so history is not resent
 
   const navigate = useNavigate(); // Initialize useNavigate
 
@@ -38,7 +39,22 @@ function ChatCompletion() {
     e.preventDefault(); // Prevent page reload
     console.log("Submitting with:", { selectedProvider, selectedModel, prompt, file });
 
+    // Open a server-side session on the first message
+    let currentSession = sessionId;
+    if (!currentSession) {
+        try {
+            const sessionRes = await axios.post("http://localhost:5006/sessions");
+            currentSession = sessionRes.data.session_id;
+            setSessionId(currentSession);
+        } catch (error) {
+            console.error("Error creating session:", error);
+        }
+    }
+
     const formData = new FormData();
+    if (currentSession) {
+        formData.append("session_id", currentSession);
+    }
     formData.append("provider", selectedProvider);
     formData.append("model", selectedModel);
     formData.append("prompt", prompt);
@@ -54,7 +70,8 @@ function ChatCompletion() {
 
     try {
         const res = await axios.post("http://localhost:5006/v1/chat/completions", formData, {
-            headers: { "Content-Type": "multipart/form-data" },
+            // A person is waiting on this one: served ahead of batch jobs when providers are saturated
+            headers: { "Content-Type": "multipart/form-data", "X-Priority": "interactive" },
         });
 
         console.log("Response:", res.data);
@@ -3,6 +3,29 @@ import ReactDOM from 'react-dom/client';
 import './index.css';
 import App from './App';
 import reportWebVitals from './reportWebVitals';
+import axios from 'axios';
+
+// The backend requires an API key (see backend/auth.py); set REACT_APP_API_KEY in frontend/.env.
+// It is compiled into the public bundle: use a chat-scoped key, and an admin-scoped one only for local development.
+if (process.env.REACT_APP_API_KEY) {
+  axios.defaults.headers.common['X-API-Key'] = process.env.REACT_APP_API_KEY;
+}
+
+// Admin writes return a read token; sending the latest one back keeps later reads from
+// being served by a database replica that has not caught up with them yet
+let readToken = null;
+axios.interceptors.response.use((res) => {
+  if (res.data?.read_token) {
+    readToken = res.data.read_token;
+  }
+  return res;
+});
+axios.interceptors.request.use((config) => {
+  if (readToken) {
+    config.headers['X-Read-Token'] = readToken;
+  }
+  return config;
+});
 
 const root = ReactDOM.createRoot(document.getElementById('root'));
 root.render(